@@ -0,0 +1,270 @@
+"""
+Génération en lot de Business Model Canvas, sans Streamlit.
+
+Lit un fichier CSV ou JSONL d'entreprises (une ligne par entreprise) et
+produit un document Word par ligne, ainsi qu'un manifeste JSONL décrivant le
+résultat de chaque ligne. Une relance avec le même dossier de sortie reprend
+le travail là où il s'était arrêté : les lignes déjà produites sont ignorées.
+Une ligne dont des blocs n'ont pas pu être obtenus est écrite mais marquée
+« incomplet » dans le manifeste (blocs manquants et avertissements) : elle
+est retentée à la relance.
+
+Colonnes attendues :
+    nom_entreprise, type_entreprise (PME, Startup, Autre)
+    et, facultativement, les 9 rubriques, nommées comme les champs du
+    formulaire (partenaires_cles, activites_cles, ...) ou comme les rubriques
+    elles-mêmes ("Partenaires clés", ...).
+
+Avec --zip, les documents produits sont en plus réunis dans une archive ZIP,
+écrite document par document depuis le disque.
+
+Exemple :
+    OPENAI_API_KEY=sk-... python batch_bmc.py cohorte.csv --sortie cohorte_bmc --workers 8 --par-minute 30
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import modelbusiness
+
+logger = logging.getLogger("batch_bmc")
+
+NOM_MANIFESTE = "manifeste.jsonl"
+
+
+def lire_entreprises(chemin):
+    """
+    Lit le fichier d'entrée (CSV ou JSONL selon l'extension) et retourne la
+    liste des lignes sous forme de dictionnaires.
+    """
+    with open(chemin, encoding="utf-8-sig", newline="") as fichier:
+        if chemin.lower().endswith((".jsonl", ".ndjson")):
+            return [json.loads(ligne) for ligne in fichier if ligne.strip()]
+        return list(csv.DictReader(fichier))
+
+
+def preparer_ligne(index, ligne):
+    """
+    Normalise une ligne d'entrée : nom, type, rubriques (mêmes clés que le
+    formulaire Streamlit) et identifiant stable utilisé pour la reprise.
+    L'identifiant dépend du contenu : une ligne modifiée est régénérée.
+    """
+    nom_entreprise = (ligne.get("nom_entreprise") or ligne.get("nom") or "").strip()
+    if not nom_entreprise:
+        raise ValueError(f"ligne {index + 1} : colonne 'nom_entreprise' manquante ou vide")
+    type_entreprise = (ligne.get("type_entreprise") or ligne.get("type") or "Autre").strip()
+
+    rubriques = {}
+    for champ, rubrique in modelbusiness.CHAMPS_RUBRIQUES.items():
+        rubriques[rubrique] = (ligne.get(champ) or ligne.get(rubrique) or "").strip()
+
+    empreinte = hashlib.sha256(
+        json.dumps([nom_entreprise, type_entreprise, rubriques], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:12]
+    nom_fichier = re.sub(r"[^\w-]+", "_", nom_entreprise).strip("_")
+    identifiant = f"{index + 1:05d}_{nom_fichier}_{empreinte}"
+
+    return {
+        "id": identifiant,
+        "ligne": index + 1,
+        "nom_entreprise": nom_entreprise,
+        "type_entreprise": type_entreprise,
+        "rubriques": rubriques,
+    }
+
+
+def lignes_terminees(dossier_sortie):
+    """
+    Identifiants des lignes déjà produites avec succès d'après le manifeste
+    (et dont le document existe toujours sur le disque).
+    """
+    return set(documents_produits(dossier_sortie))
+
+
+def documents_produits(dossier_sortie):
+    """
+    Documents produits avec succès d'après le manifeste et toujours présents
+    sur le disque : {identifiant de ligne: nom du fichier}.
+    """
+    chemin_manifeste = os.path.join(dossier_sortie, NOM_MANIFESTE)
+    terminees = {}
+    if not os.path.exists(chemin_manifeste):
+        return terminees
+    with open(chemin_manifeste, encoding="utf-8") as manifeste:
+        for ligne in manifeste:
+            try:
+                entree = json.loads(ligne)
+            except ValueError:
+                continue  # Ligne tronquée par un arrêt brutal
+            if entree.get("statut") == "ok" and os.path.exists(os.path.join(dossier_sortie, entree["fichier"])):
+                terminees[entree["id"]] = entree["fichier"]
+    return terminees
+
+
+def traiter_ligne(entree, dossier_sortie, date_bmc, limiteur):
+    """
+    Génère le contenu (generer_canvas en mode réponse unique : les blocs
+    absents de la réponse sont redemandés) puis le document Word d'une
+    entreprise. Le fichier est écrit sous un nom temporaire puis renommé :
+    un document présent sur le disque est toujours complet. Retourne
+    (fichier, durée, consommation, avertissements par bloc manquant).
+    """
+    debut = time.monotonic()
+    limiteur.acquerir()
+    with modelbusiness.suivre_usage(entree["nom_entreprise"], entree["type_entreprise"], "batch") as usage:
+        contenu_bmc, blocs, avertissements = modelbusiness.generer_canvas(
+            entree["nom_entreprise"], entree["type_entreprise"], entree["rubriques"], modelbusiness.MODE_STANDARD
+        )
+    if not contenu_bmc:
+        raise RuntimeError("génération vide (voir le journal pour l'erreur de l'API)")
+
+    nom_fichier = f"BMC_{entree['id']}.docx"
+    chemin = os.path.join(dossier_sortie, nom_fichier)
+    # Document écrit directement dans le fichier, sans copie en mémoire
+    with open(chemin + ".tmp", "wb") as fichier:
+        modelbusiness.generer_docx_business_model(
+            nom_entreprise=entree["nom_entreprise"],
+            date_bmc=date_bmc,
+            contenu_business_model=contenu_bmc,
+            blocs=blocs,
+            fichier=fichier
+        )
+    os.replace(chemin + ".tmp", chemin)
+    return nom_fichier, time.monotonic() - debut, usage, avertissements
+
+
+def ecrire_manifeste(manifeste, resultat):
+    """
+    Ajoute une ligne au manifeste, forcée sur disque pour survivre à un
+    arrêt brutal.
+    """
+    manifeste.write(json.dumps(resultat, ensure_ascii=False) + "\n")
+    manifeste.flush()
+    os.fsync(manifeste.fileno())
+
+
+def executer_batch(chemin_entree, dossier_sortie, workers=4, par_minute=20, date_bmc=None):
+    """
+    Traite toutes les lignes non encore produites du fichier d'entrée et
+    complète le manifeste au fil de l'eau ; une ligne invalide (sans nom
+    d'entreprise) y est notée « rejetee » sans interrompre le lot. Retourne
+    le nombre de lignes en échec ou rejetées.
+    """
+    os.makedirs(dossier_sortie, exist_ok=True)
+    date_bmc = date_bmc or datetime.date.today().strftime("%d %B %Y")
+
+    # Une ligne invalide est rejetée seule : les autres sont traitées
+    entrees, rejets = [], []
+    for index, ligne in enumerate(lire_entreprises(chemin_entree)):
+        try:
+            entrees.append(preparer_ligne(index, ligne))
+        except ValueError as e:
+            rejets.append({
+                "id": None,
+                "ligne": index + 1,
+                "horodatage": datetime.datetime.now().isoformat(timespec="seconds"),
+                "statut": "rejetee",
+                "erreur": str(e),
+            })
+            logger.error("REJET  %s", e)
+    terminees = lignes_terminees(dossier_sortie)
+    a_traiter = [entree for entree in entrees if entree["id"] not in terminees]
+    logger.info("%d ligne(s), %d rejetée(s), %d déjà produite(s), %d à traiter",
+                len(entrees) + len(rejets), len(rejets), len(entrees) - len(a_traiter), len(a_traiter))
+
+    # Au plus une génération lancée tous les 60 / par_minute secondes
+    limiteur = modelbusiness.SeauJetons(par_minute, capacite=1)
+    echecs = len(rejets)
+    chemin_manifeste = os.path.join(dossier_sortie, NOM_MANIFESTE)
+    with open(chemin_manifeste, "a", encoding="utf-8") as manifeste, \
+            ThreadPoolExecutor(max_workers=workers) as executeur:
+        for resultat in rejets:
+            ecrire_manifeste(manifeste, resultat)
+        futures = {
+            executeur.submit(traiter_ligne, entree, dossier_sortie, date_bmc, limiteur): entree
+            for entree in a_traiter
+        }
+        for future in as_completed(futures):
+            entree = futures[future]
+            resultat = {
+                "id": entree["id"],
+                "ligne": entree["ligne"],
+                "nom_entreprise": entree["nom_entreprise"],
+                "type_entreprise": entree["type_entreprise"],
+                "horodatage": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+            try:
+                nom_fichier, duree, usage, avertissements = future.result()
+                resultat.update(
+                    statut="ok", fichier=nom_fichier, duree=round(duree, 2),
+                    prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"],
+                    cout_usd=usage["cout_usd"], reessais=usage["reessais"], etapes=usage["etapes"]
+                )
+                if avertissements:
+                    # Document écrit avec des cellules vides : non compté comme
+                    # produit, la ligne sera retentée à la prochaine relance
+                    resultat.update(statut="incomplet", blocs_manquants=list(avertissements),
+                                    avertissements=list(avertissements.values()))
+                    logger.warning("INCOMPLET %s : %d bloc(s) manquant(s)", entree["nom_entreprise"], len(avertissements))
+                else:
+                    logger.info("OK     %s (%.1f s)", entree["nom_entreprise"], duree)
+            except Exception as e:
+                echecs += 1
+                resultat.update(statut="erreur", erreur=str(e))
+                logger.error("ECHEC  %s : %s", entree["nom_entreprise"], e)
+            # Le manifeste est écrit par ce seul thread
+            ecrire_manifeste(manifeste, resultat)
+
+    modelbusiness.ecrire_metriques()
+    return echecs
+
+
+def archiver_documents(dossier_sortie, chemin_zip):
+    """
+    Réunit dans une archive ZIP tous les documents produits avec succès
+    (d'après le manifeste). Chaque document est copié par blocs depuis le
+    disque : la mémoire utilisée ne dépend pas de la taille du lot.
+    L'archive est écrite sous un nom temporaire puis renommée.
+    Retourne le nombre de documents archivés.
+    """
+    documents = documents_produits(dossier_sortie)
+    # Les documents Word sont déjà compressés : stockés tels quels
+    with zipfile.ZipFile(chemin_zip + ".tmp", "w", compression=zipfile.ZIP_STORED) as archive:
+        for nom_fichier in sorted(documents.values()):
+            archive.write(os.path.join(dossier_sortie, nom_fichier), nom_fichier)
+    os.replace(chemin_zip + ".tmp", chemin_zip)
+    return len(documents)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Génère un Business Model Canvas (Word) pour chaque entreprise d'un fichier CSV ou JSONL."
+    )
+    parser.add_argument("entree", help="fichier CSV ou JSONL des entreprises")
+    parser.add_argument("--sortie", default="sorties_bmc", help="dossier des documents et du manifeste")
+    parser.add_argument("--workers", type=int, default=4, help="nombre de générations simultanées")
+    parser.add_argument("--par-minute", type=float, default=20,
+                        help="nombre maximal de générations lancées par minute (0 = illimité)")
+    parser.add_argument("--date", help="date affichée dans les documents (par défaut : aujourd'hui)")
+    parser.add_argument("--zip", help="archive ZIP à produire avec tous les documents du dossier de sortie")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    echecs = executer_batch(args.entree, args.sortie, args.workers, args.par_minute, args.date)
+    if args.zip:
+        nombre = archiver_documents(args.sortie, args.zip)
+        logger.info("%d document(s) archivé(s) dans %s", nombre, args.zip)
+    return 1 if echecs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
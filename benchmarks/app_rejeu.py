@@ -0,0 +1,26 @@
+"""
+Application lancée par le test de charge (bench_charge.py) :
+    streamlit run benchmarks/app_rejeu.py
+
+Installe pour tout le processus le rejeu local de llm_rejeu.py à la place de
+l'API OpenAI (paramètres : voir llm_rejeu.rejeu_environnement), puis exécute
+modelbusiness.py comme script principal, à chaque réexécution, comme le
+ferait « streamlit run modelbusiness.py ».
+"""
+import os
+import runpy
+import sys
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+RACINE = os.path.dirname(BENCHMARKS)
+for chemin in (RACINE, BENCHMARKS):
+    if chemin not in sys.path:
+        sys.path.insert(0, chemin)
+
+import modelbusiness  # noqa: E402
+from llm_rejeu import rejeu_environnement  # noqa: E402
+
+# Un seul rejeu par processus : sa limite de requêtes vaut pour toutes les sessions
+modelbusiness.definir_backend_llm(rejeu_environnement().creer)
+
+runpy.run_path(os.path.join(RACINE, "modelbusiness.py"), run_name="__main__")
@@ -0,0 +1,447 @@
+"""
+Test de charge de l'application servie par Streamlit : N navigateurs simulés
+parcourent le déroulé de main() (chargement de la page, formulaire, clic sur
+« Générer », suivi de la génération jusqu'au résultat, téléchargement de
+l'export) sur un vrai serveur « streamlit run » lancé pour l'occasion, l'API
+OpenAI étant remplacée par le rejeu local de llm_rejeu.py (latence, débit et
+limite de requêtes configurables, voir app_rejeu.py).
+
+Chaque session ouvre sa connexion websocket (/_stcore/stream) et dialogue
+avec le serveur comme le navigateur (protocole de Streamlit, BackMsg et
+ForwardMsg) : sessions et threads de script de Streamlit, relances du suivi
+(st.experimental_rerun), file de tâches, travailleurs (BMC_WORKERS_TACHES),
+cache, générations partagées et limites de débit de l'application
+(BMC_LIMITE_RPM, BMC_LIMITE_TPM ; désactivées par défaut ici) sont donc tous
+sollicités. Chaque utilisateur simulé a son identité (en-tête
+ENTETE_UTILISATEUR) : l'ordonnancement équitable s'applique.
+
+Pour chaque niveau de concurrence :
+  - latence (p50, p95, p99) du chargement de la page, du clic jusqu'au
+    résultat affiché, et du téléchargement ; attente dans la file et durée
+    de génération (p95), lues dans la file de tâches du serveur ;
+  - débit en sessions par seconde et taux d'erreur ;
+  - pic de mémoire (RSS) et de threads du processus serveur (/proc, Linux).
+
+Usage :
+    python benchmarks/bench_charge.py [--concurrences 1 10 50] [--sessions 5] [--mode parallele]
+        [--format docx] [--latence 2 --gigue 0.2 --debit 80] [--limite-rpm-api 500]
+        [--doublons 0.2] [--sortie resultats.json]
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+# Cache, journal, métriques, file de tâches, index et verrous du serveur dans
+# un dossier jetable ; pas de limite de débit côté client ni de quota par
+# utilisateur, et pas de reprise de canvas proches (chaque session est une
+# génération)
+_DOSSIER = tempfile.mkdtemp(prefix="charge_bmc_")
+atexit.register(shutil.rmtree, _DOSSIER, ignore_errors=True)
+os.environ.setdefault("BMC_CACHE_CHEMIN", os.path.join(_DOSSIER, "generations.sqlite3"))
+os.environ.setdefault("BMC_JOURNAL_USAGE", os.path.join(_DOSSIER, "usage.jsonl"))
+os.environ.setdefault("BMC_METRIQUES_CHEMIN", os.path.join(_DOSSIER, "metriques.prom"))
+os.environ.setdefault("BMC_TACHES_CHEMIN", os.path.join(_DOSSIER, "taches.sqlite3"))
+os.environ.setdefault("BMC_INDEX_CANVAS_CHEMIN", os.path.join(_DOSSIER, "canvas.sqlite3"))
+os.environ.setdefault("BMC_VERROUS_CHEMIN", os.path.join(_DOSSIER, "verrous"))
+os.environ.setdefault("BMC_LIMITE_RPM", "0")
+os.environ.setdefault("BMC_LIMITE_TPM", "0")
+os.environ.setdefault("BMC_QUOTA_GENERATIONS_JOUR", "0")
+os.environ.setdefault("BMC_CANVAS_PROCHES", "0")
+
+import modelbusiness  # noqa: E402
+
+APPLICATION = os.path.join(RACINE, "benchmarks", "app_rejeu.py")
+
+MODES = {
+    "standard": modelbusiness.MODE_STANDARD,
+    "flux": modelbusiness.MODE_FLUX,
+    "parallele": modelbusiness.MODE_PARALLELE,
+    "json": modelbusiness.MODE_JSON,
+}
+
+# Saisie du formulaire commune à toutes les sessions (seul le nom change),
+# par clé des zones de texte de main()
+SAISIE = {
+    "partenaires_cles": "Fournisseurs locaux\nTransporteurs",
+    "activites_cles": "Production, vente en ligne",
+    "offre_valeur": "Produits artisanaux livrés en 48 h",
+    "segments_clientele": "Particuliers urbains",
+    "ressources_cles": "Atelier, site marchand",
+    "canaux_distribution": "Site web, marchés",
+    "structure_couts": "Matières premières, salaires",
+    "sources_revenus": "Ventes directes, abonnements",
+}
+BOUTON_GENERER = "Générer le Business Model Canvas"
+
+
+def centile(valeurs, p):
+    """
+    Centile 'p' (0-100) par rang le plus proche.
+    """
+    if not valeurs:
+        return 0.0
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, max(0, round(p / 100 * len(valeurs)) - 1))]
+
+
+class Serveur:
+    """
+    Serveur « streamlit run app_rejeu.py » lancé sur un port libre, avec
+    les paramètres du rejeu ; sa sortie est écrite dans _DOSSIER/serveur.log.
+    """
+
+    def __init__(self, args):
+        with socket.socket() as sonde:
+            sonde.bind(("127.0.0.1", 0))
+            self.port = sonde.getsockname()[1]
+        self.url = f"127.0.0.1:{self.port}"
+        environnement = dict(
+            os.environ,
+            BMC_REJEU_LATENCE=str(args.latence), BMC_REJEU_GIGUE=str(args.gigue),
+            BMC_REJEU_DEBIT=str(args.debit), BMC_REJEU_TAILLE_MORCEAU=str(args.taille_morceau),
+            BMC_REJEU_LIMITE_RPM=str(args.limite_rpm_api),
+        )
+        self.journal = os.path.join(_DOSSIER, "serveur.log")
+        with open(self.journal, "w") as journal:
+            self.processus = subprocess.Popen(
+                [sys.executable, "-m", "streamlit", "run", APPLICATION,
+                 "--server.headless", "true", "--server.address", "127.0.0.1", "--server.port", str(self.port),
+                 "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+                env=environnement, stdout=journal, stderr=subprocess.STDOUT
+            )
+        atexit.register(self.arreter)
+
+    async def attendre(self, delai=60.0):
+        from tornado.httpclient import AsyncHTTPClient
+
+        limite = time.monotonic() + delai
+        while time.monotonic() < limite:
+            if self.processus.poll() is not None:
+                break
+            try:
+                await AsyncHTTPClient().fetch(f"http://{self.url}/_stcore/health")
+                return
+            except (OSError, Exception):
+                await asyncio.sleep(0.2)
+        with open(self.journal) as journal:
+            raise RuntimeError(f"serveur Streamlit indisponible :\n{journal.read()[-2000:]}")
+
+    def releve(self):
+        """
+        (RSS en Mo, nombre de threads) du processus serveur, ou (0, 0) hors Linux.
+        """
+        try:
+            with open(f"/proc/{self.processus.pid}/status") as statut:
+                champs = dict(ligne.split(":", 1) for ligne in statut if ":" in ligne)
+            return int(champs["VmRSS"].split()[0]) / 1024, int(champs["Threads"])
+        except (OSError, KeyError, ValueError):
+            return 0.0, 0
+
+    def arreter(self):
+        if self.processus.poll() is None:
+            self.processus.terminate()
+            try:
+                self.processus.wait(10)
+            except subprocess.TimeoutExpired:
+                self.processus.kill()
+
+
+class Navigateur:
+    """
+    Session de l'application vue par le navigateur : connexion websocket au
+    serveur, exécutions du script avec l'état des widgets, éléments affichés
+    par la dernière exécution.
+    """
+
+    def __init__(self, serveur, utilisateur):
+        self.serveur = serveur
+        self.utilisateur = utilisateur
+        self.connexion = None
+        self.etats = {}      # id du widget -> WidgetState envoyé à chaque exécution
+        self.elements = []   # (type, proto) de l'exécution en cours
+        self.messages = {}   # Messages en cache chez le client (références ref_hash)
+
+    async def ouvrir(self):
+        from tornado.httpclient import HTTPRequest
+        from tornado.websocket import websocket_connect
+
+        self.connexion = await websocket_connect(HTTPRequest(
+            f"ws://{self.serveur.url}/_stcore/stream",
+            headers={modelbusiness.ENTETE_UTILISATEUR: self.utilisateur}
+        ))
+
+    def fermer(self):
+        if self.connexion is not None:
+            self.connexion.close()
+
+    def widget(self, type_element, libelle=None, cle=None):
+        for type_trouve, proto in self.elements:
+            if type_trouve == type_element and (libelle is None or proto.label == libelle) \
+                    and (cle is None or proto.id.endswith(f"-{cle}")):
+                return proto
+        raise LookupError(f"widget {type_element} « {libelle or cle} » absent de la page")
+
+    def definir(self, proto, **valeur):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        self.etats[proto.id] = WidgetState(id=proto.id, **valeur)
+
+    async def executer(self, declencheur=None):
+        """
+        Demande une exécution du script (clic sur le bouton 'declencheur'
+        éventuel) et lit les messages jusqu'à la fin de la dernière
+        exécution : celles qu'enchaîne st.experimental_rerun comprises.
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        demande = BackMsg()
+        demande.rerun_script.query_string = ""
+        demande.rerun_script.widget_states.widgets.extend(self.etats.values())
+        if declencheur is not None:
+            demande.rerun_script.widget_states.widgets.append(WidgetState(id=declencheur.id, trigger_value=True))
+        await self.connexion.write_message(demande.SerializeToString(), binary=True)
+
+        while True:
+            donnees = await self.connexion.read_message()
+            if donnees is None:
+                raise ConnectionError("connexion fermée par le serveur")
+            message = ForwardMsg()
+            message.ParseFromString(donnees)
+            if message.WhichOneof("type") == "ref_hash":
+                message = await self._message_reference(message.ref_hash)
+            elif message.metadata.cacheable:
+                self.messages[message.hash] = message
+
+            genre = message.WhichOneof("type")
+            if genre == "new_session":
+                self.elements = []
+            elif genre == "delta" and message.delta.WhichOneof("type") == "new_element":
+                element = message.delta.new_element
+                type_element = element.WhichOneof("type")
+                self.elements.append((type_element, getattr(element, type_element)))
+            elif genre == "script_finished" and message.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    async def _message_reference(self, empreinte):
+        # Message déjà reçu, sinon demandé au serveur comme le fait le navigateur
+        if empreinte not in self.messages:
+            from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+            from tornado.httpclient import AsyncHTTPClient
+
+            reponse = await AsyncHTTPClient().fetch(f"http://{self.serveur.url}/_stcore/message?hash={empreinte}")
+            message = ForwardMsg()
+            message.ParseFromString(reponse.body)
+            self.messages[empreinte] = message
+        return self.messages[empreinte]
+
+    def erreurs(self):
+        """
+        Messages d'erreur affichés par la dernière exécution (st.error,
+        avertissement de refus, exception du script).
+        """
+        from streamlit.proto.Alert_pb2 import Alert
+
+        textes = []
+        for type_element, proto in self.elements:
+            if type_element == "alert" and (proto.format == Alert.ERROR or "refusée" in proto.body):
+                textes.append(proto.body)
+            elif type_element == "exception":
+                textes.append(f"{proto.type}: {proto.message}")
+        return textes
+
+    async def telecharger(self, url):
+        from tornado.httpclient import AsyncHTTPClient
+
+        reponse = await AsyncHTTPClient().fetch(f"http://{self.serveur.url}{url}")
+        return reponse.body
+
+
+async def session_navigateur(serveur, utilisateur, nom_entreprise, args):
+    """
+    Déroulé d'une session de l'application dans un navigateur ; retourne ses
+    mesures (secondes). Lève une exception si une étape échoue.
+    """
+    navigateur = Navigateur(serveur, utilisateur)
+    try:
+        # Chargement de la page
+        debut = time.perf_counter()
+        await navigateur.ouvrir()
+        await navigateur.executer()
+        chargement = time.perf_counter() - debut
+
+        # Saisie du formulaire, choix du mode, clic sur « Générer »
+        navigateur.definir(navigateur.widget("text_input", "Nom de l'entreprise"), string_value=nom_entreprise)
+        for cle, texte in SAISIE.items():
+            navigateur.definir(navigateur.widget("text_area", cle=cle), string_value=texte)
+        radio = navigateur.widget("radio", "Mode de génération")
+        navigateur.definir(radio, int_value=list(radio.options).index(MODES[args.mode]))
+        debut_generation = time.perf_counter()
+        await navigateur.executer(declencheur=navigateur.widget("button", BOUTON_GENERER))
+        erreurs = navigateur.erreurs()
+        if erreurs:
+            raise RuntimeError(erreurs[0])
+        generation = time.perf_counter() - debut_generation
+
+        # Choix du format puis téléchargement
+        debut_telechargement = time.perf_counter()
+        libelle = modelbusiness.FORMATS_EXPORT[args.format][0]
+        choix = navigateur.widget("selectbox", cle="format_export")
+        if choix.default != list(choix.options).index(libelle):
+            navigateur.definir(choix, int_value=list(choix.options).index(libelle))
+            await navigateur.executer()
+        bouton = navigateur.widget("download_button", f"Télécharger le Business Model Canvas ({libelle})")
+        if not await navigateur.telecharger(bouton.url):
+            raise RuntimeError("téléchargement vide")
+        return {
+            "chargement": chargement,
+            "generation": generation,
+            "telechargement": time.perf_counter() - debut_telechargement,
+        }
+    finally:
+        navigateur.fermer()
+
+
+def duree_taches(prefixe):
+    """
+    Attente dans la file et durée d'exécution (secondes) des tâches terminées
+    des utilisateurs 'prefixe*', lues dans la file de tâches du serveur.
+    """
+    with sqlite3.connect(modelbusiness.TACHES_CHEMIN) as connexion:
+        return connexion.execute(
+            "SELECT debut - cree, fin - debut FROM taches WHERE statut = 'terminee' AND utilisateur LIKE ?",
+            (f"{prefixe}%",)
+        ).fetchall()
+
+
+async def executer_niveau(serveur, concurrence, args):
+    """
+    Fait tourner 'concurrence' utilisateurs simultanés, chacun enchaînant
+    args.sessions sessions, et retourne le résumé du niveau.
+    """
+    prefixe = f"charge-{concurrence}-"
+
+    async def utilisateur_simule(numero):
+        # Une part 'doublons' des sessions demande un canvas déjà demandé
+        # (entreprises « populaires ») : cache et générations partagées
+        hasard = random.Random(f"{concurrence}-{numero}")
+        mesures, erreurs = [], []
+        for session in range(args.sessions):
+            if hasard.random() < args.doublons:
+                nom_entreprise = f"Populaire {concurrence}-{hasard.randrange(5)}"
+            else:
+                nom_entreprise = f"Entreprise {concurrence}-{numero}-{session}"
+            try:
+                mesures.append(await asyncio.wait_for(
+                    session_navigateur(serveur, f"{prefixe}{numero}", nom_entreprise, args), args.delai
+                ))
+            except asyncio.TimeoutError:
+                erreurs.append(f"TimeoutError: session non terminée après {args.delai:.0f} s")
+            except Exception as e:
+                erreurs.append(f"{type(e).__name__}: {e}")
+        return mesures, erreurs
+
+    releves = []
+
+    async def echantillonner():
+        while True:
+            releves.append(serveur.releve())
+            await asyncio.sleep(0.1)
+
+    echantillons = asyncio.ensure_future(echantillonner())
+    debut = time.perf_counter()
+    resultats = await asyncio.gather(*(utilisateur_simule(numero) for numero in range(concurrence)))
+    duree = time.perf_counter() - debut
+    echantillons.cancel()
+
+    mesures = [mesure for mesures_utilisateur, _ in resultats for mesure in mesures_utilisateur]
+    erreurs = [erreur for _, erreurs_utilisateur in resultats for erreur in erreurs_utilisateur]
+    nombre = len(mesures) + len(erreurs)
+    resume = {
+        "concurrence": concurrence,
+        "sessions": nombre,
+        "duree": duree,
+        "debit": len(mesures) / duree,
+        "taux_erreur": len(erreurs) / nombre if nombre else 0.0,
+        "erreurs": sorted(set(erreurs))[:10],
+        "rss_max_mo": max(rss for rss, _ in releves),
+        "threads_max": max(threads for _, threads in releves),
+    }
+    for etape in ("chargement", "generation", "telechargement"):
+        valeurs = [mesure[etape] * 1000 for mesure in mesures]
+        for p in (50, 95, 99):
+            resume[f"{etape}_p{p}_ms"] = centile(valeurs, p)
+    taches = duree_taches(prefixe)
+    resume["file_p95_ms"] = centile([attente * 1000 for attente, _ in taches], 95)
+    resume["execution_p95_ms"] = centile([execution * 1000 for _, execution in taches], 95)
+    return resume
+
+
+async def executer(args):
+    serveur = Serveur(args)
+    try:
+        await serveur.attendre()
+        # Échauffement (imports, travailleurs, modèles d'export en cache)
+        await session_navigateur(serveur, "charge-echauffement", "Échauffement", args)
+        return [await executer_niveau(serveur, concurrence, args) for concurrence in args.concurrences]
+    finally:
+        serveur.arreter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrences", type=int, nargs="+", default=[1, 10, 50],
+                        help="nombres d'utilisateurs simultanés")
+    parser.add_argument("--sessions", type=int, default=5, help="sessions enchaînées par utilisateur")
+    parser.add_argument("--mode", choices=list(MODES), default="standard")
+    parser.add_argument("--format", choices=list(modelbusiness.FORMATS_EXPORT), default="docx",
+                        help="format téléchargé")
+    parser.add_argument("--latence", type=float, default=2.0, help="secondes avant le premier token")
+    parser.add_argument("--gigue", type=float, default=0.2, help="variation de la latence (fraction)")
+    parser.add_argument("--debit", type=float, default=0.0, help="tokens générés par seconde (0 = instantané)")
+    parser.add_argument("--taille-morceau", type=int, default=16, help="caractères par morceau en flux")
+    parser.add_argument("--limite-rpm-api", type=int, default=0,
+                        help="requêtes par minute acceptées par l'API simulée (0 = illimité)")
+    parser.add_argument("--doublons", type=float, default=0.0,
+                        help="part des sessions qui redemandent un canvas déjà demandé")
+    parser.add_argument("--delai", type=float, default=300.0, help="abandon d'une session après ce délai (s)")
+    parser.add_argument("--sortie", help="fichier JSON des résultats (suivi des régressions)")
+    args = parser.parse_args()
+
+    resultats = asyncio.run(executer(args))
+
+    print(f"mode {args.mode}, export {args.format}, {modelbusiness.WORKERS_TACHES} travailleurs, "
+          f"latence {args.latence} s ±{args.gigue:.0%}, débit {args.debit or '∞'} tokens/s, "
+          f"API {args.limite_rpm_api or '∞'} req/min\n")
+    print(f"{'users':>6}{'sessions':>9}{'sess/s':>8}{'page p95':>10}{'résultat p50':>14}{'p95':>8}{'p99':>8}"
+          f"{'file p95':>10}{'exéc. p95':>11}{'téléch. p95':>13}{'erreurs':>9}{'RSS max':>9}{'threads':>9}")
+    for r in resultats:
+        print(f"{r['concurrence']:>6}{r['sessions']:>9}{r['debit']:>8.2f}{r['chargement_p95_ms']:>7.0f} ms"
+              f"{r['generation_p50_ms'] / 1000:>13.1f}s{r['generation_p95_ms'] / 1000:>7.1f}s"
+              f"{r['generation_p99_ms'] / 1000:>7.1f}s{r['file_p95_ms'] / 1000:>9.1f}s"
+              f"{r['execution_p95_ms'] / 1000:>10.1f}s{r['telechargement_p95_ms']:>10.0f} ms"
+              f"{r['taux_erreur']:>9.1%}{r['rss_max_mo']:>6.0f} Mo{r['threads_max']:>9}")
+        for erreur in r["erreurs"]:
+            print(f"{'':>6}erreur : {erreur}")
+
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as fichier:
+            json.dump({"parametres": vars(args), "resultats": resultats}, fichier, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
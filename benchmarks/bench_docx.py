@@ -0,0 +1,100 @@
+"""
+Comparaison du rendu Word : modèle en cache contre construction complète.
+
+  - "modèle"    : generer_docx_business_model (document chargé depuis le
+    modèle en cache, seul le texte est ajouté) ;
+  - "référence" : generer_docx_business_model tel qu'il était avant le modèle
+    en cache, lu dans l'historique git (révision --reference) : construction
+    du document, styles et fusions à chaque export, puis réinitialisation de
+    la police de chaque run du tableau.
+
+Mesure le temps moyen par document et le pic de mémoire allouée pendant un
+rendu (tracemalloc), pour une réponse enregistrée de benchmarks/reponses.
+
+Usage :
+    python benchmarks/bench_docx.py [--documents 200] [--reference c40bd8e^]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+import modelbusiness  # noqa: E402
+
+REPONSE = os.path.join(RACINE, "benchmarks", "reponses", "coiffure_mobile_pme.html")
+# Dernière révision avant le rendu depuis le modèle en cache
+REVISION_REFERENCE = "c40bd8e^"
+
+
+def charger_reference(revision):
+    """
+    Module modelbusiness.py de la révision git 'revision', chargé à côté du
+    module actuel sous le nom modelbusiness_reference.
+    """
+    source = subprocess.run(
+        ["git", "-C", RACINE, "show", f"{revision}:modelbusiness.py"],
+        capture_output=True, text=True, check=True
+    ).stdout
+    module = types.ModuleType("modelbusiness_reference")
+    module.__file__ = os.path.join(RACINE, "modelbusiness.py")
+    exec(compile(source, f"modelbusiness.py@{revision}", "exec"), module.__dict__)
+    return module
+
+
+def mesurer(rendu, documents):
+    """
+    Retourne (ms par document, pic de mémoire allouée par document en Ko).
+    """
+    rendu()  # Échauffement (imports, modèle en cache)
+    debut = time.perf_counter()
+    for _ in range(documents):
+        rendu()
+    duree = (time.perf_counter() - debut) / documents
+
+    # Pic d'allocation pendant un rendu, mesuré séparément (tracemalloc
+    # ralentit fortement l'exécution)
+    tracemalloc.start()
+    pic = 0
+    for _ in range(max(1, documents // 10)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        rendu()
+        pic = max(pic, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return duree * 1000, pic / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--reference", default=REVISION_REFERENCE,
+                        help="révision git du rendu de référence (avant le modèle en cache)")
+    args = parser.parse_args()
+    reference = charger_reference(args.reference)
+
+    with open(REPONSE, encoding="utf-8") as fichier:
+        blocs = modelbusiness.extraire_blocs(fichier.read())
+    nom, date_bmc = "COIFFURE MOBILE S.a.r.l", "18 octobre 2026"
+
+    rendus = {
+        "modèle": lambda: modelbusiness.generer_docx_business_model(nom, date_bmc, "", blocs=blocs),
+        "référence": lambda: reference.generer_docx_business_model(nom, date_bmc, "", blocs=blocs),
+    }
+    resultats = {nom_rendu: mesurer(rendu, args.documents) for nom_rendu, rendu in rendus.items()}
+
+    print(f"{'rendu':<10}{'ms/doc':>10}{'pic alloué/doc (Ko)':>22}")
+    for nom_rendu, (ms, pic) in resultats.items():
+        print(f"{nom_rendu:<10}{ms:>10.2f}{pic:>22.1f}")
+    gain = resultats["référence"][0] / resultats["modèle"][0]
+    print(f"\nRendu depuis le modèle {gain:.1f}x plus rapide que le rendu de {args.reference} "
+          f"({args.documents} documents).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Mesure du temps d'import à froid de modelbusiness.
+
+Chaque mesure lance un interpréteur Python neuf (aucun module en cache) et
+chronomètre l'import. Deux scénarios sont comparés :
+  - "paresseux" : import de modelbusiness seul (dépendances chargées à la
+    première utilisation) ;
+  - "immédiat"  : import préalable de streamlit, openai, docx et bs4, comme le
+    faisait le module lorsque ces dépendances étaient importées en tête.
+
+Usage :
+    python benchmarks/bench_import.py [--repetitions 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "paresseux": "import modelbusiness",
+    "immédiat": "import streamlit, openai, docx, bs4; import modelbusiness",
+}
+
+CHRONO = """
+import time
+debut = time.perf_counter()
+{code}
+print(time.perf_counter() - debut)
+"""
+
+
+def mesurer(code, repetitions):
+    """
+    Durées d'import (secondes) mesurées dans 'repetitions' interpréteurs neufs.
+    """
+    durees = []
+    for _ in range(repetitions):
+        sortie = subprocess.run(
+            [sys.executable, "-c", CHRONO.format(code=code)],
+            cwd=RACINE, capture_output=True, text=True, check=True
+        ).stdout
+        durees.append(float(sortie.strip().splitlines()[-1]))
+    return durees
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repetitions", type=int, default=10)
+    args = parser.parse_args()
+
+    # Un premier lancement à blanc remplit le cache disque du système
+    mesurer(SCENARIOS["immédiat"], 1)
+
+    resultats = {nom: mesurer(code, args.repetitions) for nom, code in SCENARIOS.items()}
+    print(f"{'scénario':<12}{'médiane (ms)':>14}{'min (ms)':>12}{'max (ms)':>12}")
+    for nom, durees in resultats.items():
+        print(f"{nom:<12}{statistics.median(durees) * 1000:>14.1f}"
+              f"{min(durees) * 1000:>12.1f}{max(durees) * 1000:>12.1f}")
+    gain = statistics.median(resultats["immédiat"]) / statistics.median(resultats["paresseux"])
+    print(f"\nImport paresseux {gain:.0f}x plus rapide que l'import immédiat des dépendances.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Banc d'essai hors ligne de la chaîne complète : génération (API OpenAI
+remplacée par le rejeu de benchmarks/reponses, voir llm_rejeu.py), analyse
+du HTML et rendu Word, pour 1, 10 et 1000 canvas.
+
+Pour chaque série, mesure la latence de bout en bout d'un canvas, la durée
+de l'appel (simulé), de l'extraction des blocs et du rendu Word (médiane et
+95e centile), le débit en canvas par seconde et la mémoire (RSS maximal du
+processus ; pic alloué par canvas avec --tracemalloc).
+Sans latence simulée (par défaut), les temps mesurés sont ceux du code de
+l'application : une régression de l'extraction ou du rendu s'y voit.
+
+Usage :
+    python benchmarks/bench_pipeline.py [--nombres 1 10 1000] [--mode parallele]
+        [--workers 8] [--latence 0.5 --debit 80 --taille-morceau 16] [--sortie resultats.json]
+"""
+import argparse
+import atexit
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+# Cache, journal, métriques et file de tâches dans un dossier jetable ;
+# pas de limite de débit côté client (aucune API réelle derrière)
+_DOSSIER = tempfile.mkdtemp(prefix="bench_bmc_")
+atexit.register(shutil.rmtree, _DOSSIER, ignore_errors=True)
+os.environ.setdefault("BMC_CACHE_CHEMIN", os.path.join(_DOSSIER, "generations.sqlite3"))
+os.environ.setdefault("BMC_JOURNAL_USAGE", os.path.join(_DOSSIER, "usage.jsonl"))
+os.environ.setdefault("BMC_METRIQUES_CHEMIN", os.path.join(_DOSSIER, "metriques.prom"))
+os.environ.setdefault("BMC_TACHES_CHEMIN", os.path.join(_DOSSIER, "taches.sqlite3"))
+os.environ.setdefault("BMC_LIMITE_RPM", "0")
+os.environ.setdefault("BMC_LIMITE_TPM", "0")
+
+import modelbusiness  # noqa: E402
+from llm_rejeu import LLMRejoue  # noqa: E402
+
+MODES = {
+    "standard": modelbusiness.MODE_STANDARD,
+    "flux": modelbusiness.MODE_FLUX,
+    "parallele": modelbusiness.MODE_PARALLELE,
+    "json": modelbusiness.MODE_JSON,
+}
+
+
+def centile(valeurs, p):
+    """
+    Centile 'p' (0-100) par rang le plus proche.
+    """
+    if not valeurs:
+        return 0.0
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, max(0, round(p / 100 * len(valeurs)) - 1))]
+
+
+def generer_un_canvas(index, mode):
+    """
+    Génère, analyse et rend un canvas ; retourne ses mesures (secondes).
+    Chaque canvas a son propre nom : aucun n'est servi par le cache.
+    """
+    nom_entreprise = f"Entreprise {index}"
+    debut = time.perf_counter()
+    with modelbusiness.suivre_usage(nom_entreprise, "PME", f"bench_{mode}") as usage:
+        contenu_bmc, blocs, _ = modelbusiness.generer_canvas(
+            nom_entreprise, "PME", {}, MODES[mode], regenerer=True
+        )
+        if not contenu_bmc:
+            raise RuntimeError(f"génération vide pour {nom_entreprise}")
+        modelbusiness.rendu_docx(nom_entreprise, "18 octobre 2026", blocs)
+    etapes = usage["etapes"]
+    return {
+        "total": time.perf_counter() - debut,
+        "api": etapes.get("api", 0.0),
+        "extraction": etapes.get("extraction", 0.0),
+        "rendu_docx": etapes.get("rendu_docx", 0.0),
+    }
+
+
+def executer_serie(nombre, mode, workers, avec_tracemalloc):
+    """
+    Génère 'nombre' canvas avec 'workers' générations simultanées et
+    retourne le résumé de la série.
+    """
+    if avec_tracemalloc:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executeur:
+        mesures = list(executeur.map(lambda index: generer_un_canvas(index, mode), range(nombre)))
+    duree = time.perf_counter() - debut
+    pic_alloue = None
+    if avec_tracemalloc:
+        pic_alloue = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    resume = {"nombre": nombre, "duree": duree, "debit": nombre / duree}
+    for etape in ("total", "api", "extraction", "rendu_docx"):
+        valeurs = [mesure[etape] * 1000 for mesure in mesures]
+        resume[f"{etape}_p50_ms"] = centile(valeurs, 50)
+        resume[f"{etape}_p95_ms"] = centile(valeurs, 95)
+    # ru_maxrss est en Ko sous Linux
+    resume["rss_max_mo"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    resume["pic_alloue_mo"] = pic_alloue
+    return resume
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nombres", type=int, nargs="+", default=[1, 10, 1000],
+                        help="tailles des séries (nombre de canvas)")
+    parser.add_argument("--mode", choices=list(MODES), default="standard")
+    parser.add_argument("--workers", type=int, default=8, help="générations simultanées")
+    parser.add_argument("--latence", type=float, default=0.0, help="secondes avant le premier token")
+    parser.add_argument("--debit", type=float, default=0.0, help="tokens générés par seconde (0 = instantané)")
+    parser.add_argument("--taille-morceau", type=int, default=16, help="caractères par morceau en flux")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="mesurer aussi le pic de mémoire allouée (ralentit l'exécution)")
+    parser.add_argument("--sortie", help="fichier JSON des résultats (suivi des régressions)")
+    args = parser.parse_args()
+
+    modelbusiness.definir_backend_llm(
+        LLMRejoue(latence=args.latence, debit=args.debit, taille_morceau=args.taille_morceau).creer
+    )
+    generer_un_canvas(-1, args.mode)  # Échauffement (imports, modèle Word en cache)
+
+    resultats = [executer_serie(nombre, args.mode, args.workers, args.tracemalloc) for nombre in args.nombres]
+
+    print(f"mode {args.mode}, {args.workers} workers, latence {args.latence} s, débit {args.debit or '∞'} tokens/s\n")
+    print(f"{'canvas':>7}{'canvas/s':>10}{'total p50':>11}{'p95':>9}{'api p50':>9}"
+          f"{'extr. p50':>11}{'p95':>8}{'docx p50':>10}{'p95':>8}{'RSS max':>9}")
+    for r in resultats:
+        print(f"{r['nombre']:>7}{r['debit']:>10.1f}{r['total_p50_ms']:>9.0f}ms{r['total_p95_ms']:>7.0f}ms"
+              f"{r['api_p50_ms']:>7.0f}ms{r['extraction_p50_ms']:>9.1f}ms{r['extraction_p95_ms']:>6.1f}ms"
+              f"{r['rendu_docx_p50_ms']:>8.1f}ms{r['rendu_docx_p95_ms']:>6.1f}ms{r['rss_max_mo']:>6.0f} Mo")
+        if r["pic_alloue_mo"] is not None:
+            print(f"{'':>7}pic de mémoire allouée : {r['pic_alloue_mo']:.1f} Mo")
+
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as fichier:
+            json.dump({"parametres": vars(args), "resultats": resultats}, fichier, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Backend LLM local pour les bancs d'essai : rejoue des réponses enregistrées
+(benchmarks/reponses/*.html) à la place de l'API OpenAI, avec une latence et
+un débit de génération configurables, en flux ou non.
+
+Les réponses ont la forme de celles de openai 0.28 (OpenAIObject) et
+s'adaptent au prompt reçu :
+  - prompt d'un seul bloc (mode parallèle, régénération d'un bloc) : la
+    liste <ul> de ce bloc ;
+  - format JSON demandé : l'objet JSON des 9 blocs ;
+  - sinon : la réponse HTML complète.
+
+Usage :
+    import llm_rejeu, modelbusiness
+    modelbusiness.definir_backend_llm(llm_rejeu.LLMRejoue(latence=0.5, debit=80).creer)
+"""
+import functools
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+
+import openai
+from openai.openai_object import OpenAIObject
+
+import modelbusiness
+
+REPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reponses")
+
+# Bloc demandé seul : "Génère uniquement le bloc « X »", "nouvelle version du bloc « X »"...
+MOTIF_BLOC_DEMANDE = re.compile(r"\bbloc « (.+?) »")
+
+
+class LLMRejoue:
+    """
+    Remplaçant de openai.ChatCompletion.create.
+    'latence'        : secondes avant le premier token ;
+    'debit'          : tokens générés par seconde (0 = instantané) ;
+    'taille_morceau' : caractères par morceau en flux ;
+    'gigue'          : variation aléatoire de la latence (fraction, 0.2 = ±20 %) ;
+    'limite_rpm'     : requêtes acceptées par minute glissante, au-delà
+                       RateLimitError comme l'API (0 = pas de limite).
+    La réponse enregistrée est choisie d'après le prompt : un même prompt
+    reçoit toujours la même réponse.
+    """
+
+    def __init__(self, dossier=REPONSES, latence=0.0, debit=0.0, taille_morceau=16, gigue=0.0, limite_rpm=0):
+        self.reponses = []
+        for chemin in sorted(glob.glob(os.path.join(dossier, "*.html"))):
+            with open(chemin, encoding="utf-8") as fichier:
+                html = fichier.read()
+            self.reponses.append((html, modelbusiness.extraire_blocs(html)))
+        if not self.reponses:
+            raise FileNotFoundError(f"aucune réponse enregistrée (*.html) dans {dossier}")
+        self.latence = latence
+        self.debit = debit
+        self.taille_morceau = taille_morceau
+        self.gigue = gigue
+        self.limite_rpm = limite_rpm
+        self._requetes = deque()
+        self._verrou = threading.Lock()
+
+    def texte_reponse(self, prompt, format_json):
+        """
+        Texte rejoué pour ce prompt (HTML complet, liste d'un bloc ou JSON).
+        """
+        html, blocs = self.reponses[zlib.crc32(prompt.encode("utf-8")) % len(self.reponses)]
+        if format_json:
+            return json.dumps(
+                {bloc: [modelbusiness.MOTIF_PUCE.sub("", ligne, count=1) for ligne in lignes]
+                 for bloc, lignes in blocs.items()},
+                ensure_ascii=False
+            )
+        demande = MOTIF_BLOC_DEMANDE.search(prompt)
+        if demande:
+            bloc = modelbusiness._bloc_du_titre(demande.group(1))
+            points = [modelbusiness.MOTIF_PUCE.sub("", ligne, count=1) for ligne in blocs.get(bloc, [])]
+            return "<ul>" + "".join(f"<li>{point}</li>" for point in points) + "</ul>"
+        return html
+
+    def _admettre(self):
+        # Fenêtre glissante d'une minute, comme la limite de l'API
+        if not self.limite_rpm:
+            return
+        maintenant = time.monotonic()
+        with self._verrou:
+            while self._requetes and self._requetes[0] <= maintenant - 60:
+                self._requetes.popleft()
+            if len(self._requetes) >= self.limite_rpm:
+                raise openai.error.RateLimitError(
+                    f"Rate limit reached: limit {self.limite_rpm} requests per minute (rejeu local)"
+                )
+            self._requetes.append(maintenant)
+
+    def _attendre(self, secondes):
+        if secondes > 0:
+            time.sleep(secondes)
+
+    def creer(self, model, messages, max_tokens=None, stream=False, response_format=None, **options):
+        self._admettre()
+        prompt = messages[-1]["content"]
+        texte = self.texte_reponse(prompt, response_format is not None)
+        tokens_entree = modelbusiness.tokens_prompt(modelbusiness.Prompt(messages[0]["content"], prompt))
+        tokens_sortie = modelbusiness.compter_tokens(texte)
+        self._attendre(self.latence * (1 + random.uniform(-self.gigue, self.gigue)))
+
+        if not stream:
+            if self.debit:
+                self._attendre(tokens_sortie / self.debit)
+            return OpenAIObject.construct_from({
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": texte},
+                             "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": tokens_entree,
+                    "completion_tokens": tokens_sortie,
+                    "total_tokens": tokens_entree + tokens_sortie,
+                },
+            })
+        return self._morceaux(model, texte, tokens_sortie)
+
+    def _morceaux(self, model, texte, tokens_sortie):
+        # Délai par morceau réparti d'après le débit en tokens
+        nb_morceaux = max(1, -(-len(texte) // self.taille_morceau))
+        delai = tokens_sortie / self.debit / nb_morceaux if self.debit else 0.0
+        for debut in range(0, len(texte), self.taille_morceau):
+            self._attendre(delai)
+            yield OpenAIObject.construct_from({
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": texte[debut:debut + self.taille_morceau]},
+                             "finish_reason": None}],
+            })
+        yield OpenAIObject.construct_from({
+            "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+
+
+@functools.lru_cache(maxsize=1)
+def rejeu_environnement():
+    """
+    Rejeu unique du processus, paramétré par les variables d'environnement
+    BMC_REJEU_LATENCE, BMC_REJEU_GIGUE, BMC_REJEU_DEBIT,
+    BMC_REJEU_TAILLE_MORCEAU et BMC_REJEU_LIMITE_RPM (application lancée
+    par bench_charge.py, voir app_rejeu.py).
+    """
+    return LLMRejoue(
+        latence=float(os.environ.get("BMC_REJEU_LATENCE", 0)),
+        gigue=float(os.environ.get("BMC_REJEU_GIGUE", 0)),
+        debit=float(os.environ.get("BMC_REJEU_DEBIT", 0)),
+        taille_morceau=int(os.environ.get("BMC_REJEU_TAILLE_MORCEAU", 16)),
+        limite_rpm=int(os.environ.get("BMC_REJEU_LIMITE_RPM", 0)),
+    )
@@ -1,12 +1,31 @@
-import streamlit as st
-import openai
-from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+# Streamlit, openai, python-docx, python-pptx et BeautifulSoup sont importés à la première
+# utilisation (dans les fonctions) : importer ce module reste rapide et sans
+# effet de bord, pour le mode batch, les workers et les tests.
+from html import escape as html_echappe, unescape as html_desechappe
 from io import BytesIO
+import contextlib
+import contextvars
 import datetime
+import difflib
+import functools
+import hashlib
+import json
+import math
+import logging
+import os
+import random
 import re
-from bs4 import BeautifulSoup
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import types
+import unicodedata
+import uuid
+import zipfile
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 hide_streamlit_style = """
@@ -16,22 +35,298 @@ hide_streamlit_style = """
     header {visibility: hidden;}
     </style>
     """
-st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 
-# Configuration de l'API OpenAI
+logger = logging.getLogger(__name__)
+
+# Registre des objets partagés par tout le processus (voir ressource_partagee)
+_registre = sys.modules.setdefault("_modelbusiness_ressources", types.ModuleType("_modelbusiness_ressources"))
+_registre.__dict__.setdefault("verrou", threading.Lock())
+_registre.__dict__.setdefault("objets", {})
+
+
+def ressource_partagee(nom, fabrique):
+    """
+    Retourne l'objet 'nom' unique pour tout le processus, créé au premier
+    appel par fabrique(). Streamlit réexécute ce script dans un nouveau module
+    à chaque interaction : une variable globale ordinaire serait recréée à
+    chaque fois et ne serait pas partagée entre les sessions. Les objets
+    partagés (limiteurs de débit, session HTTP...) sont donc rangés dans un
+    registre qui survit aux réexécutions.
+    """
+    with _registre.verrou:
+        if nom not in _registre.objets:
+            _registre.objets[nom] = fabrique()
+        return _registre.objets[nom]
 
-api_key = st.secrets["API_KEY"]
-openai.api_key = api_key
+# Configuration de l'API OpenAI
+# Les clés sont lues au premier appel (lire_cles_api) : variable
+# d'environnement OPENAI_API_KEYS ou OPENAI_API_KEY, sinon
+# st.secrets["API_KEYS"] ou st.secrets["API_KEY"].
+
+MODELE = "gpt-4o"
+TEMPERATURE = 0.8
+MESSAGE_SYSTEME = "Tu es un assistant expert en génération de business plan."
+
+# Cache disque des générations : taille maximale (octets) et durée de vie (secondes)
+CACHE_CHEMIN = os.environ.get("BMC_CACHE_CHEMIN", os.path.join(".cache_bmc", "generations.sqlite3"))
+CACHE_TAILLE_MAX = int(os.environ.get("BMC_CACHE_TAILLE_MAX", 50 * 1024 * 1024))
+CACHE_TTL = int(os.environ.get("BMC_CACHE_TTL", 7 * 24 * 3600))
+
+# Générations partagées : les demandes identiques simultanées (même clé de
+# cache) attendent la génération en cours au lieu d'appeler l'API. Entre
+# processus, un verrou de fichier par clé (VERROUS_CHEMIN) ; au-delà de
+# ATTENTE_VOL secondes d'attente, une demande génère elle-même.
+VERROUS_CHEMIN = os.environ.get("BMC_VERROUS_CHEMIN", os.path.join(".cache_bmc", "verrous"))
+ATTENTE_VOL = float(os.environ.get("BMC_ATTENTE_VOL", 300))
+VERROUS_TTL = 24 * 3600
+
+# Les 9 blocs du Business Model Canvas, dans l'ordre de restitution
+BLOCS_BMC = [
+    "Partenaires clés",
+    "Activités clés",
+    "Offre (proposition de valeur)",
+    "Relation client",
+    "Segments de clientèle",
+    "Ressources clés",
+    "Canaux de distribution",
+    "Structure des coûts",
+    "Sources de revenus",
+]
+
+# Clés des champs du formulaire (et colonnes du mode batch) -> rubrique
+CHAMPS_RUBRIQUES = {
+    "partenaires_cles": "Partenaires clés",
+    "activites_cles": "Activités clés",
+    "offre_valeur": "Offre (proposition de valeur)",
+    "relation_client": "Relation client",
+    "segments_clientele": "Segments de clientèle",
+    "ressources_cles": "Ressources clés",
+    "canaux_distribution": "Canaux de distribution",
+    "structure_couts": "Structure de coûts",
+    "sources_revenus": "Sources de revenus",
+}
+
+# Client OpenAI : délai maximal par requête (connexion, lecture) en secondes,
+# nouvelles tentatives sur les erreurs transitoires (429, 5xx, réseau) et
+# modèle de secours moins coûteux utilisé si le modèle principal reste
+# indisponible (vide pour désactiver)
+DELAI_CONNEXION = float(os.environ.get("BMC_DELAI_CONNEXION", 10))
+DELAI_LECTURE = float(os.environ.get("BMC_DELAI_LECTURE", 120))
+TENTATIVES_API = int(os.environ.get("BMC_TENTATIVES_API", 4))
+ATTENTE_BASE = 1.0
+ATTENTE_MAX = 30.0
+MODELE_SECOURS = os.environ.get("BMC_MODELE_SECOURS", "gpt-4o-mini")
+
+# Limites de débit côté client, communes à toutes les sessions du processus :
+# requêtes et tokens (entrée + sortie réservée) par minute. Au-delà, les
+# appels attendent leur tour au lieu d'échouer en 429.
+LIMITE_REQUETES_MINUTE = float(os.environ.get("BMC_LIMITE_RPM", 60))
+LIMITE_TOKENS_MINUTE = float(os.environ.get("BMC_LIMITE_TPM", 150000))
+
+# Pool de clés : ces limites s'appliquent à chaque clé. Les limites de l'API
+# OpenAI étant fixées par organisation (ou projet), le débit ne croît avec
+# le nombre de clés que si elles appartiennent à des projets distincts.
+# Une clé en échec ECHECS_AVANT_PAUSE fois de suite est mise en pause
+# PAUSE_CLE secondes ; une clé refusée (invalide, quota épuisé) l'est
+# PAUSE_CLE_REFUSEE secondes.
+ECHECS_AVANT_PAUSE = 3
+PAUSE_CLE = 30.0
+PAUSE_CLE_REFUSEE = float(os.environ.get("BMC_PAUSE_CLE_REFUSEE", 3600))
+
+# Budget de sortie : taille attendue d'un bloc (titre + 5 à 10 points concis)
+# et marge pour l'introduction et le récapitulatif d'une réponse complète.
+# max_tokens est dimensionné sur ces valeurs plutôt que fixé à 10000 (la
+# réservation compte dans la limite de tokens par minute de l'API).
+TOKENS_PAR_BLOC = int(os.environ.get("BMC_TOKENS_PAR_BLOC", 600))
+MARGE_TOKENS_REPONSE = int(os.environ.get("BMC_MARGE_TOKENS", 1500))
+
+# Metaprompt compacté (mise en forme Markdown et indentation retirées)
+METAPROMPT_COMPACT = os.environ.get("BMC_METAPROMPT_COMPACT", "0") == "1"
+
+# Journal de consommation (une ligne JSON par génération) et tarifs en USD
+# par million de tokens (entrée, sortie)
+JOURNAL_USAGE = os.environ.get("BMC_JOURNAL_USAGE", os.path.join(".cache_bmc", "usage.jsonl"))
+TARIFS_MODELES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Génération parallèle : un appel par bloc, pool de threads borné
+WORKERS_BLOCS = int(os.environ.get("BMC_WORKERS_BLOCS", len(BLOCS_BMC)))
+TENTATIVES_BLOC = 3
+
+# Génération JSON : nombre de demandes (la première comprise) pour obtenir
+# les 9 blocs valides
+TENTATIVES_JSON = 3
+
+# Blocs introuvables dans une réponse complète : redemandés un par un (les
+# blocs obtenus servant de contexte) au lieu de régénérer tout le canvas
+COMPLETER_BLOCS_MANQUANTS = os.environ.get("BMC_COMPLETER_BLOCS", "1") == "1"
+
+# Canvas proches : une demande très semblable (même type d'entreprise, nom
+# et données complémentaires voisins au sens TF-IDF) à un canvas déjà généré
+# est servie en adaptant ce canvas, en un appel plus court qu'une génération
+# complète. Index local, sans réseau (INDEX_CANVAS_CHEMIN).
+REUTILISER_CANVAS_PROCHES = os.environ.get("BMC_CANVAS_PROCHES", "1") == "1"
+SEUIL_SIMILARITE = float(os.environ.get("BMC_SEUIL_SIMILARITE", 0.75))
+INDEX_CANVAS_CHEMIN = os.environ.get("BMC_INDEX_CANVAS_CHEMIN", os.path.join(".cache_bmc", "canvas.sqlite3"))
+
+# File de tâches de génération (SQLite) traitée par un pool de threads de
+# travail, hors des threads de Streamlit. Le bail d'une tâche en cours est
+# prolongé tant que son processus vit ; à son expiration (processus arrêté),
+# la tâche est reprise, au plus TENTATIVES_TACHE fois.
+TACHES_CHEMIN = os.environ.get("BMC_TACHES_CHEMIN", os.path.join(".cache_bmc", "taches.sqlite3"))
+WORKERS_TACHES = int(os.environ.get("BMC_WORKERS_TACHES", 4))
+BAIL_TACHE = float(os.environ.get("BMC_BAIL_TACHE", 120))
+TENTATIVES_TACHE = 2
+TACHES_TTL = 7 * 24 * 3600
+# Suivi d'une tâche par l'application : intervalle entre deux sondages,
+# allongé (jusqu'à INTERVALLE_SONDAGE_MAX) tant que la tâche n'avance pas
+INTERVALLE_SONDAGE = 1.0
+INTERVALLE_SONDAGE_MAX = 5.0
+
+# Quotas journaliers par utilisateur (0 = illimité) : générations soumises à
+# la file et tokens consommés. L'utilisateur est identifié par l'en-tête HTTP
+# ENTETE_UTILISATEUR posé par un proxy d'authentification, sinon par sa
+# session Streamlit (un rechargement de la page ouvre alors une nouvelle
+# session).
+QUOTA_GENERATIONS_JOUR = int(os.environ.get("BMC_QUOTA_GENERATIONS_JOUR", 50))
+QUOTA_TOKENS_JOUR = int(os.environ.get("BMC_QUOTA_TOKENS_JOUR", 0))
+ENTETE_UTILISATEUR = os.environ.get("BMC_ENTETE_UTILISATEUR", "X-Forwarded-User")
+
+# Génération anticipée (option de l'application, cochée par défaut si "1") :
+# la génération démarre dès la validation du formulaire, en priorité basse,
+# et sert le clic sur « Générer » si la saisie n'a pas changé entre-temps.
+GENERATION_ANTICIPEE = os.environ.get("BMC_GENERATION_ANTICIPEE", "0") == "1"
+
+# Métriques du processus (durée par étape, appels, nouvelles tentatives,
+# tokens, cache) au format texte de Prometheus, réécrites après chaque
+# génération (à collecter par exemple avec le textfile collector de
+# node_exporter)
+METRIQUES_CHEMIN = os.environ.get("BMC_METRIQUES_CHEMIN", os.path.join(".cache_bmc", "metriques.prom"))
 
 # ----------------------------------------------------------------------------
-# 1) Fonction pour appeler ChatGPT et générer le texte du Business Model Canvas
+# Métriques : compteurs et histogrammes par étape
 # ----------------------------------------------------------------------------
-def get_metaprompt(type_entreprise):
+class Metriques:
     """
-    Retourne un metaprompt spécifique basé sur le type d'entreprise.
+    Compteurs et histogrammes (durées en secondes) du processus, identifiés
+    par un nom et des étiquettes, exportables au format texte de Prometheus.
+    """
+
+    BORNES = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.compteurs = {}
+        self.histogrammes = {}
+
+    def incrementer(self, nom, valeur=1, **etiquettes):
+        cle = (nom, tuple(sorted(etiquettes.items())))
+        with self.verrou:
+            self.compteurs[cle] = self.compteurs.get(cle, 0) + valeur
+
+    def observer(self, nom, valeur, **etiquettes):
+        cle = (nom, tuple(sorted(etiquettes.items())))
+        with self.verrou:
+            repartition = self.histogrammes.setdefault(cle, [[0] * len(self.BORNES), 0.0, 0])
+            for index, borne in enumerate(self.BORNES):
+                if valeur <= borne:
+                    repartition[0][index] += 1
+            repartition[1] += valeur
+            repartition[2] += 1
+
+    def texte(self):
+        """
+        Retourne toutes les métriques au format d'exposition texte de Prometheus.
+        """
+        def etiquettes_texte(etiquettes):
+            if not etiquettes:
+                return ""
+            valeurs = ",".join(
+                '{}="{}"'.format(nom, str(valeur).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for nom, valeur in etiquettes
+            )
+            return "{" + valeurs + "}"
+
+        lignes = []
+        with self.verrou:
+            types_declares = set()
+            for (nom, etiquettes), valeur in sorted(self.compteurs.items()):
+                if nom not in types_declares:
+                    lignes.append(f"# TYPE {nom} counter")
+                    types_declares.add(nom)
+                lignes.append(f"{nom}{etiquettes_texte(etiquettes)} {valeur:g}")
+            for (nom, etiquettes), (cumuls, somme, nombre) in sorted(self.histogrammes.items()):
+                if nom not in types_declares:
+                    lignes.append(f"# TYPE {nom} histogram")
+                    types_declares.add(nom)
+                for borne, cumul in zip(self.BORNES, cumuls):
+                    lignes.append(f"{nom}_bucket{etiquettes_texte(etiquettes + (('le', f'{borne:g}'),))} {cumul}")
+                lignes.append(f"{nom}_bucket{etiquettes_texte(etiquettes + (('le', '+Inf'),))} {nombre}")
+                lignes.append(f"{nom}_sum{etiquettes_texte(etiquettes)} {somme:.6f}")
+                lignes.append(f"{nom}_count{etiquettes_texte(etiquettes)} {nombre}")
+        return "\n".join(lignes) + "\n"
+
+
+def metriques():
+    """
+    Registre des métriques, unique pour tout le processus.
+    """
+    return ressource_partagee("metriques", Metriques)
+
+
+def ecrire_metriques():
+    """
+    Réécrit le fichier METRIQUES_CHEMIN (remplacement atomique : un collecteur
+    ne lit jamais un fichier à moitié écrit).
+    """
+    try:
+        dossier = os.path.dirname(METRIQUES_CHEMIN)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        temporaire = f"{METRIQUES_CHEMIN}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporaire, "w", encoding="utf-8") as fichier:
+            fichier.write(metriques().texte())
+        os.replace(temporaire, METRIQUES_CHEMIN)
+    except OSError as e:
+        logger.warning("Fichier de métriques inaccessible : %s", e)
+
+
+def enregistrer_etape(etape, duree):
+    """
+    Enregistre la durée d'une étape (prompt, api, extraction, rendu_...) :
+    histogramme du processus et cumul dans la génération en cours.
+    """
+    metriques().observer("bmc_etape_duree_secondes", duree, etape=etape)
+    usage = _usage_courant.get()
+    if usage is not None:
+        with _verrou_usage:
+            usage["etapes"][etape] = usage["etapes"].get(etape, 0.0) + duree
+
+
+def chronometrer(etape):
+    """
+    Décorateur : enregistre la durée de chaque appel de la fonction comme
+    étape 'etape' (voir enregistrer_etape).
     """
-    metaprompts = {
-        "PME": """**Méta-Prompt pour l’Élaboration d’un Business Model pour PME Traditionnelle (Intégrant des Innovations Low-Tech et Adaptées aux Contextes Africains ou Émergents)**
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            debut = time.perf_counter()
+            try:
+                return fonction(*args, **kwargs)
+            finally:
+                enregistrer_etape(etape, time.perf_counter() - debut)
+        return enveloppe
+    return decorateur
+
+# ----------------------------------------------------------------------------
+# 1) Fonction pour appeler ChatGPT et générer le texte du Business Model Canvas
+# ----------------------------------------------------------------------------
+# Metaprompts par type d'entreprise (construits une seule fois, au chargement du module)
+METAPROMPTS = {
+    "PME": """**Méta-Prompt pour l’Élaboration d’un Business Model pour PME Traditionnelle (Intégrant des Innovations Low-Tech et Adaptées aux Contextes Africains ou Émergents)**
 
         **Votre Rôle :**  
         Vous êtes un expert en stratégie d’entreprise, marketing, UX, innovation frugale (low-tech et éventuellement high-tech), et élaboration de Business Models. Vous devez générer un Business Model complet, clair, chiffré, cohérent et innovant, adapté à une PME qui opère dans un environnement local (par exemple en Afrique ou dans d’autres pays émergents) où les réalités technologiques, économiques, culturelles et réglementaires diffèrent des contextes occidentaux fortement numérisés.  
@@ -246,7 +541,7 @@ def get_metaprompt(type_entreprise):
         """,
         
         
-        "Startup": """ Tu es un assistant expert en stratégie d’entreprise, marketing, UX, innovation et élaboration de Business Models. Ton rôle est de générer un Business Model complet, clair, chiffré, cohérent et innovant, en suivant trois phases : Configuration Initiale, Étapes Intermédiaires (Analyse, Contexte, Empathie, Parcours Client, Optimisation) et Production Finale (Business Model Canvas).
+    "Startup": """ Tu es un assistant expert en stratégie d’entreprise, marketing, UX, innovation et élaboration de Business Models. Ton rôle est de générer un Business Model complet, clair, chiffré, cohérent et innovant, en suivant trois phases : Configuration Initiale, Étapes Intermédiaires (Analyse, Contexte, Empathie, Parcours Client, Optimisation) et Production Finale (Business Model Canvas).
 
         Tout au long du processus, tu dois :
         - Prendre en compte la persona (données démographiques, comportementales, capacités d’adoption de l’innovation).
@@ -424,461 +719,3225 @@ def get_metaprompt(type_entreprise):
 
         Enfin, fournis un récapitulatif global du Business Model, mettant en avant la logique, la cohérence, et la proposition de valeur différenciante. Indique, si possible, des chiffres (taille du marché, CAC, CLV, taux de conversion, CA projeté) pour valider la viabilité économique.""",
        
-        "Autre": "Fournissez une approche générale adaptée à votre entreprise."
-    }
-    return metaprompts.get(type_entreprise, metaprompts["Autre"])
+    "Autre": "Fournissez une approche générale adaptée à votre entreprise."
+}
 
 
+def compacter_metaprompt(texte):
+    """
+    Version compacte d'un metaprompt : même contenu, sans l'indentation du
+    code source, les marqueurs Markdown (**, __, ###) ni les lignes vides
+    répétées, qui coûtent des tokens sans rien apporter au modèle.
+    """
+    lignes = []
+    for ligne in texte.splitlines():
+        ligne = re.sub(r"\*\*|__|^#+\s*", "", ligne.strip())
+        ligne = re.sub(r"\s{2,}", " ", ligne)
+        if ligne or (lignes and lignes[-1]):
+            lignes.append(ligne)
+    return "\n".join(lignes).strip()
+
+
+METAPROMPTS_COMPACTS = {type_entreprise: compacter_metaprompt(texte) for type_entreprise, texte in METAPROMPTS.items()}
 
 
-def obtenir_business_model(nom_entreprise, type_entreprise, rubriques):
+def reduire_metaprompt_bloc(texte):
     """
-    Interroge ChatGPT (API OpenAI) pour générer le contenu textuel
-    des différents blocs du Business Model Canvas.
-    'type_entreprise' peut être "PME", "Startup", "Grande Entreprise", etc.
+    Version d'un metaprompt compact pour la régénération d'un bloc : le rôle
+    et la production finale (phase 3), sans les phases de collecte et
+    d'analyse déjà reflétées par le canvas existant. Un metaprompt sans
+    phases est retourné tel quel.
     """
-    
-    
-    # Récupérer le metaprompt basé sur le type d'entreprise
-    metaprompt = get_metaprompt(type_entreprise)
-    print(rubriques)
-    
-   
-    # Prompt ajusté sans numérotation dans les titres
-    prompt = f"""
-    {metaprompt}
-    
-    Mener la reflexions du generation du business modele sur base des indications(Méta-Prompt) precedents du metaprompts; 
-    Chercher les chiffres et autres données sur internet, assurer-vous d'etre trop precis et excat en fonction fonction des données collecter sur internet 
-    Génère le contenu d'un Business Model Canvas en format HTML pour une entreprise nommée '{nom_entreprise}'.
-    Le type d'entreprise est : {type_entreprise}.
-    et dont les données complementaires (non obligatoire pour l'utilisateur) pour chaque bloc se trouve dans : {rubriques}.
-    si l'utlisateur a donner les données complementaires, veuillez en tenir compte dans la generation, et ca doit etre imperativement prioritaire.
-    Si dans un bloque un utilisateur n'as pas donner des informations (elements), veuillez generer,
-    Si l'utilisateur à donné des elements que vous juger peu, generer d'autres et les ajoutées à ce que l'utlisateur à fournit.
-    
-    à faire imperativement est:
-    Je veux impérativement 9 blocs distincts, rédigés en français, avec les titres en gras et des listes à puces si nécessaire :
-      - Partenaires clés
-      - Activités clés
-      - Offre (proposition de valeur)
-      - Relation client
-      - Segments de clientèle
-      - Ressources clés
-      - Canaux de distribution
-      - Structure des coûts
-      - Sources de revenus
-    Fournis 5 à 10 points ou élements(phrases) , meme plus pour chacun afin d'avoir un contenu riche et adapté, soyez concis.
+    debut_phase_1 = re.search(r"^Phase 1\b", texte, re.MULTILINE)
+    debut_phase_3 = re.search(r"^Phase 3\b", texte, re.MULTILINE)
+    if not debut_phase_1 or not debut_phase_3:
+        return texte
+    return texte[:debut_phase_1.start()].rstrip("-\n ") + "\n\n" + texte[debut_phase_3.start():]
+
+
+METAPROMPTS_BLOC = {type_entreprise: reduire_metaprompt_bloc(texte) for type_entreprise, texte in METAPROMPTS_COMPACTS.items()}
+
+# Titre de la section du metaprompt (« 3. Canaux de Distribution ») propre à
+# chaque bloc du canvas
+SECTIONS_METAPROMPT = {
+    "Partenaires clés": "partenaires",
+    "Activités clés": "activités",
+    "Offre (proposition de valeur)": "proposition de valeur",
+    "Relation client": "relation",
+    "Segments de clientèle": "segments",
+    "Ressources clés": "ressources",
+    "Canaux de distribution": "canaux",
+    "Structure des coûts": "structure",
+    "Sources de revenus": "revenus",
+}
+
+
+def extraire_metaprompt_bloc(texte, bloc):
     """
+    Version d'un metaprompt réduit (METAPROMPTS_BLOC) pour la génération du
+    seul bloc 'bloc' : le rôle, suivi du méta-prompt de ce bloc, sans ceux
+    des 8 autres blocs. Un metaprompt sans méta-prompt par bloc est retourné
+    tel quel.
+    """
+    debut_phase_3 = re.search(r"^Phase 3\b", texte, re.MULTILINE)
+    if not debut_phase_3:
+        return texte
+    for section in re.finditer(r"^\d+\. (.+)\nMéta-Prompt", texte, re.MULTILINE):
+        if SECTIONS_METAPROMPT[bloc] in section.group(1).lower():
+            fin = texte.find("\n\n", section.start())
+            return texte[:debut_phase_3.start()].rstrip() + "\n\n" + texte[section.start():fin if fin >= 0 else None]
+    return texte
+
+
+def get_metaprompt(type_entreprise, compact=None):
+    """
+    Retourne un metaprompt spécifique basé sur le type d'entreprise.
+    'compact' : variante compactée (par défaut selon BMC_METAPROMPT_COMPACT).
+    """
+    if compact is None:
+        compact = METAPROMPT_COMPACT
+    metaprompts = METAPROMPTS_COMPACTS if compact else METAPROMPTS
+    return metaprompts.get(type_entreprise, metaprompts["Autre"])
 
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Tu es un assistant expert en génération de business plan."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=10000,
-            temperature=0.8
-        )
-        html_genere = response.choices[0].message.content.strip()
-        return html_genere
-    except Exception as e:
-        st.error(f"Erreur lors de la génération du contenu : {e}")
-        return ""
 
 # ----------------------------------------------------------------------------
-# 2) Fonction pour créer le fichier Word (format tableau) avec python-docx
+# Assemblage des prompts : préfixe statique, données canoniques
 # ----------------------------------------------------------------------------
-
-def generer_docx_business_model(nom_entreprise, date_bmc, contenu_business_model):
+class Prompt:
     """
-    Construit un document Word reproduisant un tableau avec la disposition souhaitée
-    pour le Business Model Canvas. La mise en forme inclut des titres en gras et
-    des listes à puces.
-    'contenu_business_model' : le contenu HTML renvoyé par ChatGPT,
-    qu'on découpe ensuite pour remplir chaque bloc.
+    Prompt en deux messages : 'systeme', préfixe statique (MESSAGE_SYSTEME,
+    metaprompt du type d'entreprise et consignes), identique à l'octet près
+    pour toutes les demandes de même nature, et 'utilisateur', les seules
+    données propres à la demande. Le fournisseur peut ainsi réutiliser le
+    préfixe déjà traité, et deux saisies équivalentes donnent le même prompt.
+    'empreinte' (SHA-256 des deux messages) identifie le prompt de façon
+    stable (clé de cache, journaux).
     """
-    # Créer un nouveau document Word
-    doc = Document()
 
-    # Définir les styles de base
-    style = doc.styles['Normal']
-    font = style.font
-    font.name = 'Calibri'
-    font.size = Pt(11)
-
-    # Titre principal
-    titre = doc.add_heading(level=1)
-    titre_run = titre.add_run(f"Business Model Canvas de {nom_entreprise}")
-    titre_run.bold = True
-    titre.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    def __init__(self, systeme, utilisateur):
+        self.systeme = systeme
+        self.utilisateur = utilisateur
+        self.empreinte = hashlib.sha256(
+            json.dumps([systeme, utilisateur], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
 
-    # Date
-    date_paragraph = doc.add_paragraph()
-    date_run = date_paragraph.add_run(f"Date : {date_bmc}")
-    date_run.bold = True
-    date_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
+    def messages(self):
+        """
+        Messages de l'appel à l'API.
+        """
+        return [
+            {"role": "system", "content": self.systeme},
+            {"role": "user", "content": self.utilisateur},
+        ]
 
-    # Ajouter un saut de ligne
-    doc.add_paragraph("")
 
-    # Créer un tableau de 6 lignes × 5 colonnes
-    table = doc.add_table(rows=6, cols=5)
-    table.style = 'Table Grid'
+def en_prompt(prompt):
+    """
+    Retourne 'prompt' sous forme de Prompt ; une simple chaîne devient le
+    message utilisateur, après le message système par défaut.
+    """
+    return prompt if isinstance(prompt, Prompt) else Prompt(MESSAGE_SYSTEME, prompt)
 
-    # Ajuster les largeurs des colonnes (en pouces)
-    for col in table.columns:
-        for cell in col.cells:
-            cell.width = Inches(1.8)  # Ajustez selon vos besoins
 
-    # 1) Ligne 0 : Titre (fusion des 5 colonnes)
-    cell00 = table.cell(0, 0)
-    cell00_merge = cell00.merge(table.cell(0, 4))
-    cell00_merge.text = f"Business Model Canvas de {nom_entreprise}"
-    for paragraph in cell00_merge.paragraphs:
-        for run in paragraph.runs:
-            run.bold = True
-            run.font.size = Pt(14)
-        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
-    # 2) Ligne 1 : Nom de l'entreprise et Date (fusion des colonnes)
-    cell10 = table.cell(1, 0)
-    cell10_merge = cell10.merge(table.cell(1, 2))
-    cell10_merge.text = f"**Nom de l'entreprise**: {nom_entreprise}"
-    for paragraph in cell10_merge.paragraphs:
-        for run in paragraph.runs:
-            run.bold = True
-        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
-
-    cell13 = table.cell(1, 3)
-    cell13_merge = cell13.merge(table.cell(1, 4))
-    cell13_merge.text = f"**Date**: {date_bmc}"
-    for paragraph in cell13_merge.paragraphs:
-        for run in paragraph.runs:
-            run.bold = True
-        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
-
-    # 3) Ligne 2 : Headers des 5 blocs
-    headers = ["Partenaires clés", "Activités clés", "Offre (proposition de valeur)", 
-               "Relation client", "Segments de clientèle"]
-    for idx, header in enumerate(headers):
-        cell = table.cell(2, idx)
-        paragraphe = cell.paragraphs[0]
-        run = paragraphe.add_run(header)
-        run.bold = True
-        paragraphe.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
-    # 4) Ligne 3 : Contenus des 5 blocs
-    # Initialiser les blocs
-    blocs = {
-        "Partenaires clés": "",
-        "Activités clés": "",
-        "Offre (proposition de valeur)": "",
-        "Relation client": "",
-        "Segments de clientèle": ""
-    }
+@functools.lru_cache(maxsize=None)
+def prefixe_prompt(type_entreprise, consignes, reduit=False, bloc=None):
+    """
+    Message système : MESSAGE_SYSTEME, metaprompt du type d'entreprise
+    (réduit à la phase de production avec 'reduit', voir METAPROMPTS_BLOC,
+    et au méta-prompt du seul 'bloc' s'il est donné) puis consignes. Calculé
+    une fois par combinaison.
+    """
+    if bloc is not None:
+        metaprompt = extraire_metaprompt_bloc(METAPROMPTS_BLOC.get(type_entreprise, METAPROMPTS_BLOC["Autre"]), bloc)
+    elif reduit:
+        metaprompt = METAPROMPTS_BLOC.get(type_entreprise, METAPROMPTS_BLOC["Autre"])
+    else:
+        metaprompt = get_metaprompt(type_entreprise)
+    return "\n\n".join([MESSAGE_SYSTEME, metaprompt.strip(), consignes])
 
-    # Utiliser BeautifulSoup pour parser le HTML
-    soup = BeautifulSoup(contenu_business_model, 'html.parser')
-
-    # Fonction pour trouver le bon header tag (h3 par défaut, avec flexibilité)
-    def trouver_header(soup, header):
-        # Regex pour capturer optionnellement des numéros suivis de points et espaces
-        pattern = rf"^(?:\d+\.\s*)?{re.escape(header)}$"
-        # Chercher dans les balises h3
-        header_tag = soup.find(['h2', 'h3', 'h4', 'h5', 'h6'], text=re.compile(pattern, re.IGNORECASE))
-        return header_tag
-
-    # Extraire chaque bloc
-    for header in blocs.keys():
-        h_tag = trouver_header(soup, header)
-        if h_tag:
-            content = []
-            for sibling in h_tag.find_next_siblings():
-                if sibling.name and re.match(r'^h[2-6]$', sibling.name, re.IGNORECASE):
-                    break  # Arrêter si un nouveau header est trouvé
-                if sibling.name == 'ul':
-                    for li in sibling.find_all('li'):
-                        content.append(f"- {li.get_text(strip=True)}")
-                elif sibling.name == 'p':
-                    content.append(sibling.get_text(strip=True))
-                elif isinstance(sibling, str):
-                    text = sibling.strip()
-                    if text:
-                        content.append(text)
-            blocs[header] = '\n'.join(content)
-
-    # Debug: Afficher les blocs extraits (à désactiver en production)
-    # st.write("Blocs extraits :", blocs)
-
-    # Fonction pour ajouter du contenu formaté dans une cellule
-    def ajouter_contenu(cell, titre, contenu):
-        """
-        Ajoute du contenu formaté dans une cellule Word.
-        Le titre est en gras, suivi de listes à puces si nécessaire.
-        """
-        # Supprimer le texte initial (par défaut) dans la cellule
-        cell.text = ""
 
-        # Ajouter le titre en gras
-        paragraphe = cell.add_paragraph()
-        run = paragraphe.add_run(titre)
-        run.bold = True
+def canoniser_rubriques(rubriques):
+    """
+    Forme canonique des données complémentaires saisies : rubriques vides
+    omises, espaces normalisés (les lignes d'un champ sont séparées par
+    « ; »), rubriques dans l'ordre du formulaire. Retourne le texte inséré
+    dans le prompt.
+    """
+    ordre = list(CHAMPS_RUBRIQUES.values())
+    lignes = []
+    for rubrique in sorted(rubriques or {}, key=lambda r: (ordre.index(r) if r in ordre else len(ordre), r)):
+        valeur = " ; ".join(
+            " ".join(ligne.split()) for ligne in str(rubriques[rubrique] or "").splitlines() if ligne.strip()
+        )
+        if valeur:
+            lignes.append(f"- {' '.join(rubrique.split())} : {valeur}")
+    return "\n".join(lignes) or "Aucune : tous les blocs sont à générer."
 
-        # Ajouter le contenu
-        # Diviser le contenu par les sauts de ligne
-        lignes = contenu.split('\n')
-        for ligne in lignes:
-            ligne = ligne.strip()
-            if not ligne:
-                continue
-            # Vérifier si la ligne commence par '-', '+', '•' pour une liste à puces
-            if re.match(r'^[-+•]\s+', ligne):
-                # Ajouter une puce
-                item = re.sub(r'^[-+•]\s+', '', ligne)
-                p = cell.add_paragraph(item, style='List Bullet')
-            else:
-                # Ajouter un paragraphe normal
-                p = cell.add_paragraph(ligne)
-
-    # Remplir les cellules de la ligne 3
-    ordre_blocs = [
-        "Partenaires clés", "Activités clés", "Offre (proposition de valeur)",
-        "Relation client", "Segments de clientèle"
-    ]
-
-    for idx, bloc in enumerate(ordre_blocs):
-        cell = table.cell(3, idx)
-        ajouter_contenu(cell, bloc, blocs[bloc])
-
-    # 5) Ligne 4 : Structure de coûts (fusion 3 cols) et Sources de revenus (fusion 2 cols)
-    # Fusionner les cellules pour "Structure de coûts" (colonnes 0-2)
-    cell40 = table.cell(4, 0)
-    cell40_merge = cell40.merge(table.cell(4, 2))
-    cell40_merge.text = f"**Structure de coûts**:\n\n"
-
-    # Fusionner les cellules pour "Sources de revenus" (colonnes 3-4)
-    cell43 = table.cell(4, 3)
-    cell43_merge = cell43.merge(table.cell(4, 4))
-    cell43_merge.text = f"**Sources de revenus**:\n\n"
-
-    # Extraire les contenus pour ces blocs
-    structure_couts = ""
-    sources_revenus = ""
-
-    # Structure des coûts
-    strong_tag = trouver_header(soup, "Structure des coûts")
-    if strong_tag:
-        content = []
-        for sibling in strong_tag.find_next_siblings():
-            if sibling.name and re.match(r'^h[2-6]$', sibling.name, re.IGNORECASE):
-                break
-            if sibling.name == 'ul':
-                for li in sibling.find_all('li'):
-                    content.append(f"- {li.get_text(strip=True)}")
-            elif sibling.name == 'p':
-                content.append(sibling.get_text(strip=True))
-            elif isinstance(sibling, str):
-                text = sibling.strip()
-                if text:
-                    content.append(text)
-        structure_couts = '\n'.join(content)
-
-    # Sources de revenus
-    strong_tag = trouver_header(soup, "Sources de revenus")
-    if strong_tag:
-        content = []
-        for sibling in strong_tag.find_next_siblings():
-            if sibling.name and re.match(r'^h[2-6]$', sibling.name, re.IGNORECASE):
-                break
-            if sibling.name == 'ul':
-                for li in sibling.find_all('li'):
-                    content.append(f"- {li.get_text(strip=True)}")
-            elif sibling.name == 'p':
-                content.append(sibling.get_text(strip=True))
-            elif isinstance(sibling, str):
-                text = sibling.strip()
-                if text:
-                    content.append(text)
-        sources_revenus = '\n'.join(content)
-
-    # Remplir les cellules fusionnées
-    ajouter_contenu(cell40_merge, "Structure de coûts", structure_couts)
-    ajouter_contenu(cell43_merge, "Sources de revenus", sources_revenus)
-
-    # Ajuster les paragraphes existants
-    for row in table.rows:
-        for cell in row.cells:
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.name = 'Calibri'
-                    run.font.size = Pt(11)
 
-    # Ajouter un saut de ligne à la fin
-    doc.add_paragraph("")
+def donnees_entreprise(nom_entreprise, type_entreprise, rubriques):
+    """
+    Partie variable commune aux prompts : entreprise, type et données
+    complémentaires canoniques.
+    """
+    return (
+        f"Entreprise : '{' '.join(nom_entreprise.split())}'\n"
+        f"Type d'entreprise : {type_entreprise}\n"
+        f"Données complémentaires fournies par l'utilisateur (non obligatoires), par bloc :\n"
+        f"{canoniser_rubriques(rubriques)}"
+    )
 
-    # Convertir le document en binaire pour téléchargement via Streamlit
-    fichier_io = BytesIO()
-    doc.save(fichier_io)
-    fichier_io.seek(0)
-    return fichier_io
 
-# ----------------------------------------------------------------------------
-# 3) Application Streamlit
-# ----------------------------------------------------------------------------
-def main():
-    st.title("Générateur de Business Model Canvas")
-    st.write(
-        "Cette application génère automatiquement un Business Model Canvas (format Word) "
-        "en se basant sur le nom et le type de votre entreprise, via ChatGPT."
+# Consignes statiques de chaque nature de demande (message système)
+CONSIGNES_CANVAS_HTML = """\
+Mener la reflexions du generation du business modele sur base des indications(Méta-Prompt) precedents du metaprompts;
+Chercher les chiffres et autres données sur internet, assurer-vous d'etre trop precis et excat en fonction fonction des données collecter sur internet
+Génère le contenu d'un Business Model Canvas en format HTML pour l'entreprise décrite dans le message de l'utilisateur.
+si l'utlisateur a donner les données complementaires, veuillez en tenir compte dans la generation, et ca doit etre imperativement prioritaire.
+Si dans un bloque un utilisateur n'as pas donner des informations (elements), veuillez generer,
+Si l'utilisateur à donné des elements que vous juger peu, generer d'autres et les ajoutées à ce que l'utlisateur à fournit.
+
+à faire imperativement est:
+Je veux impérativement 9 blocs distincts, rédigés en français, avec les titres en gras et des listes à puces si nécessaire :
+  - Partenaires clés
+  - Activités clés
+  - Offre (proposition de valeur)
+  - Relation client
+  - Segments de clientèle
+  - Ressources clés
+  - Canaux de distribution
+  - Structure des coûts
+  - Sources de revenus
+Fournis 5 à 10 points ou élements(phrases) , meme plus pour chacun afin d'avoir un contenu riche et adapté, soyez concis."""
+
+CONSIGNES_LISTE_BLOC = """\
+Réponds uniquement avec une liste HTML <ul> de 5 à 10 éléments <li>, rédigés en français, concis,
+sans titre, sans texte avant ou après la liste."""
+
+CONSIGNES_BLOC = f"""\
+Mener la reflexions du generation du business modele sur base des indications(Méta-Prompt) precedents du metaprompts;
+Le message de l'utilisateur décrit l'entreprise et le seul bloc du Business Model Canvas à générer.
+si l'utlisateur a donner des données pour ce bloc, veuillez en tenir compte en priorité et les completer.
+
+{CONSIGNES_LISTE_BLOC}"""
+
+CONSIGNES_REGENERATION_BLOC = f"""\
+Le message de l'utilisateur contient le Business Model Canvas actuel de l'entreprise et le bloc à rédiger.
+si l'utlisateur a donner des données pour ce bloc, veuillez en tenir compte en priorité et les completer.
+
+{CONSIGNES_LISTE_BLOC}"""
+
+CONSIGNES_CANVAS_JSON = """\
+Mener la reflexions du generation du business modele sur base des indications(Méta-Prompt) precedents du metaprompts;
+Génère le contenu d'un Business Model Canvas pour l'entreprise décrite dans le message de l'utilisateur.
+si l'utlisateur a donner les données complementaires, veuillez en tenir compte dans la generation, et ca doit etre imperativement prioritaire.
+
+Réponds uniquement avec un objet JSON ayant exactement les clés demandées (titres des blocs), chacune associée
+à une liste de 5 à 10 points rédigés en français, concis, sans balise HTML ni Markdown."""
+
+
+@chronometrer("prompt")
+def construire_prompt(nom_entreprise, type_entreprise, rubriques):
+    """
+    Assemble le prompt envoyé à ChatGPT : metaprompt du type d'entreprise et
+    consignes en préfixe statique, entreprise et données complémentaires
+    saisies (forme canonique) dans le message utilisateur.
+    """
+    logger.debug("Rubriques fournies : %s", rubriques)
+    return Prompt(
+        prefixe_prompt(type_entreprise, CONSIGNES_CANVAS_HTML),
+        donnees_entreprise(nom_entreprise, type_entreprise, rubriques)
     )
-    
-        # Champs de saisie
-    nom_entreprise = st.text_input("Nom de l'entreprise", value="COIFFURE MOBILE S.a.r.l")
-    type_entreprise = st.selectbox("Type d'entreprise", ["PME", "Startup", "Autre"])
-    date_bmc = st.date_input("Date du BMC", value=datetime.date.today())
-    
-     # Formulaire pour les 9 rubriques du BMC
-        # Variable pour contrôler l'état global des expanders
-    expand_all = st.checkbox("Étendre / Réduire tout le formulaire", value=False)
 
-    # Formulaire pour les 9 rubriques du BMC
-    st.header("Informations Complémentaires pour le Business Model Canvas")
 
-    with st.form("form_rubriques"):
-        st.write("Veuillez remplir les informations pour chaque rubrique du Business Model Canvas.")
+def configurer_openai():
+    """
+    Installe la session HTTP partagée : les connexions (TLS compris) sont
+    réutilisées par tous les threads au lieu d'une session par thread.
+    La clé de l'API est donnée à chaque appel par le pool de clés (pool_cles).
+    """
+    import openai
 
-        with st.expander("Partenaires clés", expanded=expand_all):
-            st.markdown("""
-            **Partenaires clés :**  
-            Identifiez les organisations ou individus essentiels à votre activité. Par exemple :  
-            - Fournisseurs  
-            - Banques ou institutions financières  
-            - Partenaires stratégiques  
-            - Associations ou gouvernements locaux  
-            """)
-            partenaire_cles = st.text_area("Listez vos principaux partenaires.", key="partenaires_cles")
+    if not openai.requestssession:
+        openai.requestssession = ressource_partagee("session_http", _creer_session_http)
 
-        with st.expander("Activités clés", expanded=expand_all):
-            st.markdown("""
-            **Activités clés :**  
-            Décrivez les tâches ou processus les plus importants pour exécuter votre modèle économique. Par exemple :  
-            - Fabrication de produits  
-            - Marketing et vente  
-            - Recherche et développement  
-            - Gestion des relations avec les clients  
-            """)
-            activites_cles = st.text_area("Décrivez vos activités principales.", key="activites_cles")
 
-        with st.expander("Offre (proposition de valeur)", expanded=expand_all):
-            st.markdown("""
-            **Proposition de valeur :**  
-            Expliquez ce que vous offrez à vos clients et ce qui vous différencie de vos concurrents. Par exemple :  
-            - Résolution d'un problème spécifique  
-            - Amélioration d'un besoin existant  
-            - Caractéristiques uniques de vos produits ou services  
-            """)
-            offre_valeur = st.text_area("Décrivez votre proposition de valeur.", key="offre_valeur")
+def lire_cles_api():
+    """
+    Retourne les clés de l'API OpenAI : variable d'environnement
+    OPENAI_API_KEYS (clés séparées par des virgules) ou OPENAI_API_KEY, sinon
+    secret Streamlit "API_KEYS" (liste ou chaîne) ou "API_KEY".
+    Sans clé configurée, retourne [None] : la clé du module openai
+    (openai.api_key) est alors utilisée.
+    """
+    valeur = os.environ.get("OPENAI_API_KEYS") or os.environ.get("OPENAI_API_KEY")
+    if not valeur:
+        import streamlit as st
 
-        with st.expander("Relation client", expanded=expand_all):
-            st.markdown("""
-            **Relation client :**  
-            Décrivez comment vous interagissez avec vos clients. Par exemple :  
-            - Assistance personnalisée  
-            - Automatisation des services (chatbots, self-service)  
-            - Programmes de fidélisation  
-            """)
-            relation_client = st.text_area("Décrivez comment vous gérez vos relations clients.", key="relation_client")
+        try:
+            valeur = st.secrets.get("API_KEYS") or st.secrets.get("API_KEY")
+        except FileNotFoundError:
+            valeur = None
+    if isinstance(valeur, str):
+        valeur = valeur.split(",")
+    cles = [cle.strip() for cle in valeur or [] if cle and cle.strip()]
+    return cles or [None]
 
-        with st.expander("Segments de clientèle", expanded=expand_all):
-            st.markdown("""
-            **Segments de clientèle :**  
-            Identifiez vos différents groupes de clients cibles. Par exemple :  
-            - Particuliers (par revenus, âge, localisation)  
-            - Entreprises (par secteur ou taille)  
-            - Marchés de niche  
-            """)
-            segments_clientele = st.text_area("Définissez vos segments de clientèle.", key="segments_clientele")
 
-        with st.expander("Ressources clés", expanded=expand_all):
-            st.markdown("""
-            **Ressources clés :**  
-            Listez les ressources nécessaires pour exécuter vos activités. Par exemple :  
-            - Ressources physiques (locaux, machines)  
-            - Ressources humaines (compétences clés, équipes)  
-            - Ressources financières (fonds, prêts)  
-            """)
-            ressources_cles = st.text_area("Listez vos ressources principales.", key="ressources_cles")
+def definir_backend_llm(creer=None):
+    """
+    Remplace, pour tout le processus, l'appel à l'API OpenAI
+    (openai.ChatCompletion.create) par 'creer' : même signature, réponses de
+    même forme. Sert aux bancs d'essai hors ligne (benchmarks/llm_rejeu.py) ;
+    limiteurs, nouvelles tentatives, cache et métriques restent en place.
+    Sans argument, rétablit l'API OpenAI.
+    """
+    with _registre.verrou:
+        _registre.objets["backend_llm"] = creer
 
-        with st.expander("Canaux de distribution", expanded=expand_all):
-            st.markdown("""
-            **Canaux de distribution :**  
-            Décrivez comment vos produits ou services atteignent vos clients. Par exemple :  
-            - Boutiques physiques  
-            - Plateformes en ligne  
-            - Distributeurs tiers  
-            """)
-            canaux_distribution = st.text_area("Décrivez vos canaux de distribution.", key="canaux_distribution")
 
-        with st.expander("Structure de coûts", expanded=expand_all):
-            st.markdown("""
-            **Structure de coûts :**  
-            Énumérez les principaux coûts liés à votre activité. Par exemple :  
-            - Coûts de production  
-            - Salaires et charges sociales  
-            - Dépenses marketing et publicitaires  
-            """)
-        
-            structure_couts = st.text_area("Décrivez votre structure de coûts.", key="structure_couts")
+def _creer_session_http():
+    import requests
 
-        with st.expander("Sources de revenus", expanded=expand_all):
-            st.markdown("""
-            **Sources de revenus :**  
-            Décrivez comment vous générez des revenus. Par exemple :  
-            - Vente de produits ou services  
-            - Abonnements  
-            - Publicité ou partenariats  
-            """)
-            sources_revenus = st.text_area("Décrivez vos sources de revenus.", key="sources_revenus")
+    session = requests.Session()
+    adaptateur = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(WORKERS_BLOCS, 16))
+    session.mount("https://", adaptateur)
+    return session
 
-        submit_form = st.form_submit_button("Valider les Informations")
-             # Récupérer les informations du formulaire
-        if submit_form:
-                # Récupérer les informations du formulaire
-            rubriques = {
-                "Partenaires clés": partenaire_cles,
-                "Activités clés": activites_cles,
-                "Offre (proposition de valeur)": offre_valeur,
-                "Relation client": relation_client,
-                "Segments de clientèle": segments_clientele,
-                "Ressources clés": ressources_cles,
-                "Canaux de distribution": canaux_distribution,
-                "Structure de coûts": structure_couts,
-                "Sources de revenus": sources_revenus
-                }
-        else:
-                # Si le formulaire n'est pas soumis, utiliser des valeurs vides
-            rubriques = {
-                "Partenaires clés": "",
-                "Activités clés": "",
-                "Offre (proposition de valeur)": "",
-                "Relation client": "",
-                "Segments de clientèle": "",
-                "Ressources clés": "",
-                "Canaux de distribution": "",
-                "Structure de coûts": "",
-                "Sources de revenus": ""
-                }    
 
+class SeauJetons:
+    """
+    Limiteur de débit à seau de jetons, sûr entre threads : 'par_minute'
+    jetons par minute, au plus 'capacite' en réserve (par défaut une minute).
+    Un appel qui dépasse la réserve la rend négative et attend son tour :
+    les demandes sont servies dans leur ordre d'arrivée.
+    """
 
+    def __init__(self, par_minute, capacite=None):
+        self.debit = par_minute / 60.0
+        self.capacite = capacite or par_minute
+        self.jetons = self.capacite
+        self.horodatage = time.monotonic()
+        self.verrou = threading.Lock()
 
-    # Bouton pour générer
-    if st.button("Générer le Business Model Canvas"):
-        with st.spinner("Génération en cours..."):
-            
-            rubriques = {
-                "Partenaires clés": partenaire_cles,
+    def acquerir(self, jetons=1):
+        """
+        Réserve 'jetons' et attend le temps nécessaire ; retourne l'attente
+        en secondes. Sans limite (débit nul), retourne immédiatement.
+        """
+        if self.debit <= 0:
+            return 0.0
+        with self.verrou:
+            maintenant = time.monotonic()
+            self.jetons = min(self.capacite, self.jetons + (maintenant - self.horodatage) * self.debit)
+            self.horodatage = maintenant
+            self.jetons -= min(jetons, self.capacite)
+            attente = -self.jetons / self.debit if self.jetons < 0 else 0.0
+        if attente:
+            time.sleep(attente)
+        return attente
+
+    def attente(self, jetons=1):
+        """
+        Attente qu'imposerait acquerir(jetons) maintenant, sans rien réserver.
+        """
+        if self.debit <= 0:
+            return 0.0
+        with self.verrou:
+            disponibles = min(self.capacite, self.jetons + (time.monotonic() - self.horodatage) * self.debit)
+        manque = min(jetons, self.capacite) - disponibles
+        return manque / self.debit if manque > 0 else 0.0
+
+
+class CleApi:
+    """
+    Une clé du pool : ses limiteurs de débit et son état de santé (échecs
+    consécutifs, fin de la pause en cours, appels en vol).
+    Son nom (cle1, cle2...) sert dans les journaux et les métriques, la
+    valeur de la clé n'y apparaît jamais.
+    """
+
+    def __init__(self, nom, valeur):
+        self.nom = nom
+        self.valeur = valeur
+        self.requetes = SeauJetons(LIMITE_REQUETES_MINUTE)
+        self.tokens = SeauJetons(LIMITE_TOKENS_MINUTE)
+        self.echecs_consecutifs = 0
+        self.pause_jusqu_a = 0.0
+        self.en_vol = 0
+
+    def options(self):
+        """
+        Arguments à ajouter à l'appel de l'API pour utiliser cette clé.
+        """
+        return {"api_key": self.valeur} if self.valeur else {}
+
+
+class PoolCles:
+    """
+    Répartit les appels à l'API entre plusieurs clés, chacune avec ses
+    propres limites de débit. Chaque appel prend, parmi les clés qui ne sont
+    pas en pause, celle qui le servira le plus tôt (attente estimée de ses
+    limiteurs, puis nombre d'appels en vol). Une clé qui échoue est mise en
+    pause : limite de débit atteinte (délai Retry-After), clé refusée
+    (PAUSE_CLE_REFUSEE) ou échecs répétés (PAUSE_CLE).
+    """
+
+    def __init__(self, cles):
+        self.cles = [CleApi(f"cle{numero}", valeur) for numero, valeur in enumerate(cles, 1)]
+        self.verrou = threading.Lock()
+
+    def acquerir(self, jetons):
+        """
+        Choisit une clé, y réserve une requête et 'jetons' tokens (en
+        attendant si besoin) et la retourne ; l'appelant la rend avec
+        liberer(). Si toutes les clés sont en pause, attend la première qui
+        redevient disponible, ou lève RuntimeError si l'attente dépasse
+        ATTENTE_MAX.
+        """
+        with self.verrou:
+            maintenant = time.monotonic()
+            disponibles = [cle for cle in self.cles if cle.pause_jusqu_a <= maintenant]
+            if disponibles:
+                cle = min(disponibles, key=lambda c: (
+                    max(c.requetes.attente(), c.tokens.attente(jetons)), c.en_vol
+                ))
+            else:
+                cle = min(self.cles, key=lambda c: c.pause_jusqu_a)
+            pause = max(0.0, cle.pause_jusqu_a - maintenant)
+            if pause > ATTENTE_MAX:
+                raise RuntimeError(f"aucune clé de l'API disponible avant {pause:.0f} s")
+            cle.en_vol += 1
+        if pause:
+            logger.warning("Toutes les clés de l'API sont en pause ; reprise avec %s dans %.1f s", cle.nom, pause)
+            time.sleep(pause)
+        cle.requetes.acquerir()
+        cle.tokens.acquerir(jetons)
+        return cle
+
+    def liberer(self, cle, erreur=None):
+        """
+        Rend la clé après l'appel et met à jour sa santé d'après 'erreur'
+        (None si l'appel a réussi). Seules comptent contre la clé les erreurs
+        transitoires (limite de débit, délai, erreur serveur) et les refus de
+        la clé : une requête invalide échouerait avec n'importe quelle clé.
+        Retourne True si la clé vient d'être mise en pause pour une raison
+        qui lui est propre (limite de débit, clé refusée) : une autre clé
+        peut alors prendre le relais sans attendre.
+        """
+        import openai
+
+        refusee = isinstance(erreur, (openai.error.AuthenticationError, openai.error.PermissionError)) \
+            or getattr(erreur, "code", None) == "insufficient_quota"
+        with self.verrou:
+            cle.en_vol -= 1
+            if erreur is None:
+                cle.echecs_consecutifs = 0
+                return False
+            if not (refusee or _erreur_reessayable(erreur)):
+                return False
+            cle.echecs_consecutifs += 1
+            if refusee:
+                raison, pause = "refusee", PAUSE_CLE_REFUSEE
+            elif isinstance(erreur, openai.error.RateLimitError):
+                raison, pause = "limite", _attente_avant_tentative(erreur, cle.echecs_consecutifs - 1)
+            elif cle.echecs_consecutifs >= ECHECS_AVANT_PAUSE:
+                raison, pause = "echecs", PAUSE_CLE
+            else:
+                return False
+            cle.pause_jusqu_a = time.monotonic() + pause
+        metriques().incrementer("bmc_pauses_cle_total", cle=cle.nom, raison=raison)
+        logger.warning("Clé %s en pause pour %.1f s (%s) : %s", cle.nom, pause, raison, erreur)
+        return raison != "echecs"
+
+    def disponible(self):
+        """
+        Vrai si au moins une clé n'est pas en pause.
+        """
+        with self.verrou:
+            maintenant = time.monotonic()
+            return any(cle.pause_jusqu_a <= maintenant for cle in self.cles)
+
+
+def pool_cles():
+    return ressource_partagee("pool_cles", lambda: PoolCles(lire_cles_api()))
+
+
+def _erreur_reessayable(erreur):
+    """
+    Vrai pour les erreurs transitoires de l'API : limite de débit, délai
+    dépassé, connexion, indisponibilité ou erreur serveur (5xx).
+    """
+    import openai
+
+    if isinstance(erreur, (openai.error.RateLimitError, openai.error.Timeout, openai.error.TryAgain,
+                           openai.error.APIConnectionError, openai.error.ServiceUnavailableError)):
+        return True
+    if isinstance(erreur, openai.error.APIError):
+        return erreur.http_status is None or erreur.http_status >= 500
+    return False
+
+
+def _attente_avant_tentative(erreur, tentative):
+    """
+    Attente exponentielle avec gigue complète, ou délai Retry-After indiqué
+    par l'API s'il est présent.
+    """
+    retry_after = getattr(erreur, "headers", {}).get("retry-after")
+    try:
+        return min(float(retry_after), ATTENTE_MAX)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(ATTENTE_MAX, ATTENTE_BASE * 2 ** tentative))
+
+
+def _signaler_erreur(message):
+    """
+    Affiche l'erreur dans l'application Streamlit, ou la journalise lorsque
+    le code s'exécute hors d'une session Streamlit (batch, threads de travail).
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    if get_script_run_ctx() is not None:
+        import streamlit as st
+
+        st.error(message)
+    else:
+        logger.error(message)
+
+
+def estimer_max_tokens(nb_blocs=len(BLOCS_BMC)):
+    """
+    Plafond de tokens de sortie pour une réponse de 'nb_blocs' blocs,
+    dimensionné sur la taille attendue plutôt que sur une valeur fixe.
+    """
+    marge = MARGE_TOKENS_REPONSE if nb_blocs > 1 else TOKENS_PAR_BLOC // 2
+    return nb_blocs * TOKENS_PAR_BLOC + marge
+
+
+def appeler_chatgpt(prompt, stream=False, max_tokens=None, format_json=False):
+    """
+    Envoie le prompt (Prompt, ou chaîne envoyée après MESSAGE_SYSTEME) à
+    l'API OpenAI (gpt-4o).
+    Avec stream=True, retourne l'itérateur de morceaux de la réponse au lieu
+    de la réponse complète. Avec format_json=True, la réponse est contrainte
+    à un objet JSON. Par défaut, max_tokens couvre un canvas complet
+    (estimer_max_tokens).
+    Chaque appel passe par une clé du pool (pool_cles) et ses limiteurs de
+    débit, et a un délai maximal ; les erreurs transitoires sont retentées
+    (TENTATIVES_API) avec une attente exponentielle, puis le modèle de
+    secours est essayé. Une clé limitée ou refusée est mise en pause et
+    l'essai suivant part aussitôt avec une autre clé.
+    """
+    import openai
+
+    prompt = en_prompt(prompt)
+    creer = _registre.objets.get("backend_llm")
+    if creer is None:
+        configurer_openai()
+        creer = openai.ChatCompletion.create
+    max_tokens = max_tokens or estimer_max_tokens()
+    options = {"response_format": {"type": "json_object"}} if format_json else {}
+    pool = pool_cles()
+    modeles = [MODELE] + ([MODELE_SECOURS] if MODELE_SECOURS and MODELE_SECOURS != MODELE else [])
+
+    for modele in modeles:
+        for tentative in range(TENTATIVES_API):
+            cle = pool.acquerir(tokens_prompt(prompt) + max_tokens)
+            debut = time.perf_counter()
+            try:
+                response = creer(
+                    model=modele,
+                    messages=prompt.messages(),
+                    max_tokens=max_tokens,
+                    temperature=TEMPERATURE,
+                    stream=stream,
+                    request_timeout=(DELAI_CONNEXION, DELAI_LECTURE),
+                    **cle.options(),
+                    **options
+                )
+            except Exception as e:
+                metriques().incrementer("bmc_erreurs_api_total", modele=modele, cle=cle.nom, erreur=type(e).__name__)
+                autre_cle = pool.liberer(cle, e) and pool.disponible()
+                if not (_erreur_reessayable(e) or autre_cle):
+                    raise
+                erreur = e
+                noter_reessai()
+                if tentative < TENTATIVES_API - 1:
+                    attente = 0.0 if autre_cle else _attente_avant_tentative(e, tentative)
+                    logger.warning("API OpenAI (%s, %s), tentative %d/%d : %s ; nouvel essai dans %.1f s",
+                                   modele, cle.nom, tentative + 1, TENTATIVES_API, e, attente)
+                    time.sleep(attente)
+                continue
+            pool.liberer(cle)
+            metriques().incrementer("bmc_appels_api_total", modele=modele, cle=cle.nom)
+            if not stream:
+                # En flux, l'aller-retour est mesuré à la lecture des morceaux
+                enregistrer_etape("api", time.perf_counter() - debut)
+            return response
+        logger.warning("Modèle %s indisponible après %d tentatives", modele, TENTATIVES_API)
+    raise erreur
+
+
+def reponse_tronquee(finish_reason, origine):
+    """
+    Vrai si la réponse a été coupée par max_tokens (finish_reason "length") :
+    elle est alors journalisée et comptée (métrique, relevé de consommation)
+    pour ne pas être mise en cache, les blocs perdus étant redemandés.
+    """
+    if finish_reason != "length":
+        return False
+    logger.warning("Réponse tronquée par la limite de tokens (%s) : non mise en cache", origine)
+    metriques().incrementer("bmc_reponses_tronquees_total", origine=origine)
+    usage = _usage_courant.get()
+    if usage is not None:
+        with _verrou_usage:
+            usage["reponses_tronquees"] += 1
+    return True
+
+
+def noter_reessai():
+    """
+    Compte une erreur transitoire de l'API suivie d'un nouvel essai (ou du
+    passage au modèle de secours).
+    """
+    metriques().incrementer("bmc_reessais_api_total")
+    usage = _usage_courant.get()
+    if usage is not None:
+        with _verrou_usage:
+            usage["reessais"] += 1
+
+
+# ----------------------------------------------------------------------------
+# Comptabilité des tokens (par génération)
+# ----------------------------------------------------------------------------
+# Consommation de la génération en cours (voir suivre_usage)
+_usage_courant = contextvars.ContextVar("usage_courant", default=None)
+_verrou_usage = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _encodeur_tokens():
+    """
+    Encodeur tiktoken du modèle, ou None si tiktoken (ou son vocabulaire,
+    téléchargé au premier usage) n'est pas disponible.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(MODELE)
+    except Exception:
+        return None
+
+
+def compter_tokens(texte):
+    """
+    Nombre de tokens d'un texte : exact avec tiktoken, sinon estimation
+    (environ 3,5 caractères par token pour du français).
+    """
+    encodeur = _encodeur_tokens()
+    if encodeur is not None:
+        return len(encodeur.encode(texte))
+    return int(len(texte) / 3.5) + 1
+
+
+def tokens_prompt(prompt):
+    """
+    Tokens d'entrée d'une requête : message système, message utilisateur et
+    surcoût fixe du format des messages. Le message système, statique, n'est
+    compté qu'une fois.
+    """
+    prompt = en_prompt(prompt)
+    return _tokens_prefixe(prompt.systeme) + compter_tokens(prompt.utilisateur) + 7
+
+
+@functools.lru_cache(maxsize=64)
+def _tokens_prefixe(systeme):
+    return compter_tokens(systeme)
+
+
+def comptabiliser_usage(prompt, response=None, texte_genere=None, cache=False, modele=None):
+    """
+    Ajoute la consommation d'un appel à la génération en cours (sans effet
+    hors de suivre_usage). Les chiffres viennent du champ 'usage' de la
+    réponse de l'API ; pour une réponse en flux (sans ce champ), ils sont
+    calculés sur le prompt et le texte généré. Un succès de cache ne coûte rien.
+    Le coût est calculé avec le modèle ayant réellement répondu (modèle de
+    secours éventuel compris).
+    """
+    usage = _usage_courant.get()
+    modele = modele or getattr(response, "model", None) or MODELE
+    estime = False
+    if cache:
+        entree = sortie = 0
+    elif getattr(response, "usage", None) is not None:
+        entree, sortie = response.usage["prompt_tokens"], response.usage["completion_tokens"]
+    else:
+        entree, sortie = tokens_prompt(prompt), compter_tokens(texte_genere or "")
+        estime = True
+
+    if not cache:
+        metriques().incrementer("bmc_tokens_total", entree, sens="entree", modele=modele)
+        metriques().incrementer("bmc_tokens_total", sortie, sens="sortie", modele=modele)
+        metriques().incrementer("bmc_cout_usd_total", cout_estime(entree, sortie, modele), modele=modele)
+    if usage is None:
+        return
+    with _verrou_usage:
+        usage["estime"] = usage["estime"] or estime
+        usage["reponses_cache" if cache else "appels"] += 1
+        usage["prompt_tokens"] += entree
+        usage["completion_tokens"] += sortie
+        usage["cout_usd"] += cout_estime(entree, sortie, modele)
+        if not cache and not modele.startswith(MODELE):
+            usage["appels_secours"] += 1
+
+
+def cout_estime(prompt_tokens, completion_tokens, modele=MODELE):
+    """
+    Coût estimé en USD d'après TARIFS_MODELES (0 si le modèle est inconnu).
+    Les versions datées ("gpt-4o-2024-08-06") prennent le tarif de leur modèle.
+    """
+    connus = [nom for nom in TARIFS_MODELES if modele.startswith(nom)]
+    tarif_entree, tarif_sortie = TARIFS_MODELES[max(connus, key=len)] if connus else (0.0, 0.0)
+    return (prompt_tokens * tarif_entree + completion_tokens * tarif_sortie) / 1_000_000
+
+
+@contextlib.contextmanager
+def suivre_usage(nom_entreprise, type_entreprise, mode, utilisateur=None):
+    """
+    Mesure une génération : tokens d'entrée et de sortie de tous les appels
+    effectués dans le bloc 'with' (threads du mode parallèle compris), durée
+    totale et par étape, nouvelles tentatives et coût estimé. Le relevé est
+    fourni à l'appelant puis ajouté au journal JSON JOURNAL_USAGE, pour
+    suivre coût et latence par type d'entreprise ; les métriques Prometheus
+    sont réécrites (METRIQUES_CHEMIN).
+    """
+    usage = {
+        "appels": 0, "appels_secours": 0, "reponses_cache": 0, "reessais": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "cout_usd": 0.0, "estime": False,
+        "etapes": {}, "canvas_proche": None, "reponses_tronquees": 0,
+    }
+    jeton = _usage_courant.set(usage)
+    debut = time.perf_counter()
+    try:
+        yield usage
+    finally:
+        _usage_courant.reset(jeton)
+        usage["duree"] = round(time.perf_counter() - debut, 3)
+        usage["cout_usd"] = round(usage["cout_usd"], 5)
+        usage["etapes"] = {etape: round(duree, 4) for etape, duree in usage["etapes"].items()}
+        metriques().incrementer("bmc_generations_total", mode=mode, type_entreprise=type_entreprise)
+        metriques().observer("bmc_generation_duree_secondes", usage["duree"], mode=mode)
+        _journaliser_usage({
+            "horodatage": datetime.datetime.now().isoformat(timespec="seconds"),
+            "entreprise": nom_entreprise,
+            "type_entreprise": type_entreprise,
+            "mode": mode,
+            "utilisateur": utilisateur,
+            "modele": MODELE,
+            "metaprompt_compact": METAPROMPT_COMPACT,
+            **usage,
+        })
+        ecrire_metriques()
+
+
+def _journaliser_usage(entree):
+    try:
+        dossier = os.path.dirname(JOURNAL_USAGE)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        with _verrou_usage, open(JOURNAL_USAGE, "a", encoding="utf-8") as journal:
+            journal.write(json.dumps(entree, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning("Journal de consommation inaccessible : %s", e)
+
+
+def resumer_usage():
+    """
+    Agrège le journal de consommation par type d'entreprise : nombre de
+    générations, tokens moyens d'entrée et de sortie, durée moyenne et coût total.
+    Les totaux sont conservés pour tout le processus avec la position lue
+    dans le journal : chaque appel ne lit que les lignes ajoutées depuis le
+    précédent (le journal entier seulement s'il a été remplacé ou tronqué).
+    """
+    etat, verrou = ressource_partagee("resume_usage", lambda: ({"position": 0, "fichier": None, "totaux": {}},
+                                                              threading.Lock()))
+    with verrou:
+        try:
+            infos = os.stat(JOURNAL_USAGE)
+        except OSError:
+            etat.update(position=0, fichier=None, totaux={})
+            return {}
+        if etat["fichier"] != (infos.st_dev, infos.st_ino) or infos.st_size < etat["position"]:
+            etat.update(position=0, fichier=(infos.st_dev, infos.st_ino), totaux={})
+        with open(JOURNAL_USAGE, "rb") as journal:
+            journal.seek(etat["position"])
+            for ligne in journal:
+                if not ligne.endswith(b"\n"):
+                    break  # Ligne en cours d'écriture : relue au prochain appel
+                etat["position"] += len(ligne)
+                try:
+                    entree = json.loads(ligne)
+                except ValueError:
+                    continue
+                total = etat["totaux"].setdefault(entree["type_entreprise"], {
+                    "generations": 0, "prompt_tokens": 0, "completion_tokens": 0, "duree": 0.0, "cout_usd": 0.0
+                })
+                total["generations"] += 1
+                for cle in ("prompt_tokens", "completion_tokens", "duree", "cout_usd"):
+                    total[cle] += entree.get(cle, 0)
+        totaux = {type_entreprise: dict(total) for type_entreprise, total in etat["totaux"].items()}
+
+    resume = {}
+    for type_entreprise, total in totaux.items():
+        generations = total["generations"]
+        resume[type_entreprise] = {
+            "generations": generations,
+            "cout_usd": round(total["cout_usd"], 4),
+            "prompt_tokens_moyen": round(total["prompt_tokens"] / generations),
+            "completion_tokens_moyen": round(total["completion_tokens"] / generations),
+            "duree_moyenne": round(total["duree"] / generations, 1),
+        }
+    return resume
+
+
+# ----------------------------------------------------------------------------
+# Cache disque des générations (clé = empreinte du prompt)
+# ----------------------------------------------------------------------------
+def cle_cache(prompt, modele=MODELE, temperature=TEMPERATURE):
+    """
+    Calcule la clé de cache d'une génération : empreinte SHA-256 de
+    l'empreinte du prompt (Prompt.empreinte, messages système et utilisateur),
+    du modèle et de la température.
+    """
+    empreinte = json.dumps([modele, temperature, en_prompt(prompt).empreinte])
+    return hashlib.sha256(empreinte.encode("utf-8")).hexdigest()
+
+
+@contextlib.contextmanager
+def _connexion_cache():
+    """
+    Ouvre la base SQLite du cache le temps d'une transaction (une connexion
+    par appel : Streamlit exécute les sessions dans des threads différents).
+    """
+    dossier = os.path.dirname(CACHE_CHEMIN)
+    if dossier:
+        os.makedirs(dossier, exist_ok=True)
+    connexion = sqlite3.connect(CACHE_CHEMIN, timeout=30)
+    try:
+        with connexion:
+            connexion.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "cle TEXT PRIMARY KEY, contenu TEXT, taille INTEGER, cree REAL, dernier_acces REAL)"
+            )
+            connexion.execute("CREATE TABLE IF NOT EXISTS compteurs (nom TEXT PRIMARY KEY, valeur INTEGER)")
+            yield connexion
+    finally:
+        connexion.close()
+
+
+def _incrementer_compteur(connexion, nom):
+    connexion.execute(
+        "INSERT INTO compteurs (nom, valeur) VALUES (?, 1) "
+        "ON CONFLICT(nom) DO UPDATE SET valeur = valeur + 1",
+        (nom,)
+    )
+
+
+def lire_cache(cle, compter=True):
+    """
+    Retourne le contenu HTML en cache pour cette clé, ou None (absent ou expiré).
+    Chaque lecture est comptée comme succès ("hits") ou échec ("misses"),
+    sauf avec compter=False (simple vérification avant une autre lecture).
+    """
+    maintenant = time.time()
+    try:
+        with _connexion_cache() as connexion:
+            ligne = connexion.execute(
+                "SELECT contenu, cree FROM generations WHERE cle = ?", (cle,)
+            ).fetchone()
+            if ligne and maintenant - ligne[1] > CACHE_TTL:
+                connexion.execute("DELETE FROM generations WHERE cle = ?", (cle,))
+                ligne = None
+            if ligne is None:
+                if compter:
+                    _incrementer_compteur(connexion, "misses")
+                    metriques().incrementer("bmc_cache_total", resultat="miss")
+                return None
+            connexion.execute("UPDATE generations SET dernier_acces = ? WHERE cle = ?", (maintenant, cle))
+            if compter:
+                _incrementer_compteur(connexion, "hits")
+                metriques().incrementer("bmc_cache_total", resultat="hit")
+            return ligne[0]
+    except sqlite3.Error:
+        # Le cache ne doit jamais empêcher une génération
+        return None
+
+
+def ecrire_cache(cle, contenu):
+    """
+    Enregistre une génération dans le cache puis évince les entrées les moins
+    récemment utilisées tant que la taille totale dépasse CACHE_TAILLE_MAX.
+    """
+    maintenant = time.time()
+    taille = len(contenu.encode("utf-8"))
+    try:
+        with _connexion_cache() as connexion:
+            connexion.execute(
+                "INSERT OR REPLACE INTO generations (cle, contenu, taille, cree, dernier_acces) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cle, contenu, taille, maintenant, maintenant)
+            )
+            total = connexion.execute("SELECT COALESCE(SUM(taille), 0) FROM generations").fetchone()[0]
+            if total > CACHE_TAILLE_MAX:
+                for cle_lru, taille_lru in connexion.execute(
+                    "SELECT cle, taille FROM generations WHERE cle != ? ORDER BY dernier_acces", (cle,)
+                ).fetchall():
+                    connexion.execute("DELETE FROM generations WHERE cle = ?", (cle_lru,))
+                    total -= taille_lru
+                    if total <= CACHE_TAILLE_MAX:
+                        break
+    except sqlite3.Error:
+        pass
+
+
+def statistiques_cache():
+    """
+    Retourne les compteurs du cache : succès, échecs, nombre d'entrées et taille.
+    """
+    try:
+        with _connexion_cache() as connexion:
+            compteurs = dict(connexion.execute("SELECT nom, valeur FROM compteurs").fetchall())
+            entrees, taille = connexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(taille), 0) FROM generations"
+            ).fetchone()
+    except sqlite3.Error:
+        compteurs, entrees, taille = {}, 0, 0
+    return {
+        "hits": compteurs.get("hits", 0),
+        "misses": compteurs.get("misses", 0),
+        "entrees": entrees,
+        "taille": taille,
+    }
+
+
+# ----------------------------------------------------------------------------
+# Générations partagées entre demandes identiques simultanées
+# ----------------------------------------------------------------------------
+class Vol:
+    """
+    Génération en cours dans ce processus, partagée par les demandes
+    identiques : le meneur publie les fragments au fil de l'eau puis la fin
+    (ou l'erreur), les suiveurs les relisent dans l'ordre.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.fragments = []
+        self.termine = False
+        self.erreur = None
+        self.suiveurs = 0
+
+    def publier(self, fragment):
+        with self.condition:
+            self.fragments.append(fragment)
+            self.condition.notify_all()
+
+    def terminer(self, erreur=None):
+        with self.condition:
+            self.termine = True
+            self.erreur = erreur
+            self.condition.notify_all()
+
+    def suivre(self, delai=ATTENTE_VOL):
+        """
+        Produit les fragments du meneur, déjà publiés puis à venir ; lève son
+        erreur éventuelle, ou TimeoutError s'il n'a pas terminé à temps.
+        """
+        limite = time.monotonic() + delai
+        lus = 0
+        while True:
+            with self.condition:
+                while lus == len(self.fragments) and not self.termine:
+                    reste = limite - time.monotonic()
+                    if reste <= 0:
+                        raise TimeoutError(f"génération partagée non terminée après {delai:.0f} s")
+                    self.condition.wait(reste)
+                nouveaux = self.fragments[lus:]
+                termine, erreur = self.termine, self.erreur
+            lus += len(nouveaux)
+            yield from nouveaux
+            if termine:
+                if erreur is not None:
+                    raise erreur
+                return
+
+
+class GenerationAnnulee(BaseException):
+    """
+    La tâche de la génération en cours a été annulée (annuler_tache) :
+    levée par verifier_annulation pour arrêter les appels à l'API. Dérive de
+    BaseException pour traverser les « except Exception » qui transforment
+    une erreur de génération en contenu vide ou en bloc manquant.
+    """
+
+
+# Tâche de la génération en cours dans ce contexte (voir executer_tache) :
+# {"tache": identifiant, "prochaine": prochaine vérification (monotonic)}
+_annulation_courante = contextvars.ContextVar("annulation_courante", default=None)
+
+
+def verifier_annulation():
+    """
+    Lève GenerationAnnulee si la tâche de la génération en cours a été
+    annulée. Sans tâche en cours (application hors file, batch), ne fait
+    rien ; la file n'est consultée qu'une fois par INTERVALLE_SONDAGE.
+    """
+    suivi = _annulation_courante.get()
+    if suivi is None:
+        return
+    if not suivi.get("annulee") and time.monotonic() >= suivi["prochaine"]:
+        suivi["prochaine"] = time.monotonic() + INTERVALLE_SONDAGE
+        with _connexion_taches() as connexion:
+            ligne = connexion.execute("SELECT statut FROM taches WHERE id = ?", (suivi["tache"],)).fetchone()
+        # Retenu pour les autres blocs de la même génération (mode parallèle)
+        suivi["annulee"] = ligne is not None and ligne["statut"] == "annulee"
+    if suivi.get("annulee"):
+        raise GenerationAnnulee(suivi["tache"])
+
+
+def _vols_en_cours():
+    return ressource_partagee("vols_en_cours", lambda: ({}, threading.Lock()))
+
+
+@contextlib.contextmanager
+def verrou_generation(cle, delai=ATTENTE_VOL):
+    """
+    Verrou exclusif entre processus sur la clé 'cle' (fichier
+    VERROUS_CHEMIN/<cle>.lock, fcntl.flock, libéré même si le processus
+    s'arrête brutalement). Produit True si le verrou est obtenu, False après
+    'delai' secondes d'attente ou sans fcntl (Windows).
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield False
+        return
+    os.makedirs(VERROUS_CHEMIN, exist_ok=True)
+    with open(os.path.join(VERROUS_CHEMIN, f"{cle}.lock"), "a") as fichier:
+        limite = time.monotonic() + delai
+        pause = 0.05
+        while True:
+            try:
+                fcntl.flock(fichier, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= limite:
+                    logger.warning("Verrou de génération %s non obtenu après %.0f s", cle[:12], delai)
+                    yield False
+                    return
+                time.sleep(pause)
+                pause = min(pause * 2, 0.5)
+        try:
+            yield True
+        finally:
+            fcntl.flock(fichier, fcntl.LOCK_UN)
+
+
+def purger_verrous(age=VERROUS_TTL):
+    """
+    Supprime les fichiers de verrou inutilisés depuis plus de 'age' secondes
+    (un fichier encore verrouillé par un processus est conservé).
+    """
+    try:
+        import fcntl
+        noms = os.listdir(VERROUS_CHEMIN)
+    except (ImportError, OSError):
+        return
+    limite = time.time() - age
+    for nom in noms:
+        chemin = os.path.join(VERROUS_CHEMIN, nom)
+        try:
+            if os.path.getmtime(chemin) >= limite:
+                continue
+            with open(chemin, "a") as fichier:
+                fcntl.flock(fichier, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(chemin)
+        except OSError:
+            continue  # Verrouillé, ou supprimé entre-temps
+
+
+def partager_generation(cle, prompt, produire, regenerer=False):
+    """
+    Exécute produire() (générateur de fragments de texte, qui appelle l'API,
+    comptabilise son usage et écrit le cache) une seule fois pour toutes les
+    demandes simultanées de même clé, et produit ses fragments.
+    - Dans le processus : une demande arrivée pendant une génération en cours
+      la suit (fragments déjà produits puis à venir, ou même erreur).
+    - Entre processus (sauf avec 'regenerer') : le meneur prend le verrou de
+      fichier de la clé puis relit le cache, qu'un autre processus a pu
+      remplir pendant l'attente, avant d'appeler l'API. Cette relecture
+      n'est pas comptée dans les statistiques du cache (voir
+      bmc_generations_partagees_total).
+    Une génération partagée compte comme une réponse du cache pour l'usage.
+    Le meneur d'une tâche annulée s'arrête avant l'appel à l'API, puis entre
+    deux fragments tant qu'aucune autre demande ne le suit
+    (verifier_annulation) : fermer le flux arrête la génération facturée.
+    """
+    vols, verrou = _vols_en_cours()
+    with verrou:
+        vol = vols.get(cle)
+        meneur = vol is None
+        if meneur:
+            vol = vols[cle] = Vol()
+    if not meneur:
+        vol.suiveurs += 1
+        metriques().incrementer("bmc_generations_partagees_total", portee="processus")
+        comptabiliser_usage(prompt, cache=True)
+        yield from vol.suivre()
+        return
+
+    def publier(fragments):
+        for fragment in fragments:
+            vol.publier(fragment)
+            yield fragment
+            if not vol.suiveurs:
+                verifier_annulation()
+
+    try:
+        verifier_annulation()
+        if regenerer:
+            yield from publier(produire())
+        else:
+            with verrou_generation(cle):
+                # L'appelant a déjà lu (et compté) le cache : simple vérification
+                contenu = lire_cache(cle, compter=False)
+                if contenu is not None:
+                    metriques().incrementer("bmc_generations_partagees_total", portee="inter_processus")
+                    comptabiliser_usage(prompt, cache=True)
+                    vol.publier(contenu)
+                    yield contenu
+                else:
+                    yield from publier(produire())
+        vol.terminer()
+    except BaseException as e:
+        # Erreur, ou lecture abandonnée par l'appelant (GeneratorExit)
+        vol.terminer(e if isinstance(e, Exception) else RuntimeError("génération partagée interrompue"))
+        raise
+    finally:
+        with verrou:
+            vols.pop(cle, None)
+
+
+def obtenir_business_model(nom_entreprise, type_entreprise, rubriques, regenerer=False):
+    """
+    Interroge ChatGPT (API OpenAI) pour générer le contenu textuel
+    des différents blocs du Business Model Canvas.
+    'type_entreprise' peut être "PME", "Startup", "Grande Entreprise", etc.
+    Une génération identique déjà en cache est renvoyée sans appel à l'API,
+    sauf si 'regenerer' est vrai.
+    """
+    prompt = construire_prompt(nom_entreprise, type_entreprise, rubriques)
+    cle = cle_cache(prompt)
+    if not regenerer:
+        html_cache = lire_cache(cle)
+        if html_cache is not None:
+            comptabiliser_usage(prompt, cache=True)
+            return html_cache
+
+    def produire():
+        response = appeler_chatgpt(prompt)
+        comptabiliser_usage(prompt, response=response)
+        html_genere = response.choices[0].message.content.strip()
+        if html_genere and not reponse_tronquee(response.choices[0].get("finish_reason"), "canvas"):
+            ecrire_cache(cle, html_genere)
+        yield html_genere
+
+    try:
+        # Demandes identiques simultanées : un seul appel à l'API
+        return "".join(partager_generation(cle, prompt, produire, regenerer=regenerer))
+    except Exception as e:
+        _signaler_erreur(f"Erreur lors de la génération du contenu : {e}")
+        return ""
+
+
+def obtenir_business_model_flux(nom_entreprise, type_entreprise, rubriques, regenerer=False):
+    """
+    Variante en flux de obtenir_business_model : produit les fragments de texte
+    HTML au fur et à mesure de leur génération par ChatGPT.
+    La concaténation des fragments (puis .strip()) donne le même HTML final.
+    Partage le cache de obtenir_business_model (un succès est produit d'un
+    bloc) et ses générations en cours.
+    """
+    prompt = construire_prompt(nom_entreprise, type_entreprise, rubriques)
+    cle = cle_cache(prompt)
+    if not regenerer:
+        html_cache = lire_cache(cle)
+        if html_cache is not None:
+            comptabiliser_usage(prompt, cache=True)
+            yield html_cache
+            return
+
+    def produire():
+        fragments = []
+        modele = fin = None
+        debut = time.perf_counter()
+        flux = appeler_chatgpt(prompt, stream=True)
+        try:
+            for morceau in flux:
+                modele = morceau.get("model", modele)
+                fin = morceau["choices"][0].get("finish_reason") or fin
+                fragment = morceau["choices"][0]["delta"].get("content")
+                if fragment:
+                    fragments.append(fragment)
+                    yield fragment
+        except GeneratorExit:
+            # Lecture abandonnée (tâche annulée) : fermer le flux arrête la
+            # génération ; les tokens déjà produits sont comptés
+            getattr(flux, "close", lambda: None)()
+            comptabiliser_usage(prompt, texte_genere="".join(fragments), modele=modele)
+            raise
+        enregistrer_etape("api", time.perf_counter() - debut)
+        html_genere = "".join(fragments).strip()
+        comptabiliser_usage(prompt, texte_genere=html_genere, modele=modele)
+        if html_genere and not reponse_tronquee(fin, "canvas_flux"):
+            ecrire_cache(cle, html_genere)
+
+    try:
+        # Demandes identiques simultanées : un seul flux, suivi par toutes
+        yield from partager_generation(cle, prompt, produire, regenerer=regenerer)
+    except Exception as e:
+        _signaler_erreur(f"Erreur lors de la génération du contenu : {e}")
+
+
+@chronometrer("prompt")
+def construire_prompt_bloc(nom_entreprise, type_entreprise, rubriques, bloc):
+    """
+    Prompt réduit demandant à ChatGPT le contenu d'un seul bloc du canvas,
+    sous forme de liste HTML (le titre du bloc est ajouté à l'assemblage).
+    Le metaprompt est réduit au rôle et au méta-prompt de ce bloc : les 9
+    demandes d'un canvas coûtent ainsi à peu près autant de tokens d'entrée
+    que la demande unique.
+    """
+    return Prompt(
+        prefixe_prompt(type_entreprise, CONSIGNES_BLOC, bloc=bloc),
+        donnees_entreprise(nom_entreprise, type_entreprise, rubriques)
+        + f"\n\nGénère uniquement le bloc « {bloc} » du Business Model Canvas."
+    )
+
+
+def generer_bloc(nom_entreprise, type_entreprise, rubriques, bloc, regenerer=False):
+    """
+    Génère le HTML d'un bloc (titre <h3> + liste). Les erreurs transitoires
+    de l'API sont retentées par appeler_chatgpt ; une réponse vide est
+    redemandée jusqu'à TENTATIVES_BLOC fois. Chaque bloc a sa propre entrée
+    de cache (et de génération partagée). Lève une exception si le bloc n'a
+    pas pu être obtenu.
+    """
+    prompt = construire_prompt_bloc(nom_entreprise, type_entreprise, rubriques, bloc)
+    cle = cle_cache(prompt)
+    if not regenerer:
+        html_cache = lire_cache(cle)
+        if html_cache is not None:
+            comptabiliser_usage(prompt, cache=True)
+            return html_cache
+
+    def produire():
+        for _ in range(TENTATIVES_BLOC):
+            response = appeler_chatgpt(prompt, max_tokens=estimer_max_tokens(1))
+            comptabiliser_usage(prompt, response=response)
+            liste = nettoyer_bloc_html(response.choices[0].message.content)
+            if liste:
+                html_bloc = f"<h3>{bloc}</h3>\n{liste}"
+                if not reponse_tronquee(response.choices[0].get("finish_reason"), "bloc"):
+                    ecrire_cache(cle, html_bloc)
+                yield html_bloc
+                return
+        raise ValueError(f"réponse vide pour le bloc « {bloc} » après {TENTATIVES_BLOC} essais")
+
+    return "".join(partager_generation(cle, prompt, produire, regenerer=regenerer))
+
+
+@chronometrer("prompt")
+def construire_prompt_regeneration_bloc(nom_entreprise, type_entreprise, rubriques, bloc, blocs, manquant=False):
+    """
+    Prompt demandant une nouvelle version d'un seul bloc (ou, avec
+    'manquant', le bloc absent d'une réponse), les autres blocs du canvas
+    étant fournis comme contexte. Le metaprompt est réduit à la phase de
+    production (METAPROMPTS_BLOC) : le canvas existant porte déjà l'analyse
+    des phases précédentes.
+    """
+    autres_blocs = {
+        autre: [MOTIF_PUCE.sub("", ligne, count=1) for ligne in blocs[autre]]
+        for autre in BLOCS_BMC if autre != bloc and blocs.get(autre)
+    }
+    if manquant:
+        consigne = f"Rédige le bloc « {bloc} », absent de ce canvas, en restant cohérent avec les autres blocs."
+    else:
+        consigne = f"Rédige une nouvelle version du bloc « {bloc} », différente de la précédente et cohérente avec les autres blocs."
+
+    return Prompt(
+        prefixe_prompt(type_entreprise, CONSIGNES_REGENERATION_BLOC, reduit=True),
+        donnees_entreprise(nom_entreprise, type_entreprise, rubriques)
+        + f"\n\nBusiness Model Canvas actuel :\n{json.dumps(autres_blocs, ensure_ascii=False)}\n\n{consigne}"
+    )
+
+
+def regenerer_bloc(nom_entreprise, type_entreprise, rubriques, bloc, blocs, manquant=False):
+    """
+    Génère une nouvelle version du bloc 'bloc' d'un canvas existant ('blocs',
+    au format de extraire_blocs) en un seul appel court, sans cache puisqu'une
+    nouvelle proposition est demandée ; avec 'manquant', rédige le bloc
+    absent de la réponse, mis en cache sur l'empreinte du prompt : un canvas
+    en cache auquel manque ce bloc reçoit, contexte identique, le même
+    complément sans nouvel appel. Retourne les lignes du bloc
+    (["- point", ...]) ; lève une exception si la réponse reste vide.
+    """
+    prompt = construire_prompt_regeneration_bloc(
+        nom_entreprise, type_entreprise, rubriques, bloc, blocs, manquant=manquant
+    )
+    cle = cle_cache(prompt)
+    if manquant:
+        lignes_cache = lire_cache(cle)
+        if lignes_cache is not None:
+            comptabiliser_usage(prompt, cache=True)
+            return json.loads(lignes_cache)
+    for _ in range(TENTATIVES_BLOC):
+        response = appeler_chatgpt(prompt, max_tokens=estimer_max_tokens(1))
+        comptabiliser_usage(prompt, response=response)
+        liste = nettoyer_bloc_html(response.choices[0].message.content)
+        lignes = extraire_blocs(f"<h3>{bloc}</h3>\n{liste}")[bloc] if liste else []
+        if lignes:
+            if manquant and not reponse_tronquee(response.choices[0].get("finish_reason"), "bloc_manquant"):
+                ecrire_cache(cle, json.dumps(lignes, ensure_ascii=False))
+            return lignes
+    raise ValueError(f"réponse vide pour le bloc « {bloc} » après {TENTATIVES_BLOC} essais")
+
+
+def completer_blocs_manquants(nom_entreprise, type_entreprise, rubriques, blocs):
+    """
+    Redemande, en parallèle et un par un, les blocs absents de 'blocs'
+    (format de extraire_blocs, complété sur place), les blocs obtenus
+    servant de contexte : seuls les blocs manquants sont payés, pas une
+    nouvelle génération complète.
+    Retourne {bloc: exception} pour les blocs toujours manquants.
+    """
+    manquants = blocs_manquants(blocs)
+    if not manquants:
+        return {}
+    logger.info("Blocs introuvables dans la réponse, redemandés seuls : %s", ", ".join(manquants))
+    contexte = dict(blocs)
+    erreurs = {}
+    with ThreadPoolExecutor(max_workers=min(WORKERS_BLOCS, len(manquants))) as executeur:
+        futures = {
+            executeur.submit(
+                contextvars.copy_context().run,
+                functools.partial(regenerer_bloc, manquant=True),
+                nom_entreprise, type_entreprise, rubriques, bloc, contexte
+            ): bloc
+            for bloc in manquants
+        }
+        for future in as_completed(futures):
+            bloc = futures[future]
+            try:
+                blocs[bloc] = future.result()
+            except Exception as e:
+                erreurs[bloc] = e
+    return erreurs
+
+
+def obtenir_business_model_parallele(nom_entreprise, type_entreprise, rubriques,
+                                     regenerer=False, sur_bloc_termine=None):
+    """
+    Génère les 9 blocs par des appels séparés exécutés dans un pool de threads
+    borné (WORKERS_BLOCS), puis les assemble dans l'ordre de BLOCS_BMC :
+    la latence totale est proche de celle du bloc le plus lent.
+    'sur_bloc_termine(bloc, html)' est appelé dans le thread appelant dès qu'un
+    bloc est prêt. Retourne (html, erreurs) où 'erreurs' associe à chaque bloc
+    en échec son exception ; les autres blocs sont conservés.
+    """
+    blocs_html = {}
+    erreurs = {}
+    with ThreadPoolExecutor(max_workers=WORKERS_BLOCS) as executeur:
+        # Chaque tâche reçoit une copie du contexte : la consommation des
+        # blocs est comptée dans la génération en cours (suivre_usage)
+        futures = {
+            executeur.submit(
+                contextvars.copy_context().run,
+                generer_bloc, nom_entreprise, type_entreprise, rubriques, bloc, regenerer
+            ): bloc
+            for bloc in BLOCS_BMC
+        }
+        for future in as_completed(futures):
+            bloc = futures[future]
+            try:
+                blocs_html[bloc] = future.result()
+            except Exception as e:
+                erreurs[bloc] = e
+                continue
+            if sur_bloc_termine:
+                sur_bloc_termine(bloc, blocs_html[bloc])
+
+    html = "\n".join(blocs_html[bloc] for bloc in BLOCS_BMC if bloc in blocs_html)
+    return html, erreurs
+
+
+@chronometrer("prompt")
+def construire_prompt_json(nom_entreprise, type_entreprise, rubriques, blocs_demandes, blocs_obtenus=None):
+    """
+    Prompt demandant les blocs 'blocs_demandes' sous forme d'objet JSON
+    {"titre du bloc": ["point", ...]}. Lors d'une relance, les blocs déjà
+    obtenus sont fournis comme contexte pour garder la cohérence du canvas.
+    """
+    schema = json.dumps({bloc: ["point 1", "point 2", "..."] for bloc in blocs_demandes},
+                        ensure_ascii=False, indent=2)
+    contexte = ""
+    if blocs_obtenus:
+        contexte = (
+            "\n\nLes blocs suivants sont déjà rédigés, reste cohérent avec eux sans les répéter :\n"
+            + json.dumps({bloc: blocs_obtenus[bloc] for bloc in BLOCS_BMC if bloc in blocs_obtenus},
+                         ensure_ascii=False)
+        )
+    return Prompt(
+        prefixe_prompt(type_entreprise, CONSIGNES_CANVAS_JSON),
+        donnees_entreprise(nom_entreprise, type_entreprise, rubriques)
+        + f"{contexte}\n\nClés demandées :\n{schema}"
+    )
+
+
+def valider_blocs_json(texte, blocs_attendus):
+    """
+    Valide une réponse JSON de ChatGPT : chaque bloc attendu doit être une
+    liste non vide de chaînes. Les clés sont reconnues comme les titres HTML
+    (numérotation et casse ignorées).
+    Retourne (blocs_valides, blocs_manquants), les points étant des chaînes.
+    """
+    try:
+        donnees = json.loads(texte)
+    except ValueError:
+        return {}, list(blocs_attendus)
+    if not isinstance(donnees, dict):
+        return {}, list(blocs_attendus)
+
+    blocs_valides = {}
+    for cle, points in donnees.items():
+        bloc = _bloc_du_titre(str(cle).strip())
+        if bloc not in blocs_attendus or not isinstance(points, list):
+            continue
+        points = [" ".join(point.split()) for point in points if isinstance(point, str) and point.strip()]
+        if points:
+            blocs_valides[bloc] = points
+    manquants = [bloc for bloc in blocs_attendus if bloc not in blocs_valides]
+    return blocs_valides, manquants
+
+
+def obtenir_business_model_json(nom_entreprise, type_entreprise, rubriques, regenerer=False):
+    """
+    Génère le canvas au format JSON (schéma fixe des 9 blocs) et valide la
+    réponse. Si des blocs manquent ou sont invalides, seuls ces blocs sont
+    redemandés (jusqu'à TENTATIVES_JSON demandes au total).
+    Retourne (blocs, manquants) : 'blocs' au format de extraire_blocs
+    ({bloc: ["- point", ...]}), sans passer par l'analyse HTML.
+    """
+    prompt = construire_prompt_json(nom_entreprise, type_entreprise, rubriques, BLOCS_BMC)
+    cle = cle_cache(prompt)
+    points = None
+    if not regenerer:
+        json_cache = lire_cache(cle)
+        if json_cache is not None:
+            comptabiliser_usage(prompt, cache=True)
+            points = json.loads(json_cache)
+
+    def produire():
+        points = {}
+        manquants = list(BLOCS_BMC)
+        prompt_tentative = prompt
+        for tentative in range(TENTATIVES_JSON):
+            if tentative > 0:
+                prompt_tentative = construire_prompt_json(nom_entreprise, type_entreprise, rubriques, manquants, points)
+            try:
+                response = appeler_chatgpt(
+                    prompt_tentative, max_tokens=estimer_max_tokens(len(manquants)), format_json=True
+                )
+            except Exception as e:
+                _signaler_erreur(f"Erreur lors de la génération du contenu : {e}")
+                break
+            comptabiliser_usage(prompt_tentative, response=response)
+            valides, manquants = valider_blocs_json(response.choices[0].message.content, manquants)
+            points.update(valides)
+            if not manquants:
+                ecrire_cache(cle, json.dumps(points, ensure_ascii=False))
+                break
+        # Blocs partiels compris : les demandes qui suivent cette génération
+        # reçoivent les mêmes blocs
+        yield json.dumps(points, ensure_ascii=False)
+
+    if points is None:
+        points = json.loads("".join(partager_generation(cle, prompt, produire, regenerer=regenerer)))
+
+    blocs = {bloc: [f"- {point}" for point in points.get(bloc, [])] for bloc in BLOCS_BMC}
+    manquants = [bloc for bloc in BLOCS_BMC if not blocs[bloc]]
+    return blocs, manquants
+
+
+def blocs_en_html(blocs):
+    """
+    Rend des blocs structurés ({bloc: [lignes]}) en HTML (titres <h3>, listes
+    à puces), pour l'affichage dans l'application.
+    """
+    parties = []
+    for bloc, lignes in blocs.items():
+        if not lignes:
+            continue
+        parties.append(f"<h3>{html_echappe(bloc)}</h3>")
+        elements = []
+        for ligne in lignes:
+            puce = MOTIF_PUCE.match(ligne)
+            if puce:
+                elements.append(f"<li>{html_echappe(ligne[puce.end():])}</li>")
+                continue
+            if elements:
+                parties.append("<ul>" + "".join(elements) + "</ul>")
+                elements = []
+            parties.append(f"<p>{html_echappe(ligne)}</p>")
+        if elements:
+            parties.append("<ul>" + "".join(elements) + "</ul>")
+    return "\n".join(parties)
+
+
+# Titre HTML complet (balise ouvrante et fermante reçues) dans un flux partiel
+MOTIF_TITRE_HTML = re.compile(r"<h[2-6]\b[^>]*>.*?</h[2-6]\s*>", re.IGNORECASE | re.DOTALL)
+
+
+def suivre_blocs_en_flux(fragments):
+    """
+    Consomme les fragments d'une génération en flux et découpe le HTML cumulé
+    en blocs du Business Model Canvas.
+    Produit des couples (html_cumule, nouveaux_blocs) : un bloc est considéré
+    terminé dès que le titre du bloc suivant est refermé ; le dernier bloc
+    est émis à la fin du flux.
+    """
+    html = ""
+    debut_bloc = None  # Position du titre du bloc en cours
+    for fragment in fragments:
+        html += fragment
+        nouveaux_blocs = []
+        # Ne rechercher qu'après le titre du bloc en cours
+        position = 0 if debut_bloc is None else debut_bloc + 1
+        for titre in MOTIF_TITRE_HTML.finditer(html, position):
+            if debut_bloc is not None:
+                nouveaux_blocs.append(nettoyer_bloc_html(html[debut_bloc:titre.start()]))
+            debut_bloc = titre.start()
+        yield html, nouveaux_blocs
+
+    if debut_bloc is not None:
+        yield html, [nettoyer_bloc_html(html[debut_bloc:])]
+
+
+def bloc_du_segment(segment):
+    """
+    Bloc du canvas d'un segment produit par suivre_blocs_en_flux, d'après son
+    titre, ou None pour un titre hors canvas (introduction, récapitulatif...).
+    """
+    titre = MOTIF_TITRE_HTML.match(segment)
+    if titre is None:
+        return None
+    return _bloc_du_titre(html_desechappe(re.sub(r"<[^>]+>", " ", titre.group())))
+
+
+def nettoyer_bloc_html(bloc):
+    """
+    Retire les délimiteurs de code Markdown (```html) que ChatGPT ajoute
+    parfois autour du HTML, pour l'affichage d'un bloc isolé.
+    """
+    return re.sub(r"```(?:html)?", "", bloc).strip()
+
+
+# ----------------------------------------------------------------------------
+# Canvas proches : index TF-IDF local et adaptation d'un canvas existant
+# ----------------------------------------------------------------------------
+# Mots sans valeur pour la similarité (formes juridiques comprises)
+MOTS_VIDES_SIMILARITE = {
+    "les", "des", "une", "pour", "par", "sur", "dans", "avec", "aux", "nos", "vos", "leur", "qui",
+    "que", "est", "sont", "pas", "plus", "tout", "tou", "cette", "ces", "son", "ses", "notre", "votre",
+    "sarl", "sas", "sasu", "eurl", "sci", "ets", "etablissement", "entreprise", "societe", "groupe",
+}
+
+
+def termes_similarite(nom_entreprise, rubriques):
+    """
+    Termes pondérés d'une demande pour l'index des canvas : mots du nom de
+    l'entreprise et des données complémentaires, normalisés comme les titres
+    (normaliser_titre), sans mots vides ni mots de moins de 3 lettres.
+    Poids TF sous-linéaire (1 + log tf) ; le nom compte double, c'est
+    souvent la seule indication de l'activité.
+    """
+    termes = {}
+    textes = [(nom_entreprise, 2.0)] + [(str(valeur or ""), 1.0) for valeur in (rubriques or {}).values()]
+    for texte, poids in textes:
+        occurrences = {}
+        for mot in normaliser_titre(texte).split():
+            if len(mot) >= 3 and mot not in MOTS_VIDES_SIMILARITE and not mot.isdigit():
+                occurrences[mot] = occurrences.get(mot, 0) + 1
+        for mot, nombre in occurrences.items():
+            termes[mot] = termes.get(mot, 0.0) + poids * (1 + math.log(nombre))
+    return termes
+
+
+@contextlib.contextmanager
+def _connexion_index_canvas():
+    """
+    Ouvre la base SQLite des canvas indexés le temps d'une transaction.
+    """
+    dossier = os.path.dirname(INDEX_CANVAS_CHEMIN)
+    if dossier:
+        os.makedirs(dossier, exist_ok=True)
+    connexion = sqlite3.connect(INDEX_CANVAS_CHEMIN, timeout=30)
+    try:
+        with connexion:
+            connexion.execute(
+                "CREATE TABLE IF NOT EXISTS canvas ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, empreinte TEXT UNIQUE, type_entreprise TEXT, "
+                "nom_entreprise TEXT, termes TEXT, blocs TEXT, cree REAL)"
+            )
+            yield connexion
+    finally:
+        connexion.close()
+
+
+class IndexCanvas:
+    """
+    Index TF-IDF en mémoire des canvas de la base INDEX_CANVAS_CHEMIN, un
+    par type d'entreprise : listes inversées compactes (array) terme ->
+    (rangs des canvas, poids). Une recherche ne parcourt que les listes des
+    termes de la demande, additionnées avec numpy : quelques millisecondes
+    pour 100 000 canvas. Seuls les identifiants et les termes sont en
+    mémoire ; les blocs sont lus dans la base pour le canvas retenu.
+    Les canvas ajoutés par d'autres processus sont chargés à la recherche
+    suivante. La norme d'un canvas est calculée avec l'IDF du moment de son
+    ajout, et recalculée pour tout l'index quand celui-ci a doublé.
+    """
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.dernier_id = 0
+        self.types = {}
+
+    @staticmethod
+    def _idf(nb_canvas, nb_avec_terme):
+        return math.log((nb_canvas + 1) / (nb_avec_terme + 1)) + 1
+
+    def _norme(self, index, termes):
+        nb_canvas = len(index["ids"])
+        return math.sqrt(sum(
+            (self._idf(nb_canvas, len(index["listes"].get(terme, ((),))[0])) * poids) ** 2
+            for terme, poids in termes.items()
+        )) or 1.0
+
+    def _recalculer_normes(self, index):
+        import numpy as np
+
+        nb_canvas = len(index["ids"])
+        carres = np.zeros(nb_canvas)
+        for rangs, poids in index["listes"].values():
+            idf = self._idf(nb_canvas, len(rangs))
+            carres[np.frombuffer(rangs, dtype=np.int64)] += (idf * np.frombuffer(poids, dtype=np.float32)) ** 2
+        index["normes"] = array("d", np.sqrt(np.maximum(carres, 1e-12)).tolist())
+        index["nb_normes"] = nb_canvas
+
+    def _rafraichir(self):
+        with _connexion_index_canvas() as connexion:
+            lignes = connexion.execute(
+                "SELECT id, type_entreprise, termes FROM canvas WHERE id > ? ORDER BY id", (self.dernier_id,)
+            ).fetchall()
+        modifies = set()
+        for identifiant, type_entreprise, termes in lignes:
+            index = self.types.setdefault(
+                type_entreprise, {"ids": array("q"), "normes": array("d"), "nb_normes": 0, "listes": {}}
+            )
+            termes = json.loads(termes)
+            rang = len(index["ids"])
+            index["ids"].append(identifiant)
+            for terme, poids in termes.items():
+                rangs, poids_liste = index["listes"].setdefault(terme, (array("q"), array("f")))
+                rangs.append(rang)
+                poids_liste.append(poids)
+            index["normes"].append(self._norme(index, termes))
+            modifies.add(type_entreprise)
+            self.dernier_id = identifiant
+        for type_entreprise in modifies:
+            index = self.types[type_entreprise]
+            if len(index["ids"]) >= 2 * index["nb_normes"]:
+                self._recalculer_normes(index)
+
+    def chercher(self, type_entreprise, termes):
+        """
+        Canvas du type 'type_entreprise' le plus proche des termes donnés
+        (termes_similarite) : (identifiant, similarité cosinus), ou None si
+        l'index de ce type est vide.
+        """
+        import numpy as np
+
+        with self.verrou:
+            self._rafraichir()
+            index = self.types.get(type_entreprise)
+            if not index or not termes:
+                return None
+            nb_canvas = len(index["ids"])
+            scores = np.zeros(nb_canvas)
+            norme = 0.0
+            for terme, poids in termes.items():
+                rangs, poids_liste = index["listes"].get(terme, ((), ()))
+                idf = self._idf(nb_canvas, len(rangs))
+                norme += (idf * poids) ** 2
+                if rangs:
+                    scores[np.frombuffer(rangs, dtype=np.int64)] += (
+                        idf * idf * poids * np.frombuffer(poids_liste, dtype=np.float32)
+                    )
+            scores /= np.frombuffer(index["normes"], dtype=np.float64) * math.sqrt(norme)
+            rang = int(np.argmax(scores))
+            return index["ids"][rang], float(scores[rang])
+
+
+def index_canvas():
+    return ressource_partagee("index_canvas", IndexCanvas)
+
+
+def empreinte_canvas(type_entreprise, termes):
+    """
+    Empreinte d'une demande dans l'index des canvas : même type et mêmes
+    termes (termes_similarite) donnent la même empreinte.
+    """
+    termes_json = json.dumps(termes, sort_keys=True)
+    return hashlib.sha256(f"{type_entreprise}\0{termes_json}".encode("utf-8")).hexdigest()
+
+
+def indexer_canvas(nom_entreprise, type_entreprise, rubriques, blocs):
+    """
+    Ajoute un canvas généré à l'index des canvas proches (une demande déjà
+    indexée, mêmes termes et même type, est ignorée).
+    """
+    termes = termes_similarite(nom_entreprise, rubriques)
+    if not termes:
+        return
+    termes_json = json.dumps(termes, sort_keys=True)
+    empreinte = empreinte_canvas(type_entreprise, termes)
+    with _connexion_index_canvas() as connexion:
+        connexion.execute(
+            "INSERT OR IGNORE INTO canvas (empreinte, type_entreprise, nom_entreprise, termes, blocs, cree) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (empreinte, type_entreprise, nom_entreprise, termes_json, json.dumps(blocs, ensure_ascii=False),
+             time.time())
+        )
+
+
+def chercher_canvas_proche(nom_entreprise, type_entreprise, rubriques, seuil=SEUIL_SIMILARITE):
+    """
+    Canvas déjà généré le plus proche de la demande, s'il atteint 'seuil' :
+    {"nom_entreprise", "blocs", "similarite"}, sinon None. Le canvas de la
+    même demande n'est pas retenu : l'adapter serait payer une seconde
+    génération du même canvas.
+    """
+    termes = termes_similarite(nom_entreprise, rubriques)
+    trouve = index_canvas().chercher(type_entreprise, termes)
+    if trouve is None or trouve[1] < seuil:
+        metriques().incrementer("bmc_canvas_proches_total", resultat="aucun")
+        return None
+    with _connexion_index_canvas() as connexion:
+        ligne = connexion.execute(
+            "SELECT nom_entreprise, blocs, empreinte FROM canvas WHERE id = ?", (trouve[0],)
+        ).fetchone()
+    if ligne is None:
+        return None
+    if ligne[2] == empreinte_canvas(type_entreprise, termes):
+        metriques().incrementer("bmc_canvas_proches_total", resultat="identique")
+        return None
+    metriques().incrementer("bmc_canvas_proches_total", resultat="trouve")
+    return {"nom_entreprise": ligne[0], "blocs": json.loads(ligne[1]), "similarite": round(trouve[1], 3)}
+
+
+CONSIGNES_ADAPTATION = """\
+Le message de l'utilisateur décrit une entreprise et fournit le Business Model Canvas d'une entreprise proche.
+Adapte ce canvas à l'entreprise décrite : conserve ce qui s'applique, corrige ce qui diffère (nom, activité,
+clientèle, localisation...) et intègre en priorité les données complémentaires fournies par l'utilisateur.
+Réponds en HTML avec les 9 blocs, chacun sous un titre <h3> (titres exacts ci-dessous) suivi d'une liste <ul>
+de 5 à 10 éléments <li>, rédigés en français, concis, sans texte avant ou après :
+""" + "\n".join(f"  - {bloc}" for bloc in BLOCS_BMC)
+
+
+@chronometrer("prompt")
+def construire_prompt_adaptation(nom_entreprise, type_entreprise, rubriques, proche):
+    """
+    Prompt demandant d'adapter le canvas d'une entreprise proche ('proche',
+    voir chercher_canvas_proche) à la demande. Le metaprompt est réduit à la
+    phase de production (METAPROMPTS_BLOC).
+    """
+    points = {
+        bloc: [MOTIF_PUCE.sub("", ligne, count=1) for ligne in proche["blocs"][bloc]]
+        for bloc in BLOCS_BMC if proche["blocs"].get(bloc)
+    }
+    return Prompt(
+        prefixe_prompt(type_entreprise, CONSIGNES_ADAPTATION, reduit=True),
+        donnees_entreprise(nom_entreprise, type_entreprise, rubriques)
+        + f"\n\nCanvas de l'entreprise proche '{proche['nom_entreprise']}' :\n"
+        + json.dumps(points, ensure_ascii=False)
+    )
+
+
+def obtenir_business_model_adapte(nom_entreprise, type_entreprise, rubriques, proche):
+    """
+    Génère le canvas en adaptant celui d'une entreprise proche (un appel,
+    réponse HTML comme obtenir_business_model). Retourne "" en cas
+    d'échec : l'appelant revient alors à une génération complète.
+    """
+    prompt = construire_prompt_adaptation(nom_entreprise, type_entreprise, rubriques, proche)
+    cle = cle_cache(prompt)
+    html_cache = lire_cache(cle)
+    if html_cache is not None:
+        comptabiliser_usage(prompt, cache=True)
+        return html_cache
+
+    def produire():
+        response = appeler_chatgpt(prompt)
+        comptabiliser_usage(prompt, response=response)
+        html_genere = nettoyer_bloc_html(response.choices[0].message.content)
+        if html_genere and not reponse_tronquee(response.choices[0].get("finish_reason"), "adaptation"):
+            ecrire_cache(cle, html_genere)
+        yield html_genere
+
+    try:
+        return "".join(partager_generation(cle, prompt, produire))
+    except Exception as e:
+        logger.warning("Adaptation du canvas de « %s » impossible : %s", proche["nom_entreprise"], e)
+        return ""
+
+# ----------------------------------------------------------------------------
+# 2) Extraction des blocs du HTML généré
+# ----------------------------------------------------------------------------
+BALISES_TITRES = ["h2", "h3", "h4", "h5", "h6"]
+
+# Intitulés acceptés pour chaque bloc (le titre de BLOCS_BMC compris) : ceux
+# du prompt, du formulaire, et les variantes courantes des réponses
+ALIAS_BLOCS = {
+    "Partenaires clés": ["Partenaires", "Partenariats clés", "Partenaires stratégiques", "Key partners"],
+    "Activités clés": ["Activités principales", "Key activities"],
+    "Offre (proposition de valeur)": ["Offre", "Proposition de valeur", "Proposition de valeur (offre)",
+                                      "Offre de valeur", "Value proposition"],
+    "Relation client": ["Relations clients", "Relation avec les clients", "Customer relationships"],
+    "Segments de clientèle": ["Segments de clients", "Segments clients", "Clientèle cible", "Customer segments"],
+    "Ressources clés": ["Ressources", "Key resources"],
+    "Canaux de distribution": ["Canaux", "Canal de distribution", "Channels"],
+    "Structure des coûts": ["Structure de coûts", "Coûts", "Cost structure"],
+    "Sources de revenus": ["Source de revenus", "Flux de revenus", "Revenus", "Revenue streams"],
+}
+
+# Mots ignorés dans la comparaison des titres
+MOTS_VIDES_TITRES = {"de", "des", "du", "d", "la", "le", "les", "l", "et", "en", "avec", "bloc"}
+
+# Ressemblance minimale (difflib) pour rattacher un titre mal orthographié
+SEUIL_TITRE_APPROCHANT = 0.85
+
+# Ligne de liste à puces ('-', '+' ou '•' suivi d'un espace)
+MOTIF_PUCE = re.compile(r"^[-+•]\s+")
+
+
+def normaliser_titre(texte):
+    """
+    Forme canonique d'un titre pour la comparaison : sans accents, casse,
+    ponctuation (« : », parenthèses...), numérotation en tête ni mots vides,
+    chaque mot au singulier approximatif ("Coûts :" -> "cout").
+    """
+    texte = unicodedata.normalize("NFKD", texte)
+    texte = "".join(caractere for caractere in texte if not unicodedata.combining(caractere)).lower()
+    mots = re.findall(r"[a-z0-9]+", texte)
+    while mots and mots[0].isdigit():
+        del mots[0]
+    mots = [mot for mot in mots if mot not in MOTS_VIDES_TITRES]
+    return " ".join(mot[:-1] if len(mot) > 3 and mot[-1] in "sx" else mot for mot in mots)
+
+
+# Index des intitulés normalisés -> bloc, calculé une fois
+INDEX_TITRES_BLOCS = {
+    normaliser_titre(alias): bloc
+    for bloc in BLOCS_BMC
+    for alias in [bloc] + ALIAS_BLOCS.get(bloc, [])
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _bloc_du_titre(texte):
+    """
+    Retourne le bloc du canvas correspondant au texte d'un titre, ou None.
+    Comparaison sur la forme normalisée (normaliser_titre) dans l'index des
+    intitulés, puis par ressemblance pour les fautes de frappe.
+    """
+    cle = normaliser_titre(texte)
+    if not cle:
+        return None
+    if cle in INDEX_TITRES_BLOCS:
+        return INDEX_TITRES_BLOCS[cle]
+    proches = difflib.get_close_matches(cle, INDEX_TITRES_BLOCS, n=1, cutoff=SEUIL_TITRE_APPROCHANT)
+    return INDEX_TITRES_BLOCS[proches[0]] if proches else None
+
+
+def _titre_en_gras(balise):
+    """
+    Texte d'un paragraphe servant de titre sans balise <hN> : tout son texte
+    est en gras (<p><strong>Coûts :</strong></p>). Retourne None sinon.
+    """
+    enfants = [enfant for enfant in balise.contents if not (isinstance(enfant, str) and not enfant.strip())]
+    if len(enfants) == 1 and getattr(enfants[0], "name", None) in ("strong", "b"):
+        return _texte_balise(enfants[0])
+    return None
+
+
+def _bloc_de_la_balise(balise):
+    """
+    Pour une balise de titre (<h2> à <h6>, ou paragraphe en gras reconnu
+    comme titre de bloc), retourne (est_un_titre, bloc ou None).
+    """
+    if balise.name in BALISES_TITRES:
+        return True, _bloc_du_titre(_texte_balise(balise))
+    texte = _titre_en_gras(balise)
+    bloc = _bloc_du_titre(texte) if texte else None
+    return bloc is not None, bloc
+
+
+def blocs_manquants(blocs):
+    """
+    Blocs de BLOCS_BMC sans contenu dans 'blocs' (format de extraire_blocs).
+    """
+    return [bloc for bloc in BLOCS_BMC if not blocs.get(bloc)]
+
+
+def _texte_balise(balise):
+    """
+    Texte d'une balise avec les espaces normalisés (les espaces autour des
+    balises en ligne comme <b> ou <a> sont conservés).
+    """
+    return " ".join(balise.get_text().split())
+
+
+@chronometrer("extraction")
+def extraire_blocs(contenu_html):
+    """
+    Découpe le HTML renvoyé par ChatGPT en blocs du Business Model Canvas,
+    en une seule passe sur le document.
+    Retourne un dictionnaire {bloc: [lignes]} avec les 9 blocs de BLOCS_BMC
+    (liste vide si le bloc est introuvable, voir blocs_manquants) : les
+    éléments de liste sont préfixés par "- ", les paragraphes sont repris
+    tels quels. Ce résultat sert de base à tous les formats de sortie.
+    Les titres sont des balises <h2> à <h6> ou des paragraphes entièrement
+    en gras, reconnus avec leurs variantes (voir _bloc_du_titre).
+    """
+    from bs4 import BeautifulSoup, NavigableString
+
+    blocs = {bloc: [] for bloc in BLOCS_BMC}
+    trouves = set()
+    soup = BeautifulSoup(contenu_html, "lxml")
+
+    # Les titres sont visités dans l'ordre du document ; le contenu d'un bloc
+    # s'arrête au titre frère suivant, chaque nœud n'est donc lu qu'une fois
+    for titre in soup.find_all(BALISES_TITRES + ["p"]):
+        _, bloc = _bloc_de_la_balise(titre)
+        if bloc is None or bloc in trouves:
+            continue
+        trouves.add(bloc)
+        lignes = blocs[bloc]
+        for frere in titre.next_siblings:
+            if isinstance(frere, NavigableString):
+                texte = frere.strip()
+                if texte:
+                    lignes.append(texte)
+            elif frere.name in BALISES_TITRES or (frere.name == "p" and _bloc_de_la_balise(frere)[0]):
+                break  # Arrêter si un nouveau header est trouvé
+            elif frere.name in ("ul", "ol"):
+                for li in frere.find_all("li"):
+                    lignes.append(f"- {_texte_balise(li)}")
+            elif frere.name == "p":
+                lignes.append(_texte_balise(frere))
+    return blocs
+
+
+# ----------------------------------------------------------------------------
+# 3) Fonction pour créer le fichier Word (format tableau) avec python-docx
+# ----------------------------------------------------------------------------
+
+# Disposition du canvas dans le tableau Word (grille standard du Business
+# Model Canvas) : (zone, ligne début, colonne début, ligne fin, colonne fin).
+# Les zones couvrant plusieurs cellules sont fusionnées.
+LIGNES_CANVAS = 5
+COLONNES_CANVAS = 5
+DISPOSITION_CANVAS = [
+    ("titre", 0, 0, 0, 4),
+    ("entreprise", 1, 0, 1, 2),
+    ("date", 1, 3, 1, 4),
+    ("Partenaires clés", 2, 0, 3, 0),
+    ("Activités clés", 2, 1, 2, 1),
+    ("Ressources clés", 3, 1, 3, 1),
+    ("Offre (proposition de valeur)", 2, 2, 3, 2),
+    ("Relation client", 2, 3, 2, 3),
+    ("Canaux de distribution", 3, 3, 3, 3),
+    ("Segments de clientèle", 2, 4, 3, 4),
+    ("Structure des coûts", 4, 0, 4, 2),
+    ("Sources de revenus", 4, 3, 4, 4),
+]
+
+
+def _construire_modele_docx():
+    """
+    Construit le document vierge du canvas : styles de base, paragraphes du
+    titre et de la date, tableau fusionné selon DISPOSITION_CANVAS et
+    alignements. Seul le texte reste à remplir.
+    """
+    from docx import Document
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.shared import Inches, Pt
+
+    # Créer un nouveau document Word
+    doc = Document()
+
+    # Définir les styles de base (hérités par tous les paragraphes, y compris
+    # ceux du tableau : inutile de reprendre chaque run ensuite)
+    style = doc.styles['Normal']
+    font = style.font
+    font.name = 'Calibri'
+    font.size = Pt(11)
+
+    # Titre principal
+    titre = doc.add_heading(level=1)
+    titre.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+    # Date
+    date_paragraph = doc.add_paragraph()
+    date_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
+
+    # Ajouter un saut de ligne
+    doc.add_paragraph("")
+
+    # Créer le tableau du canvas, puis fusionner les cellules selon la disposition
+    table = doc.add_table(rows=LIGNES_CANVAS, cols=COLONNES_CANVAS)
+    table.style = 'Table Grid'
+
+    # Ajuster les largeurs des colonnes (en pouces)
+    for col in table.columns:
+        for cell in col.cells:
+            cell.width = Inches(1.8)  # Ajustez selon vos besoins
+
+    alignements = {
+        "titre": WD_PARAGRAPH_ALIGNMENT.CENTER,
+        "entreprise": WD_PARAGRAPH_ALIGNMENT.LEFT,
+        "date": WD_PARAGRAPH_ALIGNMENT.RIGHT,
+    }
+    for zone, ligne_debut, col_debut, ligne_fin, col_fin in DISPOSITION_CANVAS:
+        cell = table.cell(ligne_debut, col_debut).merge(table.cell(ligne_fin, col_fin))
+        if zone in alignements:
+            cell.paragraphs[0].alignment = alignements[zone]
+
+    # Ajouter un saut de ligne à la fin
+    doc.add_paragraph("")
+    return doc
+
+
+def _lire_modele_docx():
+    chemin = os.environ.get("BMC_MODELE_DOCX")
+    if chemin:
+        with open(chemin, "rb") as fichier:
+            return fichier.read()
+    fichier_io = BytesIO()
+    _construire_modele_docx().save(fichier_io)
+    return fichier_io.getvalue()
+
+
+def modele_docx():
+    """
+    Octets du modèle Word du canvas, construits une seule fois par processus
+    (ressource_partagee : le modèle survit aux réexécutions du script).
+    La variable d'environnement BMC_MODELE_DOCX permet de fournir un modèle
+    personnalisé (mêmes paragraphes et même tableau que _construire_modele_docx).
+    """
+    return ressource_partagee("modele_docx", _lire_modele_docx)
+
+
+def ajouter_contenu(cell, titre, lignes, id_style_puce=None):
+    """
+    Ajoute du contenu formaté dans une cellule Word.
+    Le titre est en gras, suivi de listes à puces si nécessaire.
+    'id_style_puce' : identifiant du style 'List Bullet' déjà résolu pour ce
+    document (la recherche du style par son nom à chaque puce est coûteuse).
+    """
+    # Supprimer le texte initial (par défaut) dans la cellule
+    cell.text = ""
+
+    # Ajouter le titre en gras
+    paragraphe = cell.add_paragraph()
+    run = paragraphe.add_run(titre)
+    run.bold = True
+
+    # Ajouter le contenu, ligne par ligne
+    for ligne in lignes:
+        ligne = ligne.strip()
+        if not ligne:
+            continue
+        # Vérifier si la ligne commence par '-', '+', '•' pour une liste à puces
+        puce = MOTIF_PUCE.match(ligne)
+        if puce:
+            # Ajouter une puce
+            if id_style_puce:
+                p = cell.add_paragraph(ligne[puce.end():])
+                p._p.get_or_add_pPr().style = id_style_puce
+            else:
+                cell.add_paragraph(ligne[puce.end():], style='List Bullet')
+        else:
+            # Ajouter un paragraphe normal
+            cell.add_paragraph(ligne)
+
+
+@chronometrer("rendu_docx")
+def generer_docx_business_model(nom_entreprise, date_bmc, contenu_business_model, blocs=None, fichier=None):
+    """
+    Construit un document Word reproduisant un tableau avec la disposition souhaitée
+    pour le Business Model Canvas. La mise en forme inclut des titres en gras et
+    des listes à puces.
+    'contenu_business_model' : le contenu HTML renvoyé par ChatGPT,
+    qu'on découpe ensuite pour remplir chaque bloc.
+    'blocs' : blocs déjà structurés (mode JSON) ; le HTML n'est alors pas analysé.
+    Le document part du modèle en cache (modele_docx) : styles, fusions et
+    alignements sont déjà en place, seul le texte est ajouté.
+    'fichier' : fichier binaire ouvert où écrire le document (par défaut, un
+    BytesIO retourné positionné au début).
+    """
+    from docx import Document
+    from docx.shared import Pt
+
+    doc = Document(BytesIO(modele_docx()))
+
+    # Titre principal et date
+    titre, date_paragraph = doc.paragraphs[0], doc.paragraphs[1]
+    titre.add_run(f"Business Model Canvas de {nom_entreprise}").bold = True
+    date_paragraph.add_run(f"Date : {date_bmc}").bold = True
+
+    # Cellules du canvas : la cellule en haut à gauche de chaque zone fusionnée
+    table = doc.tables[0]
+    cellules = {
+        zone: table.cell(ligne_debut, col_debut)
+        for zone, ligne_debut, col_debut, _, _ in DISPOSITION_CANVAS
+    }
+
+    # 1) Titre du canvas
+    run = cellules["titre"].paragraphs[0].add_run(f"Business Model Canvas de {nom_entreprise}")
+    run.bold = True
+    run.font.size = Pt(14)
+
+    # 2) Nom de l'entreprise et Date
+    cellules["entreprise"].paragraphs[0].add_run(f"**Nom de l'entreprise**: {nom_entreprise}").bold = True
+    cellules["date"].paragraphs[0].add_run(f"**Date**: {date_bmc}").bold = True
+
+    # 3) Contenus des 9 blocs
+    # Découper le HTML en blocs en une seule passe
+    if blocs is None:
+        blocs = extraire_blocs(contenu_business_model)
+
+    id_style_puce = doc.styles['List Bullet'].style_id
+    for bloc in BLOCS_BMC:
+        ajouter_contenu(cellules[bloc], bloc, blocs[bloc], id_style_puce)
+
+    # Convertir le document en binaire pour téléchargement via Streamlit
+    if fichier is not None:
+        doc.save(fichier)
+        return fichier
+    fichier_io = BytesIO()
+    doc.save(fichier_io)
+    fichier_io.seek(0)
+    return fichier_io
+
+
+@chronometrer("rendu_docx")
+def mettre_a_jour_cellule_docx(docx_octets, bloc, lignes):
+    """
+    Remplace le contenu de la seule cellule du bloc 'bloc' dans un document
+    déjà généré (octets .docx) ; le reste du document est conservé tel quel.
+    Retourne les octets du document modifié.
+    """
+    from docx import Document
+
+    doc = Document(BytesIO(docx_octets))
+    ligne_debut, col_debut = next(
+        (ligne, colonne) for zone, ligne, colonne, _, _ in DISPOSITION_CANVAS if zone == bloc
+    )
+    ajouter_contenu(
+        doc.tables[0].cell(ligne_debut, col_debut), bloc, lignes, doc.styles['List Bullet'].style_id
+    )
+
+    fichier_io = BytesIO()
+    doc.save(fichier_io)
+    return fichier_io.getvalue()
+
+
+# ----------------------------------------------------------------------------
+# Autres formats d'export. Tous partent des blocs déjà extraits
+# ({bloc: [lignes]}, voir extraire_blocs) : le HTML n'est jamais réanalysé.
+# ----------------------------------------------------------------------------
+def rendu_docx(nom_entreprise, date_bmc, blocs):
+    """
+    Octets du document Word (voir generer_docx_business_model).
+    """
+    return generer_docx_business_model(nom_entreprise, date_bmc, "", blocs=blocs).getvalue()
+
+
+@chronometrer("rendu_pptx")
+def rendu_pptx(nom_entreprise, date_bmc, blocs):
+    """
+    Octets d'une présentation PowerPoint d'une diapositive : titre, date et
+    les 9 blocs dans la grille standard du canvas (DISPOSITION_CANVAS).
+    """
+    from pptx import Presentation
+    from pptx.dml.color import RGBColor
+    from pptx.enum.shapes import MSO_SHAPE
+    from pptx.enum.text import MSO_ANCHOR, MSO_AUTO_SIZE
+    from pptx.util import Inches, Pt
+
+    presentation = Presentation()
+    presentation.slide_width, presentation.slide_height = Inches(13.333), Inches(7.5)
+    diapositive = presentation.slides.add_slide(presentation.slide_layouts[6])  # Diapositive vierge
+
+    # Titre et date
+    cadre = diapositive.shapes.add_textbox(Inches(0.3), Inches(0.2), Inches(12.7), Inches(0.6)).text_frame
+    cadre.text = f"Business Model Canvas de {nom_entreprise}"
+    cadre.paragraphs[0].runs[0].font.size = Pt(24)
+    cadre.paragraphs[0].runs[0].font.bold = True
+    date_paragraphe = cadre.add_paragraph()
+    date_paragraphe.text = f"Date : {date_bmc}"
+    date_paragraphe.runs[0].font.size = Pt(12)
+
+    # Grille du canvas : les lignes 2 à 4 de DISPOSITION_CANVAS
+    gauche, haut = Inches(0.3), Inches(1.2)
+    largeur_colonne = (presentation.slide_width - 2 * gauche) // COLONNES_CANVAS
+    hauteur_ligne = (presentation.slide_height - haut - Inches(0.2)) // (LIGNES_CANVAS - 2)
+    for bloc, ligne_debut, col_debut, ligne_fin, col_fin in DISPOSITION_CANVAS:
+        if bloc not in blocs:
+            continue
+        forme = diapositive.shapes.add_shape(
+            MSO_SHAPE.RECTANGLE,
+            gauche + col_debut * largeur_colonne, haut + (ligne_debut - 2) * hauteur_ligne,
+            (col_fin - col_debut + 1) * largeur_colonne, (ligne_fin - ligne_debut + 1) * hauteur_ligne
+        )
+        forme.fill.solid()
+        forme.fill.fore_color.rgb = RGBColor(0xFF, 0xFF, 0xFF)
+        forme.line.color.rgb = RGBColor(0x40, 0x40, 0x40)
+
+        cadre = forme.text_frame
+        cadre.word_wrap = True
+        cadre.vertical_anchor = MSO_ANCHOR.TOP
+        cadre.auto_size = MSO_AUTO_SIZE.TEXT_TO_FIT_SHAPE  # Texte réduit si le bloc déborde
+        cadre.text = bloc
+        titre = cadre.paragraphs[0].runs[0].font
+        titre.bold, titre.size, titre.color.rgb = True, Pt(11), RGBColor(0, 0, 0)
+        for ligne in blocs[bloc]:
+            ligne = ligne.strip()
+            if not ligne:
+                continue
+            puce = MOTIF_PUCE.match(ligne)
+            paragraphe = cadre.add_paragraph()
+            paragraphe.text = f"• {ligne[puce.end():]}" if puce else ligne
+            police = paragraphe.runs[0].font
+            police.size, police.color.rgb = Pt(8), RGBColor(0, 0, 0)
+
+    fichier_io = BytesIO()
+    presentation.save(fichier_io)
+    return fichier_io.getvalue()
+
+
+@chronometrer("rendu_markdown")
+def rendu_markdown(nom_entreprise, date_bmc, blocs):
+    """
+    Octets (UTF-8) du canvas en Markdown : un titre de niveau 2 par bloc.
+    """
+    lignes_md = [f"# Business Model Canvas de {nom_entreprise}", "", f"Date : {date_bmc}"]
+    for bloc in BLOCS_BMC:
+        lignes_md += ["", f"## {bloc}", ""]
+        for ligne in blocs.get(bloc, []):
+            ligne = ligne.strip()
+            puce = MOTIF_PUCE.match(ligne)
+            if puce:
+                lignes_md.append(f"- {ligne[puce.end():]}")
+            elif ligne:
+                lignes_md += [ligne, ""]
+    return ("\n".join(lignes_md).rstrip() + "\n").encode("utf-8")
+
+
+@chronometrer("rendu_json")
+def rendu_json(nom_entreprise, date_bmc, blocs):
+    """
+    Octets (UTF-8) du canvas en JSON : les lignes de chaque bloc telles
+    qu'extraites (les puces commencent par "- ").
+    """
+    canvas = {
+        "nom_entreprise": nom_entreprise,
+        "date": date_bmc,
+        "blocs": {bloc: blocs.get(bloc, []) for bloc in BLOCS_BMC},
+    }
+    return json.dumps(canvas, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+# Formats d'export : clé -> (libellé, extension, type MIME, fonction de rendu).
+# Une fonction de rendu reçoit (nom_entreprise, date_bmc, blocs) et retourne
+# des octets ; ajouter un format revient à ajouter une entrée.
+FORMATS_EXPORT = {
+    "docx": ("Word", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", rendu_docx),
+    "pptx": ("PowerPoint", "pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+             rendu_pptx),
+    "md": ("Markdown", "md", "text/markdown", rendu_markdown),
+    "json": ("JSON", "json", "application/json", rendu_json),
+}
+
+
+def exporter_canvas(format_export, nom_entreprise, date_bmc, blocs):
+    """
+    Rend le canvas dans le format 'format_export' (clé de FORMATS_EXPORT).
+    """
+    return FORMATS_EXPORT[format_export][3](nom_entreprise, date_bmc, blocs)
+
+
+def nom_fichier_canvas(nom_entreprise, extension):
+    """
+    Nom de fichier d'un canvas exporté : BMC_<nom de l'entreprise>.<extension>.
+    """
+    base = re.sub(r"[^\w-]+", "_", nom_entreprise).strip("_")
+    return f"BMC_{base}.{extension}"
+
+
+def ecrire_archive_zip(canvas, destination, format_export="docx"):
+    """
+    Écrit dans 'destination' (chemin, ou fichier binaire ouvert, même non
+    positionnable) une archive ZIP d'un document par canvas, au fil de
+    l'itérable 'canvas' : chaque document est rendu en mémoire, ajouté à
+    l'archive puis libéré, un seul document à la fois.
+    Chaque élément de 'canvas' est un dictionnaire : nom_entreprise,
+    date_bmc, blocs et, facultativement, nom_fichier.
+    Retourne le nombre de documents archivés.
+    """
+    _, extension, _, _ = FORMATS_EXPORT[format_export]
+    # Les formats Office sont déjà compressés : inutile de les recompresser
+    compression = zipfile.ZIP_STORED if extension in ("docx", "pptx") else zipfile.ZIP_DEFLATED
+    noms = set()
+    with zipfile.ZipFile(destination, "w", compression=compression) as archive:
+        for element in canvas:
+            nom_fichier = element.get("nom_fichier") or nom_fichier_canvas(element["nom_entreprise"], extension)
+            base, numero = nom_fichier, 2
+            while nom_fichier in noms:
+                nom_fichier = f"{base.rsplit('.', 1)[0]}_{numero}.{extension}"
+                numero += 1
+            noms.add(nom_fichier)
+
+            if format_export == "docx":
+                document = generer_docx_business_model(
+                    element["nom_entreprise"], element["date_bmc"], "", blocs=element["blocs"]
+                ).getvalue()
+            else:
+                document = exporter_canvas(format_export, element["nom_entreprise"], element["date_bmc"], element["blocs"])
+            archive.writestr(nom_fichier, document)
+    return len(noms)
+
+
+# ----------------------------------------------------------------------------
+# 4) File de tâches de génération (SQLite) et pool de threads de travail
+# ----------------------------------------------------------------------------
+MODE_FLUX = "Affichage progressif"
+MODE_PARALLELE = "Parallèle (un appel par bloc)"
+MODE_STANDARD = "Réponse unique"
+MODE_JSON = "JSON structuré (validé)"
+
+# Modes servis par l'adaptation d'un canvas proche (réponse HTML en un
+# appel) ; les modes parallèle et JSON génèrent toujours le canvas
+MODES_ADAPTATION = (MODE_STANDARD, MODE_FLUX)
+
+
+def generer_canvas(nom_entreprise, type_entreprise, rubriques, mode, regenerer=False, sur_progression=None):
+    """
+    Génère un canvas selon le mode choisi (MODE_*).
+    'sur_progression(html, nb_blocs)' est appelé à chaque bloc terminé avec
+    le HTML des blocs déjà prêts (modes flux et parallèle).
+    Dans les modes MODES_ADAPTATION, sauf avec 'regenerer' ou si la demande
+    elle-même est en cache, une demande proche d'un canvas déjà généré
+    (chercher_canvas_proche) est servie en adaptant ce canvas, d'un seul
+    bloc ; les générations complètes alimentent l'index des canvas.
+    Retourne (contenu_bmc, blocs, avertissements) : 'contenu_bmc' est vide en
+    cas d'échec, 'avertissements' associe un message à chaque bloc manquant.
+    """
+    avertissements = {}
+    blocs = None
+    proche = None
+    if (REUTILISER_CANVAS_PROCHES and not regenerer and mode in MODES_ADAPTATION
+            and lire_cache(cle_cache(construire_prompt(nom_entreprise, type_entreprise, rubriques)),
+                           compter=False) is None):
+        try:
+            proche = chercher_canvas_proche(nom_entreprise, type_entreprise, rubriques)
+        except sqlite3.Error as e:
+            logger.warning("Index des canvas inaccessible : %s", e)
+    contenu_bmc = obtenir_business_model_adapte(nom_entreprise, type_entreprise, rubriques, proche) if proche else ""
+    if contenu_bmc:
+        usage = _usage_courant.get()
+        if usage is not None:
+            usage["canvas_proche"] = {"nom_entreprise": proche["nom_entreprise"], "similarite": proche["similarite"]}
+        if sur_progression:
+            sur_progression(contenu_bmc, len(BLOCS_BMC))
+    elif mode == MODE_FLUX:
+        html_cumule = ""
+        termines = []
+        # Seuls les titres des blocs du canvas comptent dans l'avancement
+        # (pas l'introduction ni un éventuel récapitulatif)
+        blocs_termines = set()
+        fragments = obtenir_business_model_flux(nom_entreprise, type_entreprise, rubriques, regenerer=regenerer)
+        for html_cumule, nouveaux_blocs in suivre_blocs_en_flux(fragments):
+            termines.extend(nouveaux_blocs)
+            blocs_termines.update(filter(None, map(bloc_du_segment, nouveaux_blocs)))
+            if nouveaux_blocs and sur_progression:
+                sur_progression("\n".join(termines), len(blocs_termines))
+        contenu_bmc = html_cumule.strip()
+    elif mode == MODE_PARALLELE:
+        termines = {}
+
+        def bloc_termine(bloc, html):
+            termines[bloc] = html
+            if sur_progression:
+                sur_progression("\n".join(termines[b] for b in BLOCS_BMC if b in termines), len(termines))
+
+        contenu_bmc, erreurs = obtenir_business_model_parallele(
+            nom_entreprise, type_entreprise, rubriques, regenerer=regenerer, sur_bloc_termine=bloc_termine
+        )
+        for bloc, erreur in erreurs.items():
+            avertissements[bloc] = f"Le bloc « {bloc} » n'a pas pu être généré : {erreur}"
+    elif mode == MODE_JSON:
+        # Blocs déjà structurés : pas d'analyse HTML pour le document Word
+        blocs, manquants = obtenir_business_model_json(
+            nom_entreprise, type_entreprise, rubriques, regenerer=regenerer
+        )
+        contenu_bmc = blocs_en_html(blocs)
+        for bloc in manquants:
+            avertissements[bloc] = f"Le bloc « {bloc} » n'a pas été obtenu après {TENTATIVES_JSON} demandes"
+    else:
+        contenu_bmc = obtenir_business_model(nom_entreprise, type_entreprise, rubriques, regenerer=regenerer)
+
+    if contenu_bmc and blocs is None:
+        blocs = extraire_blocs(contenu_bmc)
+        # Réponse complète dont certains titres sont introuvables : ne
+        # redemander que ces blocs
+        if COMPLETER_BLOCS_MANQUANTS and (proche or mode in (MODE_FLUX, MODE_STANDARD)):
+            avant = set(blocs_manquants(blocs))
+            erreurs = completer_blocs_manquants(nom_entreprise, type_entreprise, rubriques, blocs)
+            completes = {bloc: blocs[bloc] for bloc in BLOCS_BMC if bloc in avant and bloc not in erreurs}
+            if completes:
+                contenu_bmc += "\n" + blocs_en_html(completes)
+                if sur_progression:
+                    sur_progression(contenu_bmc, len(BLOCS_BMC) - len(erreurs))
+            for bloc, erreur in erreurs.items():
+                avertissements[bloc] = f"Le bloc « {bloc} » est absent de la réponse et n'a pas pu être redemandé : {erreur}"
+
+    # Seuls les canvas complets issus d'une génération complète servent de
+    # modèle : adapter une adaptation éloignerait peu à peu du contenu d'origine
+    if contenu_bmc and not proche and not blocs_manquants(blocs):
+        try:
+            indexer_canvas(nom_entreprise, type_entreprise, rubriques, blocs)
+        except sqlite3.Error as e:
+            logger.warning("Canvas non indexé : %s", e)
+    return contenu_bmc, blocs, avertissements
+
+
+@contextlib.contextmanager
+def _connexion_taches():
+    """
+    Ouvre la base SQLite de la file de tâches le temps d'une transaction.
+    """
+    dossier = os.path.dirname(TACHES_CHEMIN)
+    if dossier:
+        os.makedirs(dossier, exist_ok=True)
+    connexion = sqlite3.connect(TACHES_CHEMIN, timeout=30)
+    connexion.row_factory = sqlite3.Row
+    try:
+        with connexion:
+            connexion.execute(
+                "CREATE TABLE IF NOT EXISTS taches ("
+                "id TEXT PRIMARY KEY, statut TEXT, parametres TEXT, progression INTEGER DEFAULT 0, "
+                "html_partiel TEXT DEFAULT '', resultat TEXT, erreur TEXT, tentatives INTEGER DEFAULT 0, "
+                "travailleur TEXT, bail REAL, cree REAL, debut REAL, fin REAL, "
+                "utilisateur TEXT DEFAULT '', tokens INTEGER DEFAULT 0, anticipee INTEGER DEFAULT 0, "
+                "generations INTEGER DEFAULT 1)"
+            )
+            # Base créée avant les quotas par utilisateur
+            colonnes = {colonne[1] for colonne in connexion.execute("PRAGMA table_info(taches)")}
+            for colonne, definition in (("utilisateur", "TEXT DEFAULT ''"), ("tokens", "INTEGER DEFAULT 0"),
+                                        ("anticipee", "INTEGER DEFAULT 0"), ("generations", "INTEGER DEFAULT 1")):
+                if colonne not in colonnes:
+                    try:
+                        connexion.execute(f"ALTER TABLE taches ADD COLUMN {colonne} {definition}")
+                    except sqlite3.OperationalError:
+                        pass  # Ajoutée entre-temps par un autre processus
+            connexion.execute("CREATE INDEX IF NOT EXISTS taches_statut ON taches (statut, cree)")
+            connexion.execute("CREATE INDEX IF NOT EXISTS taches_utilisateur ON taches (utilisateur, statut)")
+            yield connexion
+    finally:
+        connexion.close()
+
+
+class QuotaDepasse(Exception):
+    """
+    Quota journalier de l'utilisateur atteint (QUOTA_GENERATIONS_JOUR ou
+    QUOTA_TOKENS_JOUR) : la génération n'est pas ajoutée à la file.
+    """
+
+
+def _consommation_jour(connexion, utilisateur):
+    """
+    Générations soumises (hors échecs et générations anticipées annulées
+    avant de démarrer) et tokens consommés depuis minuit par 'utilisateur',
+    régénérations de blocs comprises (tokens seulement).
+    """
+    minuit = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+    generations, tokens = connexion.execute(
+        "SELECT COALESCE(SUM(generations), 0), COALESCE(SUM(tokens), 0) FROM taches "
+        "WHERE utilisateur = ? AND cree >= ? AND statut != 'echec' "
+        "AND NOT (statut = 'annulee' AND debut IS NULL)",
+        (utilisateur, minuit)
+    ).fetchone()
+    return generations, tokens
+
+
+def _verifier_quota(connexion, utilisateur):
+    generations, tokens = _consommation_jour(connexion, utilisateur)
+    if QUOTA_GENERATIONS_JOUR and generations >= QUOTA_GENERATIONS_JOUR:
+        raise QuotaDepasse(f"quota de {QUOTA_GENERATIONS_JOUR} générations par jour atteint")
+    if QUOTA_TOKENS_JOUR and tokens >= QUOTA_TOKENS_JOUR:
+        raise QuotaDepasse(f"quota de {QUOTA_TOKENS_JOUR} tokens par jour atteint")
+
+
+def verifier_quota(utilisateur):
+    """
+    Lève QuotaDepasse si 'utilisateur' a atteint son quota du jour (appels
+    faits hors de la file, comme la régénération d'un bloc).
+    """
+    if utilisateur:
+        with _connexion_taches() as connexion:
+            _verifier_quota(connexion, utilisateur)
+
+
+def enregistrer_consommation(utilisateur, usage, mode):
+    """
+    Ajoute au décompte du jour de 'utilisateur' les tokens d'appels faits
+    hors de la file ('usage' : relevé de suivre_usage), sous forme d'une
+    tâche terminée qui ne compte pas comme une génération.
+    """
+    tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+    if not utilisateur or not tokens:
+        return
+    maintenant = time.time()
+    with _connexion_taches() as connexion:
+        connexion.execute(
+            "INSERT INTO taches (id, statut, parametres, cree, debut, fin, utilisateur, tokens, generations) "
+            "VALUES (?, 'terminee', ?, ?, ?, ?, ?, ?, 0)",
+            (uuid.uuid4().hex, json.dumps({"mode": mode, "utilisateur": utilisateur}, ensure_ascii=False),
+             maintenant, maintenant, maintenant, utilisateur, tokens)
+        )
+
+
+def quota_restant(utilisateur):
+    """
+    Retourne (générations, tokens) encore disponibles aujourd'hui pour
+    'utilisateur' ; None pour un quota illimité.
+    """
+    if not QUOTA_GENERATIONS_JOUR and not QUOTA_TOKENS_JOUR:
+        return None, None
+    with _connexion_taches() as connexion:
+        generations, tokens = _consommation_jour(connexion, utilisateur)
+    return (
+        max(0, QUOTA_GENERATIONS_JOUR - generations) if QUOTA_GENERATIONS_JOUR else None,
+        max(0, QUOTA_TOKENS_JOUR - tokens) if QUOTA_TOKENS_JOUR else None,
+    )
+
+
+def soumettre_tache(nom_entreprise, type_entreprise, rubriques, mode, regenerer=False, utilisateur="",
+                    anticipee=False):
+    """
+    Ajoute une génération à la file et retourne l'identifiant de la tâche.
+    Une génération 'anticipee' ne passe qu'après les demandes explicites
+    (voir adopter_tache). Lève QuotaDepasse si 'utilisateur' a atteint son
+    quota du jour.
+    """
+    identifiant = uuid.uuid4().hex
+    parametres = {
+        "nom_entreprise": nom_entreprise,
+        "type_entreprise": type_entreprise,
+        "rubriques": rubriques,
+        "mode": mode,
+        "regenerer": regenerer,
+        "utilisateur": utilisateur,
+    }
+    with _connexion_taches() as connexion:
+        # Vérification et ajout dans la même transaction : deux demandes
+        # simultanées ne peuvent pas dépasser ensemble le quota
+        connexion.execute("BEGIN IMMEDIATE")
+        if utilisateur:
+            _verifier_quota(connexion, utilisateur)
+        connexion.execute(
+            "INSERT INTO taches (id, statut, parametres, cree, utilisateur, anticipee) "
+            "VALUES (?, 'en_attente', ?, ?, ?, ?)",
+            (identifiant, json.dumps(parametres, ensure_ascii=False), time.time(), utilisateur, int(anticipee))
+        )
+    return identifiant
+
+
+def adopter_tache(identifiant):
+    """
+    Transforme une génération anticipée en demande explicite (priorité
+    normale dans la file). Retourne False si elle a été annulée ou a échoué :
+    il faut alors soumettre une nouvelle tâche.
+    """
+    with _connexion_taches() as connexion:
+        return connexion.execute(
+            "UPDATE taches SET anticipee = 0 WHERE id = ? AND statut IN ('en_attente', 'en_cours', 'terminee')",
+            (identifiant,)
+        ).rowcount > 0
+
+
+def annuler_tache(identifiant):
+    """
+    Annule une tâche en attente (elle ne démarrera pas) ou en cours : la
+    génération en cours s'arrête au prochain bloc ou fragment
+    (verifier_annulation), sauf si d'autres demandes identiques la suivent
+    (partager_generation) ; elle va alors à son terme, mais son résultat
+    n'est pas enregistré dans la tâche et reste disponible dans le cache.
+    """
+    with _connexion_taches() as connexion:
+        connexion.execute(
+            "UPDATE taches SET statut = 'annulee', fin = ?, html_partiel = '' "
+            "WHERE id = ? AND statut IN ('en_attente', 'en_cours')",
+            (time.time(), identifiant)
+        )
+
+
+def prendre_tache(travailleur):
+    """
+    Attribue à 'travailleur' une tâche en attente (ou dont le bail a expiré)
+    et retourne (identifiant, parametres), ou None si la file est vide.
+    L'ordonnancement est équitable entre utilisateurs : la tâche choisie est
+    la plus ancienne de l'utilisateur qui a le moins de tâches en cours, si
+    bien qu'un utilisateur qui soumet beaucoup de générations n'occupe pas
+    tous les travailleurs au détriment des autres. Les générations
+    anticipées passent après les demandes explicites.
+    L'attribution est conditionnelle : deux travailleurs, même dans des
+    processus différents, ne peuvent pas prendre la même tâche.
+    """
+    while True:
+        maintenant = time.time()
+        with _connexion_taches() as connexion:
+            ligne = connexion.execute(
+                "SELECT id, parametres, tentatives, statut FROM taches AS t "
+                "WHERE statut = 'en_attente' OR (statut = 'en_cours' AND bail < ?) "
+                "ORDER BY anticipee, (SELECT COUNT(*) FROM taches AS e WHERE e.utilisateur = t.utilisateur "
+                "AND e.statut = 'en_cours' AND e.bail >= ?), cree LIMIT 1",
+                (maintenant, maintenant)
+            ).fetchone()
+            if ligne is None:
+                return None
+            if ligne["tentatives"] >= TENTATIVES_TACHE:
+                connexion.execute(
+                    "UPDATE taches SET statut = 'echec', erreur = ?, fin = ? WHERE id = ? AND statut = ?",
+                    (f"abandonnée après {ligne['tentatives']} tentative(s) interrompue(s)",
+                     maintenant, ligne["id"], ligne["statut"])
+                )
+                continue
+            prise = connexion.execute(
+                "UPDATE taches SET statut = 'en_cours', travailleur = ?, bail = ?, debut = ?, "
+                "tentatives = tentatives + 1 "
+                "WHERE id = ? AND (statut = 'en_attente' OR (statut = 'en_cours' AND bail < ?))",
+                (travailleur, maintenant + BAIL_TACHE, maintenant, ligne["id"], maintenant)
+            ).rowcount
+        if prise:
+            return ligne["id"], json.loads(ligne["parametres"])
+
+
+def progresser_tache(identifiant, nb_blocs, html_partiel):
+    """
+    Enregistre l'avancement d'une tâche (blocs terminés et HTML déjà prêt).
+    """
+    with _connexion_taches() as connexion:
+        connexion.execute(
+            "UPDATE taches SET progression = ?, html_partiel = ? WHERE id = ? AND statut = 'en_cours'",
+            (nb_blocs, html_partiel, identifiant)
+        )
+
+
+def prolonger_baux(travailleur, identifiants):
+    """
+    Prolonge le bail des tâches en cours de 'travailleur'.
+    """
+    if not identifiants:
+        return
+    with _connexion_taches() as connexion:
+        connexion.executemany(
+            "UPDATE taches SET bail = ? WHERE id = ? AND travailleur = ? AND statut = 'en_cours'",
+            [(time.time() + BAIL_TACHE, identifiant, travailleur) for identifiant in identifiants]
+        )
+
+
+def terminer_tache(identifiant, resultat=None, erreur=None):
+    """
+    Enregistre le résultat (tâche terminée) ou l'erreur (tâche en échec),
+    ainsi que les tokens consommés (quota QUOTA_TOKENS_JOUR). Une tâche
+    annulée pendant son exécution le reste (seuls les tokens sont comptés).
+    """
+    usage = (resultat or {}).get("usage") or {}
+    tokens = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    with _connexion_taches() as connexion:
+        connexion.execute(
+            "UPDATE taches SET statut = ?, resultat = ?, erreur = ?, fin = ?, html_partiel = '', tokens = ? "
+            "WHERE id = ? AND statut = 'en_cours'",
+            ("echec" if erreur else "terminee",
+             None if resultat is None else json.dumps(resultat, ensure_ascii=False),
+             erreur, time.time(), tokens, identifiant)
+        )
+        connexion.execute("UPDATE taches SET tokens = ? WHERE id = ? AND statut = 'annulee'", (tokens, identifiant))
+
+
+def etat_tache(identifiant):
+    """
+    Retourne l'état d'une tâche (statut, progression, HTML partiel, résultat
+    ou erreur, et position estimée dans la file si elle est en attente), ou
+    None si la tâche est inconnue.
+    """
+    with _connexion_taches() as connexion:
+        ligne = connexion.execute("SELECT * FROM taches WHERE id = ?", (identifiant,)).fetchone()
+        if ligne is None:
+            return None
+        tache = dict(ligne)
+        tache["parametres"] = json.loads(tache["parametres"])
+        tache["resultat"] = json.loads(tache["resultat"]) if tache["resultat"] else None
+        if tache["statut"] == "en_attente":
+            # Ordonnancement équitable : chaque autre utilisateur passe au
+            # plus une tâche de plus que celles de cet utilisateur déjà en
+            # attente
+            avant = connexion.execute(
+                "SELECT COUNT(*) FROM taches WHERE statut = 'en_attente' AND utilisateur = ? AND anticipee = ? "
+                "AND cree < ?",
+                (tache["utilisateur"], tache["anticipee"], tache["cree"])
+            ).fetchone()[0]
+            autres = connexion.execute(
+                "SELECT COUNT(*) FROM taches WHERE statut = 'en_attente' AND utilisateur != ? AND anticipee = ? "
+                "GROUP BY utilisateur",
+                (tache["utilisateur"], tache["anticipee"])
+            ).fetchall()
+            # Les générations anticipées passent après toutes les demandes
+            # explicites et ne retardent pas celles-ci
+            prioritaires = connexion.execute(
+                "SELECT COUNT(*) FROM taches WHERE statut = 'en_attente' AND anticipee < ?", (tache["anticipee"],)
+            ).fetchone()[0]
+            tache["position"] = prioritaires + avant + sum(min(nombre, avant + 1) for (nombre,) in autres)
+    return tache
+
+
+def purger_taches(age=TACHES_TTL):
+    """
+    Supprime les tâches terminées, en échec ou annulées depuis plus de 'age'
+    secondes.
+    """
+    with _connexion_taches() as connexion:
+        connexion.execute(
+            "DELETE FROM taches WHERE statut IN ('terminee', 'echec', 'annulee') AND fin < ?",
+            (time.time() - age,)
+        )
+
+
+def executer_tache(identifiant, parametres):
+    """
+    Exécute une génération de la file et retourne son résultat (contenu,
+    blocs, avertissements, consommation). L'avancement est enregistré bloc
+    par bloc pour l'affichage progressif dans l'application. Si la tâche est
+    annulée pendant la génération, celle-ci s'arrête (verifier_annulation) et
+    seule la consommation déjà engagée est retournée.
+    """
+    jeton = _annulation_courante.set({"tache": identifiant, "prochaine": 0.0})
+    try:
+        with suivre_usage(parametres["nom_entreprise"], parametres["type_entreprise"], parametres["mode"],
+                          utilisateur=parametres.get("utilisateur")) as usage:
+            try:
+                contenu_bmc, blocs, avertissements = generer_canvas(
+                    parametres["nom_entreprise"], parametres["type_entreprise"], parametres["rubriques"],
+                    parametres["mode"], regenerer=parametres["regenerer"],
+                    sur_progression=lambda html, nb_blocs: progresser_tache(identifiant, nb_blocs, html)
+                )
+            except GenerationAnnulee:
+                logger.info("Tâche %s annulée : génération interrompue", identifiant)
+                metriques().incrementer("bmc_generations_interrompues_total")
+                annulee = True
+            else:
+                annulee = False
+    finally:
+        _annulation_courante.reset(jeton)
+    if annulee:
+        return {"usage": usage}
+    if not contenu_bmc:
+        raise RuntimeError("génération vide (voir le journal pour l'erreur de l'API)")
+    return {"contenu_bmc": contenu_bmc, "blocs": blocs, "avertissements": avertissements, "usage": usage}
+
+
+class TravailleursTaches:
+    """
+    Pool de threads de travail d'un processus : chaque thread prend la tâche
+    en attente la plus ancienne, l'exécute puis enregistre son résultat. Un
+    thread de veille prolonge le bail des tâches en cours et réécrit les
+    métriques ; si le processus s'arrête, ses tâches sont reprises par un
+    autre travailleur (ou par ce même pool au redémarrage) une fois le bail
+    expiré.
+    Le débit est ainsi borné par les limites de l'API (SeauJetons) et par
+    'nombre', et non par le nombre de threads de Streamlit.
+    """
+
+    def __init__(self, nombre=WORKERS_TACHES):
+        self.identifiant = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.en_cours = set()
+        self.verrou = threading.Lock()
+        purger_taches()
+        purger_verrous()
+        for numero in range(nombre):
+            threading.Thread(target=self._boucle, name=f"tache-bmc-{numero}", daemon=True).start()
+        threading.Thread(target=self._veille, name="tache-bmc-veille", daemon=True).start()
+
+    def _boucle(self):
+        while True:
+            try:
+                tache = prendre_tache(self.identifiant)
+            except sqlite3.Error as e:
+                logger.warning("File de tâches inaccessible : %s", e)
+                tache = None
+            if tache is None:
+                time.sleep(INTERVALLE_SONDAGE)
+                continue
+
+            identifiant, parametres = tache
+            with self.verrou:
+                self.en_cours.add(identifiant)
+            try:
+                terminer_tache(identifiant, resultat=executer_tache(identifiant, parametres))
+            except Exception as e:
+                logger.exception("Tâche %s en échec", identifiant)
+                terminer_tache(identifiant, erreur=str(e))
+            finally:
+                with self.verrou:
+                    self.en_cours.discard(identifiant)
+
+    def _veille(self):
+        while True:
+            time.sleep(BAIL_TACHE / 3)
+            with self.verrou:
+                identifiants = list(self.en_cours)
+            try:
+                prolonger_baux(self.identifiant, identifiants)
+            except sqlite3.Error as e:
+                logger.warning("Bail des tâches non prolongé : %s", e)
+            ecrire_metriques()  # Durées de rendu observées depuis la dernière génération
+
+
+def demarrer_travailleurs():
+    """
+    Démarre (une seule fois par processus) le pool de threads de travail.
+    """
+    return ressource_partagee("travailleurs_taches", TravailleursTaches)
+
+# ----------------------------------------------------------------------------
+# 5) Application Streamlit
+# ----------------------------------------------------------------------------
+def export_session(resultat, format_export, date_bmc):
+    """
+    Octets de l'export 'format_export' d'une génération conservée en session,
+    rendus à la première demande puis conservés (par format et par date) :
+    changer de format ou retélécharger ne refait aucun rendu.
+    """
+    cle = (format_export, date_bmc)
+    if cle not in resultat["exports"]:
+        resultat["exports"][cle] = exporter_canvas(
+            format_export, resultat["nom_entreprise"], date_bmc, resultat["blocs"]
+        )
+    return resultat["exports"][cle]
+
+
+def regenerer_bloc_session(resultat, bloc, utilisateur=""):
+    """
+    Régénère un bloc d'une génération conservée en session et ne met à jour
+    que ce bloc : lignes, HTML affiché et cellule des documents Word déjà
+    produits (les autres exports, peu coûteux, seront refaits à la demande).
+    L'appel, fait hors de la file, est soumis au quota de 'utilisateur' et
+    ses tokens y sont décomptés (QuotaDepasse si le quota est atteint).
+    Retourne la consommation de l'opération (suivre_usage).
+    """
+    verifier_quota(utilisateur)
+    with suivre_usage(resultat["nom_entreprise"], resultat["type_entreprise"], "bloc",
+                      utilisateur=utilisateur) as usage:
+        try:
+            lignes = regenerer_bloc(
+                resultat["nom_entreprise"], resultat["type_entreprise"], resultat["rubriques"],
+                bloc, resultat["blocs"]
+            )
+        finally:
+            # Tokens des essais en échec compris
+            enregistrer_consommation(utilisateur, usage, "bloc")
+    resultat["blocs"][bloc] = lignes
+    resultat["contenu_bmc"] = blocs_en_html(resultat["blocs"])
+    resultat["exports"] = {
+        (format_export, date): mettre_a_jour_cellule_docx(octets, bloc, lignes)
+        for (format_export, date), octets in resultat["exports"].items() if format_export == "docx"
+    }
+    resultat["avertissements"].pop(bloc, None)
+    resultat["usage"] = usage
+    return usage
+
+
+def suivre_tache(identifiant):
+    """
+    Affiche l'avancement d'une tâche de génération (position dans la file,
+    blocs terminés) et relance le script tant qu'elle n'est pas finie :
+    après INTERVALLE_SONDAGE secondes si elle a avancé depuis le sondage
+    précédent, sinon après un intervalle 1,5 fois plus long (au plus
+    INTERVALLE_SONDAGE_MAX), pour qu'une longue attente dans la file ne
+    réexécute pas le script chaque seconde. Une tâche terminée devient la
+    génération conservée en session (st.session_state["bmc"]).
+    """
+    import streamlit as st
+
+    demarrer_travailleurs()  # Reprise des tâches après un redémarrage du serveur
+    tache = etat_tache(identifiant)
+    if tache is None or tache["statut"] in ("terminee", "echec", "annulee"):
+        del st.session_state["tache"]
+        st.session_state.pop("sondage", None)
+    if tache is None or tache["statut"] == "annulee":
+        return
+    if tache["statut"] == "echec":
+        st.error(f"Erreur lors de la génération du contenu : {tache['erreur']}. Veuillez réessayer.")
+        return
+    if tache["statut"] == "terminee":
+        parametres, resultat = tache["parametres"], tache["resultat"]
+        st.session_state["bmc"] = resultat = {
+            "nom_entreprise": parametres["nom_entreprise"],
+            "type_entreprise": parametres["type_entreprise"],
+            "rubriques": parametres["rubriques"],
+            "contenu_bmc": resultat["contenu_bmc"],
+            "blocs": resultat["blocs"],
+            "usage": resultat["usage"],
+            "avertissements": resultat["avertissements"],
+            "exports": {},
+        }
+        # Toutes les générations de la session, pour l'archive ZIP
+        st.session_state.setdefault("historique", []).append(resultat)
+        return
+
+    if tache["statut"] == "en_attente":
+        st.info(f"Génération en attente ({tache['position']} demande(s) avant la vôtre)...")
+    else:
+        progression = min(tache["progression"], len(BLOCS_BMC))
+        st.progress(
+            progression / len(BLOCS_BMC),
+            text=f"Génération en cours... {progression} bloc(s) sur {len(BLOCS_BMC)}"
+        )
+    if tache["html_partiel"]:
+        st.subheader("Contenu Généré par ChatGPT")
+        st.markdown(tache["html_partiel"], unsafe_allow_html=True)
+
+    avancement = (tache["statut"], tache.get("position"), tache["progression"])
+    sondage = st.session_state.get("sondage")
+    if sondage is None or sondage["avancement"] != avancement:
+        intervalle = INTERVALLE_SONDAGE
+    else:
+        intervalle = min(sondage["intervalle"] * 1.5, INTERVALLE_SONDAGE_MAX)
+    st.session_state["sondage"] = {"avancement": avancement, "intervalle": intervalle}
+    time.sleep(intervalle)
+    st.experimental_rerun()
+
+
+def signature_demande(nom_entreprise, type_entreprise, rubriques, mode, regenerer):
+    """
+    Empreinte d'une saisie complète (rubriques sous forme canonique) : deux
+    saisies équivalentes ont la même signature.
+    """
+    return hashlib.sha256(json.dumps(
+        [" ".join(nom_entreprise.split()), type_entreprise, canoniser_rubriques(rubriques), mode, regenerer],
+        ensure_ascii=False
+    ).encode("utf-8")).hexdigest()
+
+
+def anticiper_generation(parametres, formulaire_valide, active, utilisateur):
+    """
+    Génération anticipée : à la validation du formulaire ('formulaire_valide'),
+    soumet la génération de 'parametres' (nom, type, rubriques, mode,
+    regénération) en priorité basse ; dès que la saisie change, ou que
+    l'option est décochée, l'annule. La tâche est conservée dans
+    st.session_state["anticipation"] avec la signature de la saisie.
+    """
+    import streamlit as st
+
+    signature = signature_demande(*parametres)
+    anticipation = st.session_state.get("anticipation")
+    if anticipation and (anticipation["signature"] != signature or not active):
+        annuler_tache(anticipation["tache"])
+        metriques().incrementer("bmc_generations_anticipees_total", resultat="annulee")
+        del st.session_state["anticipation"]
+        anticipation = None
+    if active and formulaire_valide and anticipation is None:
+        demarrer_travailleurs()
+        try:
+            tache = soumettre_tache(*parametres, utilisateur=utilisateur, anticipee=True)
+        except QuotaDepasse:
+            return  # Signalé au clic sur « Générer »
+        metriques().incrementer("bmc_generations_anticipees_total", resultat="soumise")
+        st.session_state["anticipation"] = {"signature": signature, "tache": tache}
+
+
+def reprendre_anticipation(parametres):
+    """
+    Au clic sur « Générer » : retourne la tâche anticipée pour cette même
+    saisie (terminée ou en cours), passée en priorité normale, ou None.
+    """
+    import streamlit as st
+
+    anticipation = st.session_state.pop("anticipation", None)
+    if anticipation is None:
+        return None
+    if anticipation["signature"] == signature_demande(*parametres) and adopter_tache(anticipation["tache"]):
+        metriques().incrementer("bmc_generations_anticipees_total", resultat="adoptee")
+        return anticipation["tache"]
+    annuler_tache(anticipation["tache"])
+    return None
+
+
+def identifiant_utilisateur():
+    """
+    Identifiant de l'utilisateur pour les quotas et l'ordonnancement de la
+    file : en-tête ENTETE_UTILISATEUR posé par un proxy d'authentification,
+    sinon un identifiant propre à la session Streamlit.
+    """
+    import streamlit as st
+    from streamlit.web.server.websocket_headers import _get_websocket_headers
+
+    utilisateur = (_get_websocket_headers() or {}).get(ENTETE_UTILISATEUR)
+    if utilisateur:
+        return utilisateur
+    return st.session_state.setdefault("utilisateur", f"session:{uuid.uuid4().hex}")
+
+
+def afficher_resultat(resultat, date_bmc, utilisateur=""):
+    """
+    Affiche une génération conservée en session : consommation, téléchargement
+    et contenu. Seule la régénération d'un bloc, à la demande de
+    'utilisateur', appelle ChatGPT.
+    """
+    import streamlit as st
+
+    st.success(f"Business Model Canvas de {resultat['nom_entreprise']} généré avec succès !")
+
+    # Régénérer un seul bloc, les autres servant de contexte
+    colonne_bloc, colonne_bouton = st.columns([3, 1])
+    bloc = colonne_bloc.selectbox("Bloc à régénérer", BLOCS_BMC, label_visibility="collapsed")
+    if colonne_bouton.button("Régénérer ce bloc"):
+        with st.spinner(f"Régénération du bloc « {bloc} »..."):
+            try:
+                regenerer_bloc_session(resultat, bloc, utilisateur)
+            except QuotaDepasse as e:
+                st.warning(f"Régénération refusée : {e}. Réessayez demain.")
+            except Exception as e:
+                st.error(f"Le bloc « {bloc} » n'a pas pu être régénéré : {e}")
+
+    for avertissement in resultat["avertissements"].values():
+        st.warning(avertissement)
+    usage = resultat["usage"]
+    st.caption(
+        f"Consommation : {usage['prompt_tokens']} tokens d'entrée, {usage['completion_tokens']} tokens "
+        f"de sortie{' (estimés)' if usage['estime'] else ''}, {usage['appels']} appel(s) à l'API, "
+        f"{usage['duree']:.1f} s, environ {usage['cout_usd']:.3f} $"
+    )
+    if usage.get("canvas_proche"):
+        st.caption(
+            f"Canvas adapté de celui de « {usage['canvas_proche']['nom_entreprise']} » "
+            f"(similarité {usage['canvas_proche']['similarite']:.2f}) ; cochez « Forcer une nouvelle génération » "
+            f"pour une génération complète."
+        )
+    stats = statistiques_cache()
+    st.caption(
+        f"Cache : {stats['hits']} réutilisation(s), {stats['misses']} génération(s), "
+        f"{stats['entrees']} entrée(s) ({stats['taille'] / 1024:.0f} Ko)"
+    )
+
+    # Proposer le téléchargement dans le format choisi
+    format_export = st.selectbox(
+        "Format d'export", list(FORMATS_EXPORT), format_func=lambda cle: FORMATS_EXPORT[cle][0],
+        key="format_export"
+    )
+    libelle, extension, mime, _ = FORMATS_EXPORT[format_export]
+    st.download_button(
+        label=f"Télécharger le Business Model Canvas ({libelle})",
+        data=export_session(resultat, format_export, date_bmc),
+        file_name=nom_fichier_canvas(resultat["nom_entreprise"], extension),
+        mime=mime
+    )
+
+    # Afficher le contenu généré pour vérification
+    st.subheader("Contenu Généré par ChatGPT")
+    st.markdown(resultat["contenu_bmc"], unsafe_allow_html=True)
+
+
+def afficher_archive_session(historique, date_bmc):
+    """
+    Propose le téléchargement en un seul ZIP de tous les canvas générés dans
+    la session (format choisi pour l'export unitaire). L'archive est
+    conservée en session et refaite seulement si un canvas, le format ou la
+    date a changé. st.download_button reçoit des octets : Streamlit garde de
+    toute façon le fichier téléchargé entier en mémoire.
+    """
+    import streamlit as st
+
+    format_export = st.session_state.get("format_export", "docx")
+    libelle, _, _, _ = FORMATS_EXPORT[format_export]
+    cle = (format_export, date_bmc, hashlib.sha256(
+        "\0".join(resultat["contenu_bmc"] for resultat in historique).encode("utf-8")
+    ).hexdigest())
+
+    archive = st.session_state.get("archive")
+    if archive is None or archive["cle"] != cle:
+        fichier = BytesIO()
+        ecrire_archive_zip(
+            ({"nom_entreprise": resultat["nom_entreprise"], "date_bmc": date_bmc, "blocs": resultat["blocs"]}
+             for resultat in historique),
+            fichier, format_export
+        )
+        archive = st.session_state["archive"] = {"cle": cle, "octets": fichier.getvalue()}
+
+    st.download_button(
+        label=f"Télécharger les {len(historique)} canvas de la session ({libelle}, ZIP)",
+        data=archive["octets"],
+        file_name="BMC_session.zip",
+        mime="application/zip"
+    )
+
+
+def main():
+    import streamlit as st
+
+    st.markdown(hide_streamlit_style, unsafe_allow_html=True)
+    st.title("Générateur de Business Model Canvas")
+    st.write(
+        "Cette application génère automatiquement un Business Model Canvas (format Word) "
+        "en se basant sur le nom et le type de votre entreprise, via ChatGPT."
+    )
+    
+        # Champs de saisie
+    nom_entreprise = st.text_input("Nom de l'entreprise", value="COIFFURE MOBILE S.a.r.l")
+    type_entreprise = st.selectbox("Type d'entreprise", ["PME", "Startup", "Autre"])
+    date_bmc = st.date_input("Date du BMC", value=datetime.date.today())
+    
+     # Formulaire pour les 9 rubriques du BMC
+        # Variable pour contrôler l'état global des expanders
+    expand_all = st.checkbox("Étendre / Réduire tout le formulaire", value=False)
+
+    # Formulaire pour les 9 rubriques du BMC
+    st.header("Informations Complémentaires pour le Business Model Canvas")
+
+    with st.form("form_rubriques"):
+        st.write("Veuillez remplir les informations pour chaque rubrique du Business Model Canvas.")
+
+        with st.expander("Partenaires clés", expanded=expand_all):
+            st.markdown("""
+            **Partenaires clés :**  
+            Identifiez les organisations ou individus essentiels à votre activité. Par exemple :  
+            - Fournisseurs  
+            - Banques ou institutions financières  
+            - Partenaires stratégiques  
+            - Associations ou gouvernements locaux  
+            """)
+            partenaire_cles = st.text_area("Listez vos principaux partenaires.", key="partenaires_cles")
+
+        with st.expander("Activités clés", expanded=expand_all):
+            st.markdown("""
+            **Activités clés :**  
+            Décrivez les tâches ou processus les plus importants pour exécuter votre modèle économique. Par exemple :  
+            - Fabrication de produits  
+            - Marketing et vente  
+            - Recherche et développement  
+            - Gestion des relations avec les clients  
+            """)
+            activites_cles = st.text_area("Décrivez vos activités principales.", key="activites_cles")
+
+        with st.expander("Offre (proposition de valeur)", expanded=expand_all):
+            st.markdown("""
+            **Proposition de valeur :**  
+            Expliquez ce que vous offrez à vos clients et ce qui vous différencie de vos concurrents. Par exemple :  
+            - Résolution d'un problème spécifique  
+            - Amélioration d'un besoin existant  
+            - Caractéristiques uniques de vos produits ou services  
+            """)
+            offre_valeur = st.text_area("Décrivez votre proposition de valeur.", key="offre_valeur")
+
+        with st.expander("Relation client", expanded=expand_all):
+            st.markdown("""
+            **Relation client :**  
+            Décrivez comment vous interagissez avec vos clients. Par exemple :  
+            - Assistance personnalisée  
+            - Automatisation des services (chatbots, self-service)  
+            - Programmes de fidélisation  
+            """)
+            relation_client = st.text_area("Décrivez comment vous gérez vos relations clients.", key="relation_client")
+
+        with st.expander("Segments de clientèle", expanded=expand_all):
+            st.markdown("""
+            **Segments de clientèle :**  
+            Identifiez vos différents groupes de clients cibles. Par exemple :  
+            - Particuliers (par revenus, âge, localisation)  
+            - Entreprises (par secteur ou taille)  
+            - Marchés de niche  
+            """)
+            segments_clientele = st.text_area("Définissez vos segments de clientèle.", key="segments_clientele")
+
+        with st.expander("Ressources clés", expanded=expand_all):
+            st.markdown("""
+            **Ressources clés :**  
+            Listez les ressources nécessaires pour exécuter vos activités. Par exemple :  
+            - Ressources physiques (locaux, machines)  
+            - Ressources humaines (compétences clés, équipes)  
+            - Ressources financières (fonds, prêts)  
+            """)
+            ressources_cles = st.text_area("Listez vos ressources principales.", key="ressources_cles")
+
+        with st.expander("Canaux de distribution", expanded=expand_all):
+            st.markdown("""
+            **Canaux de distribution :**  
+            Décrivez comment vos produits ou services atteignent vos clients. Par exemple :  
+            - Boutiques physiques  
+            - Plateformes en ligne  
+            - Distributeurs tiers  
+            """)
+            canaux_distribution = st.text_area("Décrivez vos canaux de distribution.", key="canaux_distribution")
+
+        with st.expander("Structure de coûts", expanded=expand_all):
+            st.markdown("""
+            **Structure de coûts :**  
+            Énumérez les principaux coûts liés à votre activité. Par exemple :  
+            - Coûts de production  
+            - Salaires et charges sociales  
+            - Dépenses marketing et publicitaires  
+            """)
+        
+            structure_couts = st.text_area("Décrivez votre structure de coûts.", key="structure_couts")
+
+        with st.expander("Sources de revenus", expanded=expand_all):
+            st.markdown("""
+            **Sources de revenus :**  
+            Décrivez comment vous générez des revenus. Par exemple :  
+            - Vente de produits ou services  
+            - Abonnements  
+            - Publicité ou partenariats  
+            """)
+            sources_revenus = st.text_area("Décrivez vos sources de revenus.", key="sources_revenus")
+
+        submit_form = st.form_submit_button("Valider les Informations")
+             # Récupérer les informations du formulaire
+        if submit_form:
+                # Récupérer les informations du formulaire
+            rubriques = {
+                "Partenaires clés": partenaire_cles,
                 "Activités clés": activites_cles,
                 "Offre (proposition de valeur)": offre_valeur,
                 "Relation client": relation_client,
@@ -887,36 +3946,101 @@ def main():
                 "Canaux de distribution": canaux_distribution,
                 "Structure de coûts": structure_couts,
                 "Sources de revenus": sources_revenus
-             }
-            print(rubriques)
-            # 1) Obtenir le contenu textuel via ChatGPT
-            contenu_bmc = obtenir_business_model(nom_entreprise, type_entreprise, rubriques)
-            
-
-            if not contenu_bmc:
-                st.error("Erreur lors de la génération du contenu. Veuillez réessayer.")
-                return
+                }
+        else:
+                # Si le formulaire n'est pas soumis, utiliser des valeurs vides
+            rubriques = {
+                "Partenaires clés": "",
+                "Activités clés": "",
+                "Offre (proposition de valeur)": "",
+                "Relation client": "",
+                "Segments de clientèle": "",
+                "Ressources clés": "",
+                "Canaux de distribution": "",
+                "Structure de coûts": "",
+                "Sources de revenus": ""
+                }    
 
-            # 2) Générer le document Word en mémoire
-            docx_bytes = generer_docx_business_model(
-                nom_entreprise=nom_entreprise,
-                date_bmc=date_bmc.strftime("%d %B %Y"),
-                contenu_business_model=contenu_bmc
-            )
 
-        st.success("Business Model Canvas généré avec succès !")
 
-        # Proposer le téléchargement du document Word
-        st.download_button(
-            label="Télécharger le Business Model Canvas (Word)",
-            data=docx_bytes,
-            file_name=f"BMC_{nom_entreprise.replace(' ', '_')}.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        )
+    # Mode de génération : réponse en flux (affichage progressif), un appel
+    # par bloc en parallèle, ou réponse unique
+    mode_generation = st.radio(
+        "Mode de génération",
+        [MODE_FLUX, MODE_PARALLELE, MODE_STANDARD, MODE_JSON],
+        help="Le mode parallèle génère chaque bloc séparément : plus rapide, "
+             "et un bloc en échec n'entraîne pas la perte des autres. "
+             "Le mode JSON valide la réponse et ne redemande que les blocs manquants. "
+             "En réponse unique et en affichage progressif, une demande proche d'un canvas déjà "
+             "généré est servie en adaptant ce canvas (affiché d'un seul bloc)."
+    )
+    # Contourner le cache pour obtenir une nouvelle proposition de ChatGPT
+    regenerer = st.checkbox("Forcer une nouvelle génération (ignorer le cache)", value=False)
+    anticiper = st.checkbox(
+        "Préparer la génération dès la validation du formulaire", value=GENERATION_ANTICIPEE,
+        help="La génération démarre en arrière-plan à la validation des informations : le clic sur "
+             "« Générer » est alors souvent servi immédiatement. Elle est annulée si la saisie change."
+    )
 
-        # Optionnel : Afficher le contenu généré pour vérification
-        st.subheader("Contenu Généré par ChatGPT")
-        st.markdown(contenu_bmc, unsafe_allow_html=True)
+    utilisateur = identifiant_utilisateur()
+    rubriques = {
+        "Partenaires clés": partenaire_cles,
+        "Activités clés": activites_cles,
+        "Offre (proposition de valeur)": offre_valeur,
+        "Relation client": relation_client,
+        "Segments de clientèle": segments_clientele,
+        "Ressources clés": ressources_cles,
+        "Canaux de distribution": canaux_distribution,
+        "Structure de coûts": structure_couts,
+        "Sources de revenus": sources_revenus
+    }
+    parametres = (nom_entreprise, type_entreprise, rubriques, mode_generation, regenerer)
+    anticiper_generation(parametres, submit_form, anticiper, utilisateur)
+    # Pendant le suivi d'une tâche, le script est relancé à chaque sondage :
+    # le quota n'est pas relu (et suivre_tache interrompt l'exécution avant
+    # les panneaux du résultat, du cache et de la consommation)
+    generations_restantes = tokens_restants = None
+    if "tache" not in st.session_state:
+        generations_restantes, tokens_restants = quota_restant(utilisateur)
+    if generations_restantes is not None or tokens_restants is not None:
+        st.caption("Quota du jour : " + ", ".join(
+            texte for texte in (
+                None if generations_restantes is None else f"{generations_restantes} génération(s)",
+                None if tokens_restants is None else f"{tokens_restants} tokens",
+            ) if texte
+        ) + " restant(s)")
+
+    # Bouton pour générer : la génération est confiée à la file de tâches,
+    # le script ne fait ensuite que suivre son avancement
+    if st.button("Générer le Business Model Canvas"):
+        demarrer_travailleurs()
+        # Génération anticipée de la même saisie : déjà terminée ou en cours
+        tache = reprendre_anticipation(parametres)
+        try:
+            st.session_state["tache"] = tache or soumettre_tache(*parametres, utilisateur=utilisateur)
+            st.session_state.pop("bmc", None)
+        except QuotaDepasse as e:
+            st.warning(f"Génération refusée : {e}. Réessayez demain.")
+
+    # Génération en cours : afficher son avancement (jusqu'au résultat)
+    if "tache" in st.session_state:
+        suivre_tache(st.session_state["tache"])
+
+    # Dernière génération de la session (conservée entre les réexécutions)
+    if "bmc" in st.session_state:
+        afficher_resultat(st.session_state["bmc"], date_bmc.strftime("%d %B %Y"), utilisateur)
+
+    # Plusieurs canvas générés dans la session : archive ZIP de l'ensemble
+    if len(st.session_state.get("historique", [])) > 1:
+        afficher_archive_session(st.session_state["historique"], date_bmc.strftime("%d %B %Y"))
+
+    # Suivi de la consommation par type d'entreprise (journal JOURNAL_USAGE)
+    with st.expander("Consommation par type d'entreprise"):
+        resume = resumer_usage()
+        if resume:
+            st.table(resume)
+        else:
+            st.write("Aucune génération enregistrée.")
 
 # Point d'entrée
 if __name__ == "__main__":
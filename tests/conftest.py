@@ -0,0 +1,70 @@
+"""
+Configuration commune des tests : fichiers de l'application (cache, file de
+tâches, journaux, index, verrous) dans un dossier temporaire propre à chaque
+test, ressources partagées du processus recréées, et API OpenAI remplacée par
+le rejeu local de benchmarks/llm_rejeu.py (fixture 'rejeu').
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RACINE, os.path.join(RACINE, "benchmarks")]
+
+import llm_rejeu  # noqa: E402
+import modelbusiness  # noqa: E402
+
+FICHIERS = {
+    "CACHE_CHEMIN": "generations.sqlite3",
+    "JOURNAL_USAGE": "usage.jsonl",
+    "METRIQUES_CHEMIN": "metriques.prom",
+    "TACHES_CHEMIN": "taches.sqlite3",
+    "INDEX_CANVAS_CHEMIN": "canvas.sqlite3",
+    "VERROUS_CHEMIN": "verrous",
+}
+
+
+@pytest.fixture(autouse=True)
+def dossier_bmc(tmp_path, monkeypatch):
+    """
+    Isole chaque test : fichiers dans 'tmp_path', pas de limite de débit ni
+    de quota, registre des ressources partagées vide.
+    """
+    for nom, fichier in FICHIERS.items():
+        monkeypatch.setattr(modelbusiness, nom, str(tmp_path / fichier))
+    monkeypatch.setattr(modelbusiness, "LIMITE_REQUETES_MINUTE", 0)
+    monkeypatch.setattr(modelbusiness, "LIMITE_TOKENS_MINUTE", 0)
+    monkeypatch.setattr(modelbusiness, "QUOTA_GENERATIONS_JOUR", 0)
+    monkeypatch.setattr(modelbusiness, "QUOTA_TOKENS_JOUR", 0)
+    monkeypatch.setattr(modelbusiness._registre, "objets", {})
+    return tmp_path
+
+
+class RejeuCompte:
+    """
+    Rejeu local qui compte les appels à l'API simulée.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.appels = 0
+        self.verrou = threading.Lock()
+
+    def creer(self, **options):
+        with self.verrou:
+            self.appels += 1
+        return self.llm.creer(**options)
+
+
+@pytest.fixture
+def rejeu():
+    """
+    API OpenAI remplacée par le rejeu des réponses enregistrées (sans
+    latence) ; rejeu.appels compte les appels.
+    """
+    compteur = RejeuCompte(llm_rejeu.LLMRejoue())
+    modelbusiness.definir_backend_llm(compteur.creer)
+    yield compteur
+    modelbusiness.definir_backend_llm()
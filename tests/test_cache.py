@@ -0,0 +1,59 @@
+"""
+Cache des générations : décompte des réutilisations et des générations,
+générations simultanées partagées.
+"""
+import threading
+
+import llm_rejeu
+import modelbusiness
+
+
+def test_compteurs_du_cache(rejeu):
+    assert modelbusiness.obtenir_business_model("Atelier Dupont", "PME", {})
+    assert modelbusiness.obtenir_business_model("Atelier Dupont", "PME", {})
+
+    stats = modelbusiness.statistiques_cache()
+    assert (stats["hits"], stats["misses"], stats["entrees"]) == (1, 1, 1)
+    assert rejeu.appels == 1
+
+
+def test_lecture_non_comptee(rejeu):
+    modelbusiness.obtenir_business_model("Atelier Dupont", "PME", {})
+    cle = modelbusiness.cle_cache(modelbusiness.construire_prompt("Atelier Dupont", "PME", {}))
+    assert modelbusiness.lire_cache(cle, compter=False) is not None
+    assert modelbusiness.lire_cache("absente", compter=False) is None
+
+    stats = modelbusiness.statistiques_cache()
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+
+
+def test_regeneration_sans_lecture_du_cache(rejeu):
+    modelbusiness.obtenir_business_model("Atelier Dupont", "PME", {})
+    modelbusiness.obtenir_business_model("Atelier Dupont", "PME", {}, regenerer=True)
+
+    stats = modelbusiness.statistiques_cache()
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+    assert rejeu.appels == 2
+
+
+def test_demandes_simultanees_partagees(rejeu):
+    rejeu.llm = llm_rejeu.LLMRejoue(latence=0.5)
+    depart = threading.Barrier(8)
+    resultats = []
+
+    def demander():
+        depart.wait()
+        resultats.append(modelbusiness.obtenir_business_model("Atelier Dupont", "PME", {}))
+
+    threads = [threading.Thread(target=demander) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert rejeu.appels == 1
+    assert len(set(resultats)) == 1 and resultats[0]
+    # Une lecture du cache par demande ; la relecture du meneur sous le
+    # verrou n'est pas comptée
+    stats = modelbusiness.statistiques_cache()
+    assert stats["hits"] + stats["misses"] == 8
@@ -0,0 +1,52 @@
+"""
+Export Word : mise à jour d'une seule cellule après la régénération d'un bloc.
+"""
+from io import BytesIO
+
+import modelbusiness
+from modelbusiness import BLOCS_BMC, DISPOSITION_CANVAS
+
+DATE = "18 octobre 2026"
+
+
+def textes_cellules(octets):
+    from docx import Document
+
+    table = Document(BytesIO(octets)).tables[0]
+    return {zone: table.cell(ligne, colonne).text for zone, ligne, colonne, _, _ in DISPOSITION_CANVAS}
+
+
+def test_mise_a_jour_d_une_seule_cellule():
+    blocs = {bloc: [f"- {bloc} : point {numero}" for numero in range(3)] for bloc in BLOCS_BMC}
+    octets = modelbusiness.generer_docx_business_model("Atelier Dupont", DATE, "", blocs=blocs).getvalue()
+
+    modifie = modelbusiness.mettre_a_jour_cellule_docx(octets, "Relation client", ["- Nouveau point"])
+
+    avant, apres = textes_cellules(octets), textes_cellules(modifie)
+    assert "Nouveau point" in apres["Relation client"]
+    assert "Relation client : point 0" not in apres["Relation client"]
+    assert {zone: texte for zone, texte in apres.items() if zone != "Relation client"} == \
+        {zone: texte for zone, texte in avant.items() if zone != "Relation client"}
+
+
+def test_regeneration_d_un_bloc_en_session(rejeu):
+    html, erreurs = modelbusiness.obtenir_business_model_parallele("Atelier Dupont", "PME", {})
+    assert not erreurs
+    blocs = modelbusiness.extraire_blocs(html)
+    octets = modelbusiness.generer_docx_business_model("Atelier Dupont", DATE, "", blocs=blocs).getvalue()
+    resultat = {
+        "nom_entreprise": "Atelier Dupont", "type_entreprise": "PME", "rubriques": {},
+        "contenu_bmc": html, "blocs": {bloc: list(lignes) for bloc, lignes in blocs.items()},
+        "avertissements": {}, "usage": {}, "exports": {("docx", DATE): octets},
+    }
+    appels = rejeu.appels
+
+    modelbusiness.regenerer_bloc_session(resultat, "Relation client", utilisateur="alice")
+
+    assert rejeu.appels == appels + 1
+    # Cellule du document en session identique à un rendu complet du canvas mis à jour
+    attendu = modelbusiness.generer_docx_business_model("Atelier Dupont", DATE, "", blocs=resultat["blocs"])
+    assert textes_cellules(resultat["exports"][("docx", DATE)]) == textes_cellules(attendu.getvalue())
+    # Tokens de l'appel décomptés du quota de l'utilisateur
+    with modelbusiness._connexion_taches() as connexion:
+        assert modelbusiness._consommation_jour(connexion, "alice")[1] > 0
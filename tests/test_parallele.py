@@ -0,0 +1,39 @@
+"""
+Mode parallèle : budget de tokens des demandes par bloc.
+"""
+import pytest
+
+import modelbusiness
+from modelbusiness import BLOCS_BMC
+
+
+@pytest.mark.parametrize("type_entreprise", ["PME", "Startup"])
+def test_prompts_des_blocs_proches_de_la_demande_unique(type_entreprise):
+    unique = modelbusiness.tokens_prompt(modelbusiness.construire_prompt("Atelier Dupont", type_entreprise, {}))
+    par_bloc = [
+        modelbusiness.tokens_prompt(modelbusiness.construire_prompt_bloc("Atelier Dupont", type_entreprise, {}, bloc))
+        for bloc in BLOCS_BMC
+    ]
+    assert sum(par_bloc) <= 2 * unique
+    # Chaque bloc ne reçoit que son propre méta-prompt
+    assert max(par_bloc) < unique / 3
+
+
+def test_prefixe_d_un_bloc_limite_a_son_meta_prompt():
+    systeme = modelbusiness.construire_prompt_bloc("Atelier Dupont", "PME", {}, "Canaux de distribution").systeme
+    assert "Canaux de Distribution" in systeme
+    assert "Structure de Coûts" not in systeme
+    assert "Phase 1" not in systeme
+
+
+def test_generation_parallele_consomme_autant_que_la_demande_unique(rejeu):
+    with modelbusiness.suivre_usage("Atelier Dupont", "PME", "parallele") as parallele:
+        html, erreurs = modelbusiness.obtenir_business_model_parallele("Atelier Dupont", "PME", {})
+    assert not erreurs
+    assert not modelbusiness.blocs_manquants(modelbusiness.extraire_blocs(html))
+
+    with modelbusiness.suivre_usage("Atelier Martin", "PME", "standard") as standard:
+        assert modelbusiness.obtenir_business_model("Atelier Martin", "PME", {})
+
+    assert rejeu.appels == len(BLOCS_BMC) + 1
+    assert parallele["prompt_tokens"] <= 2 * standard["prompt_tokens"]
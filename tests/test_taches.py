@@ -0,0 +1,87 @@
+"""
+File de tâches : bail et reprise, quotas journaliers, position dans la file.
+"""
+import time
+
+import pytest
+
+import modelbusiness
+from modelbusiness import MODE_STANDARD, QuotaDepasse
+
+DEMANDE = ("Atelier Dupont", "PME", {}, MODE_STANDARD)
+
+
+def expirer_bail(identifiant):
+    with modelbusiness._connexion_taches() as connexion:
+        connexion.execute("UPDATE taches SET bail = ? WHERE id = ?", (time.time() - 1, identifiant))
+
+
+def test_bail_et_reprise():
+    tache = modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")
+    assert modelbusiness.prendre_tache("travailleur-1")[0] == tache
+    # Bail en cours : personne d'autre ne prend la tâche
+    assert modelbusiness.prendre_tache("travailleur-2") is None
+
+    modelbusiness.prolonger_baux("travailleur-1", [tache])
+    assert modelbusiness.prendre_tache("travailleur-2") is None
+
+    # Bail expiré (processus arrêté) : la tâche est reprise
+    expirer_bail(tache)
+    assert modelbusiness.prendre_tache("travailleur-2")[0] == tache
+    assert modelbusiness.etat_tache(tache)["travailleur"] == "travailleur-2"
+
+    # Au-delà de TENTATIVES_TACHE, elle est abandonnée
+    expirer_bail(tache)
+    assert modelbusiness.prendre_tache("travailleur-3") is None
+    assert modelbusiness.etat_tache(tache)["statut"] == "echec"
+
+
+def test_position_sans_les_anticipations_des_autres():
+    anticipees = [modelbusiness.soumettre_tache(*DEMANDE, utilisateur=nom, anticipee=True) for nom in ("bob", "carole")]
+    explicite = modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")
+
+    assert modelbusiness.etat_tache(explicite)["position"] == 0
+    assert modelbusiness.etat_tache(anticipees[0])["position"] >= 1
+    assert modelbusiness.prendre_tache("travailleur-1")[0] == explicite
+
+
+def test_ordonnancement_equitable():
+    anticipee = modelbusiness.soumettre_tache(*DEMANDE, utilisateur="bob", anticipee=True)
+    alice = [modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice") for _ in range(3)]
+    carole = modelbusiness.soumettre_tache(*DEMANDE, utilisateur="carole")
+
+    # Alice a déjà une tâche en cours : Carole passe avant ses suivantes,
+    # l'anticipation passe en dernier
+    ordre = [modelbusiness.prendre_tache(f"travailleur-{numero}")[0] for numero in range(5)]
+    assert ordre == [alice[0], carole, alice[1], alice[2], anticipee]
+
+
+def test_quota_de_generations(monkeypatch):
+    monkeypatch.setattr(modelbusiness, "QUOTA_GENERATIONS_JOUR", 2)
+    premiere = modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")
+    modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")
+    with pytest.raises(QuotaDepasse):
+        modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")
+    assert modelbusiness.quota_restant("alice") == (0, None)
+
+    # Quota propre à chaque utilisateur
+    modelbusiness.soumettre_tache(*DEMANDE, utilisateur="bob")
+
+    # Une tâche annulée avant de démarrer ne compte pas
+    modelbusiness.annuler_tache(premiere)
+    modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")
+
+
+def test_quota_de_tokens_des_regenerations_de_bloc(monkeypatch):
+    monkeypatch.setattr(modelbusiness, "QUOTA_GENERATIONS_JOUR", 1)
+    monkeypatch.setattr(modelbusiness, "QUOTA_TOKENS_JOUR", 100)
+    modelbusiness.enregistrer_consommation("alice", {"prompt_tokens": 60, "completion_tokens": 30}, "bloc")
+    # Tokens décomptés, mais pas de génération consommée
+    assert modelbusiness.quota_restant("alice") == (1, 10)
+    modelbusiness.verifier_quota("alice")
+
+    modelbusiness.enregistrer_consommation("alice", {"prompt_tokens": 10, "completion_tokens": 0}, "bloc")
+    with pytest.raises(QuotaDepasse):
+        modelbusiness.verifier_quota("alice")
+    with pytest.raises(QuotaDepasse):
+        modelbusiness.soumettre_tache(*DEMANDE, utilisateur="alice")